@@ -35,12 +35,15 @@ upgrade_plugin_data()
 
 # 在此处使用 get_driver() 防止多进程生成图片时反复调用
 
-from .utils import CommandBegin
+from .utils import CommandBegin, HttpClientManager, NotificationOutbox
 from nonebot import init
 from nonebot import get_driver
 
 init()  # 初始化Driver对象
 get_driver().on_startup(CommandBegin.set_command_begin)
+get_driver().on_shutdown(HttpClientManager.close_all)
+get_driver().on_shutdown(NotificationOutbox.close)
+get_driver().on_bot_connect(NotificationOutbox.restore)
 
 # 加载命令
 
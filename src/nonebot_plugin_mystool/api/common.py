@@ -1,19 +1,23 @@
+import asyncio
+import json
+import threading
 import time
-from typing import List, Optional, Tuple, Dict, Any, Union, Type
+from email.utils import parsedate_to_datetime
+from typing import List, Optional, Tuple, Dict, Any, Union, Type, Callable, Awaitable, Hashable, TypeVar
 from urllib.parse import urlencode
 
 import httpx
 import tenacity
-from pydantic import ValidationError, BaseModel
+from pydantic import ValidationError
 from requests.utils import dict_from_cookiejar
 
 from ..model import GameRecord, GameInfo, Good, Address, BaseApiStatus, MmtData, GeetestResult, \
     GetCookieStatus, \
     CreateMobileCaptchaStatus, GetGoodDetailStatus, ExchangeStatus, GeetestResultV4, GenshinNote, GenshinNoteStatus, \
     GetFpStatus, StarRailNoteStatus, StarRailNote, UserAccount, BBSCookies, ExchangePlan, ExchangeResult, plugin_env, \
-    plugin_config
+    plugin_config, json_loads
 from ..utils import generate_device_id, logger, generate_ds, \
-    get_async_retry, generate_seed_id, generate_fp_locally
+    get_async_retry, generate_seed_id, generate_fp_locally, HttpClientManager, SingleFlight
 
 URL_LOGIN_TICKET_BY_CAPTCHA = "https://webapi.account.mihoyo.com/Api/login_by_mobilecaptcha"
 URL_LOGIN_TICKET_BY_PASSWORD = "https://webapi.account.mihoyo.com/Api/login_by_password"
@@ -318,36 +322,50 @@ def is_incorrect_return(exception: Exception, *addition_exceptions: Type[Excepti
     return isinstance(exception, exceptions) or isinstance(exception.__cause__, exceptions)
 
 
-class ApiResultHandler(BaseModel):
+class ApiResultHandler:
     """
     API返回的数据处理器
+
+    每个请求的返回都会创建一个对象，因此不使用 pydantic 模型，只在创建时读取状态码和消息内容
     """
-    content: Dict[str, Any]
-    """API返回的JSON对象序列化以后的Dict对象"""
-    data: Optional[Dict[str, Any]]
-    """API返回的数据体"""
-    message: Optional[str]
-    """API返回的消息内容"""
-    retcode: Optional[int]
-    """API返回的状态码"""
+    __slots__ = ("content", "retcode", "message")
 
     def __init__(self, content: Dict[str, Any]):
-        super().__init__(content=content)
-
-        self.data = self.content.get("data")
+        """
+        :param content: API返回的JSON对象序列化以后的Dict对象
+        :raises TypeError: API返回的不是JSON对象
+        """
+        if not isinstance(content, dict):
+            raise TypeError(f"API返回的数据不是JSON对象：{type(content).__name__}")
+        self.content = content
+        """API返回的JSON对象序列化以后的Dict对象"""
+        self.retcode: Optional[int] = self._find("retcode", "status")
+        """API返回的状态码"""
+        self.message: Optional[str] = self._find("message", "msg")
+        """API返回的消息内容"""
+
+    def _find(self, *keys: str) -> Any:
+        """
+        依次从返回的JSON对象和数据体中查找第一个有效的值
+        """
+        value = None
+        data = self.data
+        for key in keys:
+            if not value:
+                value = self.content.get(key)
+                if not value:
+                    value = data.get(key) if data else None
+        return value
 
-        for key in ["retcode", "status"]:
-            if not self.retcode:
-                self.retcode = self.content.get(key)
-                if not self.retcode:
-                    self.retcode = self.data.get(key) if self.data else None
+    @property
+    def data(self) -> Optional[Dict[str, Any]]:
+        """
+        API返回的数据体
+        """
+        return self.content.get("data")
 
-        self.message: Optional[str] = None
-        for key in ["message", "msg"]:
-            if not self.message:
-                self.message = self.content.get(key)
-                if not self.message:
-                    self.message = self.data.get(key) if self.data else None
+    def __repr__(self):
+        return f"{self.__class__.__name__}(retcode={self.retcode!r}, message={self.message!r})"
 
     @property
     def success(self):
@@ -380,25 +398,121 @@ class ApiResultHandler(BaseModel):
         return self.message in ["invalid request"]
 
 
+_T = TypeVar("_T")
+
+
+class AsyncTTLCache:
+    """
+    异步 TTL 缓存
+
+    同一个键同时只会有一个请求在进行，其他协程会等待该请求的结果（单飞合并，见 ``SingleFlight``），
+    结果在 ``ttl`` 秒内有效。只有满足 ``cache_if`` 条件的结果（如请求成功）才会被缓存。
+    缓存数据可以在不同线程的事件循环之间共享。
+    """
+
+    def __init__(self, ttl: Callable[[], float]):
+        """
+        :param ttl: 返回缓存有效时间（单位：秒）的函数，便于读取最新的偏好设置
+        """
+        self.ttl = ttl
+        self.hits = 0
+        """缓存命中次数（包括等待正在进行的请求）"""
+        self.misses = 0
+        """缓存未命中次数"""
+        self._data: Dict[Hashable, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    async def get(
+            self,
+            key: Hashable,
+            factory: Callable[[], Awaitable[_T]],
+            cache_if: Callable[[_T], bool] = lambda _: True
+    ) -> _T:
+        """
+        获取缓存，若缓存不存在或已过期则调用 ``factory`` 获取
+
+        :param key: 缓存键
+        :param factory: 获取数据的协程函数
+        :param cache_if: 判断结果是否可以缓存的函数
+        """
+        with self._lock:
+            cached = self._data.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.hits += 1
+            return cached[1]
+
+        result, shared = await self._flight.do(key, factory)
+        if shared:
+            self.hits += 1
+            return result
+        self.misses += 1
+        if cache_if(result):
+            with self._lock:
+                self._data[key] = time.monotonic() + self.ttl(), result
+        return result
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """
+        使缓存失效
+
+        :param key: 缓存键，为空则清空所有缓存
+        """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+
+game_record_cache = AsyncTTLCache(lambda: plugin_config.preference.game_record_cache_ttl)
+"""用户游戏账户信息缓存 {米游社UID: 请求结果}"""
+game_list_cache = AsyncTTLCache(lambda: plugin_config.preference.game_list_cache_ttl)
+"""米哈游游戏信息缓存"""
+
+
+def invalidate_account_cache(account: UserAccount):
+    """
+    清除账号相关的缓存，在账号登录失效或重新登录时调用
+
+    :param account: 用户账户数据
+    """
+    game_record_cache.invalidate(account.bbs_uid)
+
+
 async def get_game_record(account: UserAccount, retry: bool = True) -> Tuple[BaseApiStatus, Optional[List[GameRecord]]]:
     """
     获取用户绑定的游戏账户信息，返回一个GameRecord对象的列表
 
+    成功获取的结果会缓存 ``game_record_cache_ttl`` 秒
+
+    :param account: 用户账户数据
+    :param retry: 是否允许重试
+    """
+    status, records = await game_record_cache.get(
+        account.bbs_uid, lambda: _get_game_record(account, retry), lambda x: bool(x[0]))
+    return status, list(records) if records is not None else None
+
+
+async def _get_game_record(account: UserAccount, retry: bool = True) -> Tuple[BaseApiStatus, Optional[List[GameRecord]]]:
+    """
+    请求用户绑定的游戏账户信息，不使用缓存
+
     :param account: 用户账户数据
     :param retry: 是否允许重试
     """
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_GAME_RECORD.format(account.bbs_uid), headers=HEADERS_GAME_RECORD,
-                                           cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
-                                           timeout=plugin_config.preference.timeout)
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.get(URL_GAME_RECORD.format(account.bbs_uid), headers=HEADERS_GAME_RECORD,
+                                                  cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
+                                                  timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.login_expired:
                     logger.info(
                         f"获取用户游戏数据(GameRecord) - 用户 {account.display_name} 登录失效")
                     logger.debug(f"网络请求返回: {res.text}")
+                    invalidate_account_cache(account)
                     return BaseApiStatus(login_expired=True), None
                 return BaseApiStatus(success=True), list(
                     map(GameRecord.parse_obj, api_result.data["list"]))
@@ -416,6 +530,18 @@ async def get_game_list(retry: bool = True) -> Tuple[BaseApiStatus, Optional[Lis
     """
     获取米哈游游戏的详细信息，若返回`None`说明获取失败
 
+    成功获取的结果会缓存 ``game_list_cache_ttl`` 秒
+
+    :param retry: 是否允许重试
+    """
+    status, game_list = await game_list_cache.get(None, lambda: _get_game_list(retry), lambda x: bool(x[0]))
+    return status, list(game_list) if game_list is not None else None
+
+
+async def _get_game_list(retry: bool = True) -> Tuple[BaseApiStatus, Optional[List[GameInfo]]]:
+    """
+    请求米哈游游戏的详细信息，不使用缓存
+
     :param retry: 是否允许重试
     """
     headers = HEADERS_BBS_API.copy()
@@ -423,9 +549,8 @@ async def get_game_list(retry: bool = True) -> Tuple[BaseApiStatus, Optional[Lis
         async for attempt in get_async_retry(retry):
             with attempt:
                 headers["DS"] = generate_ds()
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_GAME_LIST, headers=headers, timeout=plugin_config.preference.timeout)
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.get(URL_GAME_LIST, headers=headers, timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
                 return BaseApiStatus(success=True), list(
                     map(GameInfo.parse_obj, api_result.data["list"]))
     except tenacity.RetryError as e:
@@ -448,11 +573,10 @@ async def get_user_myb(account: UserAccount, retry: bool = True) -> Tuple[BaseAp
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_MYB, headers=HEADERS_MYB,
-                                           cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
-                                           timeout=plugin_config.preference.timeout)
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.get(URL_MYB, headers=HEADERS_MYB,
+                                                  cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
+                                                  timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.login_expired:
                     logger.info(
                         f"获取用户米游币 - 用户 {account.display_name} 登录失效")
@@ -490,17 +614,16 @@ async def device_login(account: UserAccount, retry: bool = True):
         async for attempt in get_async_retry(retry):
             with attempt:
                 headers["DS"] = generate_ds(data)
-                async with httpx.AsyncClient() as client:
-                    res = await client.post(URL_DEVICE_LOGIN, headers=headers, json=data,
-                                            cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
-                                            timeout=plugin_config.preference.timeout)
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.post(URL_DEVICE_LOGIN, headers=headers, json=data,
+                                                   cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
+                                                   timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.login_expired:
                     logger.info(
                         f"设备登录(device_login) - 用户 {account.display_name} 登录失效")
                     logger.debug(f"网络请求返回: {res.text}")
                     return BaseApiStatus(login_expired=True)
-                if res.json()["message"] != "OK":
+                if json_loads(res.content)["message"] != "OK":
                     raise ValueError
                 else:
                     return BaseApiStatus(success=True)
@@ -535,17 +658,16 @@ async def device_save(account: UserAccount, retry: bool = True):
         async for attempt in get_async_retry(retry):
             with attempt:
                 headers["DS"] = generate_ds(data)
-                async with httpx.AsyncClient() as client:
-                    res = await client.post(URL_DEVICE_SAVE, headers=headers, json=data,
-                                            cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
-                                            timeout=plugin_config.preference.timeout)
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.post(URL_DEVICE_SAVE, headers=headers, json=data,
+                                                   cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
+                                                   timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.login_expired:
                     logger.info(
                         f"设备保存(device_save) - 用户 {account.display_name} 登录失效")
                     logger.debug(f"网络请求返回: {res.text}")
                     return BaseApiStatus(login_expired=True)
-                if res.json()["message"] != "OK":
+                if json_loads(res.content)["message"] != "OK":
                     raise ValueError
                 else:
                     return BaseApiStatus(success=True)
@@ -559,28 +681,27 @@ async def device_save(account: UserAccount, retry: bool = True):
             return BaseApiStatus(network_error=True)
 
 
-async def get_good_detail(good: Union[Good, str], retry: bool = True) -> Tuple[GetGoodDetailStatus, Optional[Good]]:
+good_detail_cache = AsyncTTLCache(lambda: plugin_config.preference.good_detail_cache_ttl)
+"""商品详细信息缓存 {商品ID: 请求结果}"""
+
+
+async def _get_good_detail(good_id: str, retry: bool = True) -> Tuple[GetGoodDetailStatus, Optional[Dict[str, Any]]]:
     """
-    获取某商品的详细信息
+    获取某商品的详细信息（原始数据）
 
-    :param good: 商品对象 / 商品ID，如果指定为商品对象，则会更新商品对象的数据并返回其引用
+    :param good_id: 商品ID
     :param retry: 是否允许重试
-    :return: 商品数据
+    :return: 商品数据字典
     """
-    good_id = good.goods_id if isinstance(good, Good) else good
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_CHECK_GOOD.format(good_id), timeout=plugin_config.preference.timeout)
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.get(URL_CHECK_GOOD.format(good_id), timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
                 # -2109 商品不存在；-2105 商品已下架
                 if api_result.retcode == -2109 or api_result.message == -2105:
                     return GetGoodDetailStatus(good_not_existed=True), None
-                if isinstance(good, Good):
-                    return GetGoodDetailStatus(success=True), good.update(api_result.data)
-                else:
-                    return GetGoodDetailStatus(success=True), Good.parse_obj(api_result.data)
+                return GetGoodDetailStatus(success=True), api_result.data
     except tenacity.RetryError as e:
         if is_incorrect_return(e):
             logger.exception(f"米游币商品兑换 - 获取商品详细信息: 服务器没有正确返回")
@@ -591,6 +712,30 @@ async def get_good_detail(good: Union[Good, str], retry: bool = True) -> Tuple[G
             return GetGoodDetailStatus(network_error=True), None
 
 
+async def get_good_detail(good: Union[Good, str], retry: bool = True) -> Tuple[GetGoodDetailStatus, Optional[Good]]:
+    """
+    获取某商品的详细信息
+
+    同一商品同时进行的请求会被合并为一个，短时间内的重复请求直接使用缓存结果
+
+    :param good: 商品对象 / 商品ID，如果指定为商品对象，则会更新商品对象的数据并返回其引用
+    :param retry: 是否允许重试
+    :return: 商品数据
+    """
+    good_id = good.goods_id if isinstance(good, Good) else good
+    status, data = await good_detail_cache.get(
+        good_id,
+        lambda: _get_good_detail(good_id, retry),
+        lambda result: bool(result[0])
+    )
+    if data is None:
+        return status, None
+    elif isinstance(good, Good):
+        return status, good.update(dict(data))
+    else:
+        return status, Good.parse_obj(data)
+
+
 async def get_good_games(retry: bool = True) -> Tuple[BaseApiStatus, Optional[List[Tuple[str, str]]]]:
     """
     获取商品分区列表
@@ -601,12 +746,11 @@ async def get_good_games(retry: bool = True) -> Tuple[BaseApiStatus, Optional[Li
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_GOOD_LIST.format(page=1,
-                                                                game=""),
-                                           headers=HEADERS_GOOD_LIST,
-                                           timeout=plugin_config.preference.timeout)
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.get(URL_GOOD_LIST.format(page=1,
+                                                                       game=""),
+                                                  headers=HEADERS_GOOD_LIST,
+                                                  timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
                 return BaseApiStatus(success=True), list(map(lambda x: (x["name"], x["key"]), api_result.data["games"]))
     except tenacity.RetryError as e:
         if is_incorrect_return(e):
@@ -635,11 +779,10 @@ async def get_good_list(game: str = "", retry: bool = True) -> Tuple[
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_GOOD_LIST.format(page=page,
-                                                                game=game), headers=HEADERS_GOOD_LIST,
-                                           timeout=plugin_config.preference.timeout)
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.get(URL_GOOD_LIST.format(page=page,
+                                                                       game=game), headers=HEADERS_GOOD_LIST,
+                                                  timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
                 goods = map(Good.parse_obj, api_result.data["list"])
                 # 判断是否已经读完所有商品
                 if not goods:
@@ -671,17 +814,16 @@ async def get_address(account: UserAccount, retry: bool = True) -> Tuple[BaseApi
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_ADDRESS.format(
-                        round(time.time() * 1000)), headers=headers,
-                        cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
-                        timeout=plugin_config.preference.timeout)
-                    api_result = ApiResultHandler(res.json())
-                    if api_result.login_expired:
-                        logger.info(
-                            f"获取地址数据 - 用户 {account.display_name} 登录失效")
-                        logger.debug(f"网络请求返回: {res.text}")
-                        return BaseApiStatus(login_expired=True), None
+                res = await HttpClientManager.get(URL_ADDRESS.format(
+                    round(time.time() * 1000)), headers=headers,
+                    cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
+                    timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
+                if api_result.login_expired:
+                    logger.info(
+                        f"获取地址数据 - 用户 {account.display_name} 登录失效")
+                    logger.debug(f"网络请求返回: {res.text}")
+                    return BaseApiStatus(login_expired=True), None
                 address_list = list(map(Address.parse_obj, api_result.data["list"]))
     except tenacity.RetryError as e:
         if is_incorrect_return(e):
@@ -719,6 +861,8 @@ async def check_registrable(phone_number: int, keep_client: bool = False, retry:
         time_now = round(time.time() * 1000)
         # await client.options(URL_REGISTRABLE.format(mobile=phone_number, t=time_now),
         #                      headers=headers, timeout=conf.preference.timeout)
+        # 登录流程需要保持同一个会话，不经过共享连接池，但仍然遵循 Host 的限速
+        await HttpClientManager.get_rate_limiter(URL_REGISTRABLE).acquire()
         return await client.get(URL_REGISTRABLE.format(mobile=phone_number, t=time_now),
                                 headers=headers, timeout=plugin_config.preference.timeout)
 
@@ -731,7 +875,7 @@ async def check_registrable(phone_number: int, keep_client: bool = False, retry:
                     async with httpx.AsyncClient() as client:
                         res = await request()
                 res = await request()
-                api_result = ApiResultHandler(res.json())
+                api_result = ApiResultHandler(json_loads(res.content))
                 return BaseApiStatus(success=True), bool(api_result.data["is_registable"]), device_id, client
     except tenacity.RetryError as e:
         if keep_client:
@@ -776,6 +920,7 @@ async def create_mmt(client: Optional[httpx.AsyncClient] = None,
         time_now = round(time.time() * 1000)
         # await client.options(URL_CREATE_MMT.format(now=time_now, t=time_now),
         #                      headers=headers, timeout=conf.preference.timeout)
+        await HttpClientManager.get_rate_limiter(URL_CREATE_MMT).acquire()
         return await client.get(URL_CREATE_MMT.format(now=time_now, t=time_now),
                                 headers=headers, timeout=plugin_config.preference.timeout)
 
@@ -787,7 +932,7 @@ async def create_mmt(client: Optional[httpx.AsyncClient] = None,
                 else:
                     async with httpx.AsyncClient() as client:
                         res = await request()
-                api_result = ApiResultHandler(res.json())
+                api_result = ApiResultHandler(json_loads(res.content))
                 return BaseApiStatus(success=True), MmtData.parse_obj(api_result.data["mmt_data"]), device_id, client
     except tenacity.RetryError as e:
         if client:
@@ -852,6 +997,7 @@ async def create_mobile_captcha(phone_number: str,
         """
         发送请求的闭包函数
         """
+        await HttpClientManager.get_rate_limiter(URL_CREATE_MOBILE_CAPTCHA).acquire()
         return await client.post(URL_CREATE_MOBILE_CAPTCHA,
                                  params=content,
                                  headers=headers,
@@ -865,7 +1011,7 @@ async def create_mobile_captcha(phone_number: str,
                 else:
                     async with httpx.AsyncClient() as client:
                         res = await request()
-                api_result = ApiResultHandler(res.json())
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.success:
                     return CreateMobileCaptchaStatus(success=True), client
                 elif api_result.wrong_captcha:
@@ -926,6 +1072,7 @@ async def get_login_ticket_by_captcha(phone_number: str,
         发送请求的闭包函数
         """
         # TODO 还需要进一步简化代码
+        await HttpClientManager.get_rate_limiter(URL_LOGIN_TICKET_BY_CAPTCHA).acquire()
         return await client.post(URL_LOGIN_TICKET_BY_CAPTCHA,
                                  headers=headers,
                                  content=encoded_params,
@@ -940,7 +1087,7 @@ async def get_login_ticket_by_captcha(phone_number: str,
                 else:
                     async with httpx.AsyncClient() as client:
                         res = await request()
-                api_result = ApiResultHandler(res.json())
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.success:
                     cookies = BBSCookies.parse_obj(dict_from_cookiejar(
                         res.cookies.jar))
@@ -983,12 +1130,11 @@ async def get_multi_token_by_login_ticket(cookies: BBSCookies, retry: bool = Tru
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(
-                        URL_MULTI_TOKEN_BY_LOGIN_TICKET.format(cookies.login_ticket, cookies.bbs_uid),
-                        headers=HEADERS_API_TAKUMI_PC,
-                        timeout=plugin_config.preference.timeout)
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.get(
+                    URL_MULTI_TOKEN_BY_LOGIN_TICKET.format(cookies.login_ticket, cookies.bbs_uid),
+                    headers=HEADERS_API_TAKUMI_PC,
+                    timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.login_expired:
                     logger.warning(f"通过 login_ticket 获取 stoken: 登录失效")
                     return GetCookieStatus(login_expired=True), None
@@ -1026,19 +1172,18 @@ async def get_cookie_token_by_captcha(phone_number: str, captcha: int, retry: bo
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.post(URL_COOKIE_TOKEN_BY_CAPTCHA,
-                                            headers=HEADERS_API_TAKUMI_PC,
-                                            json={
-                                                "is_bh2": False,
-                                                "mobile": phone_number,
-                                                "captcha": str(captcha),
-                                                "action_type": "login",
-                                                "token_type": 6
-                                            },
-                                            timeout=plugin_config.preference.timeout
-                                            )
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.post(URL_COOKIE_TOKEN_BY_CAPTCHA,
+                                                   headers=HEADERS_API_TAKUMI_PC,
+                                                   json={
+                                                       "is_bh2": False,
+                                                       "mobile": phone_number,
+                                                       "captcha": str(captcha),
+                                                       "action_type": "login",
+                                                       "token_type": 6
+                                                   },
+                                                   timeout=plugin_config.preference.timeout
+                                                   )
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.wrong_captcha:
                     logger.info(f"登录米哈游账号 - 验证码错误")
                     return GetCookieStatus(incorrect_captcha=True), None
@@ -1088,15 +1233,14 @@ async def get_login_ticket_by_password(account: str, password: str, mmt_data: Mm
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.post(
-                        URL_LOGIN_TICKET_BY_PASSWORD,
-                        content=encoded_params,
-                        headers=headers,
-                        timeout=plugin_config.preference.timeout
-                    )
+                res = await HttpClientManager.post(
+                    URL_LOGIN_TICKET_BY_PASSWORD,
+                    content=encoded_params,
+                    headers=headers,
+                    timeout=plugin_config.preference.timeout
+                )
                 cookies = BBSCookies.parse_obj(dict_from_cookiejar(res.cookies.jar))
-                api_result = ApiResultHandler(res.json())
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.success:
                     return GetCookieStatus(success=True), cookies
                 elif api_result.wrong_captcha:
@@ -1134,14 +1278,13 @@ async def get_cookie_token_by_stoken(cookies: BBSCookies, device_id: str = None,
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(
-                        URL_COOKIE_TOKEN_BY_STOKEN,
-                        cookies=cookies.dict(v2_stoken=True, cookie_type=True),
-                        headers=headers,
-                        timeout=plugin_config.preference.timeout
-                    )
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.get(
+                    URL_COOKIE_TOKEN_BY_STOKEN,
+                    cookies=cookies.dict(v2_stoken=True, cookie_type=True),
+                    headers=headers,
+                    timeout=plugin_config.preference.timeout
+                )
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.success:
                     cookies.cookie_token = api_result.data["cookie_token"]
                     if not cookies.bbs_uid:
@@ -1188,15 +1331,14 @@ async def get_stoken_v2_by_v1(cookies: BBSCookies, device_id: str = None, retry:
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    headers.setdefault("DS", generate_ds(salt=plugin_env.salt_config.SALT_PROD))
-                    res = await client.post(
-                        URL_STOKEN_V2_BY_V1,
-                        cookies={"stoken": cookies.stoken_v1, "stuid": cookies.bbs_uid},
-                        headers=headers,
-                        timeout=plugin_config.preference.timeout
-                    )
-                api_result = ApiResultHandler(res.json())
+                headers.setdefault("DS", generate_ds(salt=plugin_env.salt_config.SALT_PROD))
+                res = await HttpClientManager.post(
+                    URL_STOKEN_V2_BY_V1,
+                    cookies={"stoken": cookies.stoken_v1, "stuid": cookies.bbs_uid},
+                    headers=headers,
+                    timeout=plugin_config.preference.timeout
+                )
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.success:
                     cookies.stoken_v2 = api_result.data["token"]["token"]
                     cookies.mid = api_result.data["user_info"]["mid"]
@@ -1243,14 +1385,13 @@ async def get_ltoken_by_stoken(cookies: BBSCookies, device_id: str = None, retry
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(
-                        URL_LTOKEN_BY_STOKEN,
-                        cookies=cookies.dict(v2_stoken=True, cookie_type=True),
-                        headers=headers,
-                        timeout=plugin_config.preference.timeout
-                    )
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.get(
+                    URL_LTOKEN_BY_STOKEN,
+                    cookies=cookies.dict(v2_stoken=True, cookie_type=True),
+                    headers=headers,
+                    timeout=plugin_config.preference.timeout
+                )
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.success:
                     cookies.ltoken = api_result.data["ltoken"]
                     return GetCookieStatus(success=True), cookies
@@ -1301,13 +1442,12 @@ async def get_device_fp(device_id: str, retry: bool = True) -> Tuple[GetFpStatus
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.post(
-                        URL_GET_DEVICE_FP,
-                        json=content,
-                        timeout=plugin_config.preference.timeout
-                    )
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.post(
+                    URL_GET_DEVICE_FP,
+                    json=content,
+                    timeout=plugin_config.preference.timeout
+                )
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.data["code"] == 403 or api_result.data["msg"] == "传入的参数有误":
                     logger.error("传入的参数有误")
                     return GetFpStatus(invalid_arguments=True), None
@@ -1328,38 +1468,67 @@ async def get_device_fp(device_id: str, retry: bool = True) -> Tuple[GetFpStatus
             return GetFpStatus(network_error=True), None
 
 
-async def good_exchange(plan: ExchangePlan) -> Tuple[ExchangeStatus, Optional[ExchangeResult]]:
+class PreparedExchange:
+    """
+    预先构建好的兑换请求
+
+    请求头（包括 Cookie）和请求体在兑换开始前就已经序列化完成，兑换时只需发送即可。
+    """
+
+    def __init__(self, plan: ExchangePlan):
+        """
+        :param plan: 兑换计划
+        """
+        self.plan = plan
+        """兑换计划"""
+        content = {
+            "app_id": 1,
+            "point_sn": "myb",
+            "goods_id": plan.good.goods_id,
+            "exchange_num": 1
+        }
+        if plan.address is not None:
+            content.setdefault("address_id", plan.address.id)
+        if plan.game_record is not None:
+            content.setdefault("uid", plan.game_record.game_role_id)
+            # 例: cn_gf01
+            content.setdefault("region", plan.game_record.region)
+            # 例: hk4e_cn
+            content.setdefault("game_biz", plan.good.game_biz)
+        self.content = json.dumps(content).encode()
+        """JSON 请求体"""
+        self.headers = HEADERS_EXCHANGE.copy()
+        """请求头"""
+        self.headers["x-rpc-device_id"] = plan.account.device_id_ios
+        self.headers["x-rpc-device_fp"] = plan.account.device_fp or generate_fp_locally()
+        self.headers["Cookie"] = "; ".join(
+            f"{key}={value}" for key, value in plan.account.cookies.dict(cookie_type=True).items())
+        self._request: Optional[httpx.Request] = None
+
+    def build_request(self) -> httpx.Request:
+        """
+        获取构建好的 ``httpx.Request``，首次调用时构建，需要在事件循环中调用
+        """
+        if self._request is None:
+            self._request = HttpClientManager.build_request(
+                "POST", URL_EXCHANGE, headers=self.headers, content=self.content,
+                timeout=plugin_config.preference.timeout)
+        return self._request
+
+
+async def good_exchange(plan: Union[ExchangePlan, PreparedExchange]) -> Tuple[ExchangeStatus, Optional[ExchangeResult]]:
     """
     执行米游币商品兑换
 
-    :param plan: 兑换计划
+    :param plan: 兑换计划，或预先构建好的兑换请求
     """
-    headers = HEADERS_EXCHANGE
-    headers["x-rpc-device_id"] = plan.account.device_id_ios
-    headers["x-rpc-device_fp"] = plan.account.device_fp or generate_fp_locally()
-    content = {
-        "app_id": 1,
-        "point_sn": "myb",
-        "goods_id": plan.good.goods_id,
-        "exchange_num": 1
-    }
-    if plan.address is not None:
-        content.setdefault("address_id", plan.address.id)
-    if plan.game_record is not None:
-        content.setdefault("uid", plan.game_record.game_role_id)
-        # 例: cn_gf01
-        content.setdefault("region", plan.game_record.region)
-        # 例: hk4e_cn
-        content.setdefault("game_biz", plan.good.game_biz)
+    prepared = plan if isinstance(plan, PreparedExchange) else PreparedExchange(plan)
+    plan = prepared.plan
     start_time = 0
     try:
         start_time = time.time()
-        async with httpx.AsyncClient() as client:
-            res = await client.post(
-                URL_EXCHANGE, headers=headers, json=content,
-                cookies=plan.account.cookies.dict(cookie_type=True),
-                timeout=plugin_config.preference.timeout)
-        api_result = ApiResultHandler(res.json())
+        res = await HttpClientManager.send(prepared.build_request(), rate_limit=False, circuit_breaker=False)
+        api_result = ApiResultHandler(json_loads(res.content))
         if api_result.login_expired:
             logger.info(
                 f"米游币商品兑换 - 执行兑换: 用户 {plan.account.display_name} 登录失效 - 请求发送时间: {start_time}")
@@ -1369,12 +1538,12 @@ async def good_exchange(plan: ExchangePlan) -> Tuple[ExchangeStatus, Optional[Ex
             logger.info(
                 f"米游币商品兑换: 用户 {plan.account.display_name} 商品 {plan.good.goods_id} 兑换成功！可以自行确认 - 请求发送时间: {start_time}")
             logger.debug(f"网络请求返回: {res.text}")
-            return ExchangeStatus(success=True), ExchangeResult(result=True, return_data=res.json(), plan=plan)
+            return ExchangeStatus(success=True), ExchangeResult(result=True, return_data=api_result.content, plan=plan)
         else:
             logger.info(
                 f"米游币商品兑换: 用户 {plan.account.display_name} 商品 {plan.good.goods_id} 兑换失败，可以自行确认 - 请求发送时间: {start_time}")
             logger.debug(f"网络请求返回: {res.text}")
-            return ExchangeStatus(success=True), ExchangeResult(result=False, return_data=res.json(), plan=plan)
+            return ExchangeStatus(success=True), ExchangeResult(result=False, return_data=api_result.content, plan=plan)
     except Exception as e:
         if is_incorrect_return(e):
             logger.error(
@@ -1393,32 +1562,15 @@ def good_exchange_sync(plan: ExchangePlan) -> Tuple[ExchangeStatus, Optional[Exc
 
     :param plan: 兑换计划
     """
-    headers = HEADERS_EXCHANGE
-    headers["x-rpc-device_id"] = plan.account.device_id_ios
-    headers["x-rpc-device_fp"] = plan.account.device_fp or generate_fp_locally()
-    content = {
-        "app_id": 1,
-        "point_sn": "myb",
-        "goods_id": plan.good.goods_id,
-        "exchange_num": 1
-    }
-    if plan.address is not None:
-        content.setdefault("address_id", plan.address.id)
-    if plan.game_record is not None:
-        content.setdefault("uid", plan.game_record.game_role_id)
-        # 例: cn_gf01
-        content.setdefault("region", plan.game_record.region)
-        # 例: hk4e_cn
-        content.setdefault("game_biz", plan.good.game_biz)
+    prepared = PreparedExchange(plan)
     start_time = 0
     try:
         start_time = time.time()
         with httpx.Client() as client:
             res = client.post(
-                URL_EXCHANGE, headers=headers, json=content,
-                cookies=plan.account.cookies.dict(cookie_type=True),
+                URL_EXCHANGE, headers=prepared.headers, content=prepared.content,
                 timeout=plugin_config.preference.timeout)
-        api_result = ApiResultHandler(res.json())
+        api_result = ApiResultHandler(json_loads(res.content))
         if api_result.login_expired:
             logger.info(
                 f"米游币商品兑换 - 执行兑换: 用户 {plan.account.display_name} 登录失效 - 请求发送时间: {start_time}")
@@ -1428,12 +1580,12 @@ def good_exchange_sync(plan: ExchangePlan) -> Tuple[ExchangeStatus, Optional[Exc
             logger.info(
                 f"米游币商品兑换: 用户 {plan.account.display_name} 商品 {plan.good.goods_id} 兑换成功！可以自行确认 - 请求发送时间: {start_time}")
             logger.debug(f"网络请求返回: {res.text}")
-            return ExchangeStatus(success=True), ExchangeResult(result=True, return_data=res.json(), plan=plan)
+            return ExchangeStatus(success=True), ExchangeResult(result=True, return_data=api_result.content, plan=plan)
         else:
             logger.info(
                 f"米游币商品兑换: 用户 {plan.account.display_name} 商品 {plan.good.goods_id} 兑换失败，可以自行确认 - 请求发送时间: {start_time}")
             logger.debug(f"网络请求返回: {res.text}")
-            return ExchangeStatus(success=True), ExchangeResult(result=False, return_data=res.json(), plan=plan)
+            return ExchangeStatus(success=True), ExchangeResult(result=False, return_data=api_result.content, plan=plan)
     except Exception as e:
         if is_incorrect_return(e):
             logger.error(
@@ -1446,6 +1598,54 @@ def good_exchange_sync(plan: ExchangePlan) -> Tuple[ExchangeStatus, Optional[Exc
             return ExchangeStatus(network_error=True), None
 
 
+async def get_server_time_offset(
+        url: str = URL_EXCHANGE,
+        samples: int = 5
+) -> Tuple[Optional[float], Optional[float]]:
+    """
+    通过响应头中的 ``Date`` 估算米游社服务器时间与本地时间的偏差，同时也会预热与目标 Host 的连接
+
+    ``Date`` 只精确到秒，但服务器时间在请求发出到收到响应之间的某个时刻处于 ``[Date, Date + 1)``，
+    因此每次采样都可以得到偏差的一个区间，取所有区间的交集即为估计范围。
+    之后的采样会尽量让请求在估计的服务器整秒时刻到达，以不断缩小区间。
+
+    :param url: 用于采样的URL，应与实际发送请求的URL处于同一 Host
+    :param samples: 采样次数
+    :return: (服务器时间 - 本地时间 的估计值, 估计误差)，单位为秒，获取失败则均为 None
+    """
+    lower, upper = float("-inf"), float("inf")
+    rtt = 0.0
+    for i in range(samples):
+        if i > 0 and upper - lower < 1:
+            # 等待到估计的下一个服务器整秒时刻附近再发送请求
+            middle = (lower + upper) / 2
+            server_now = time.time() + middle
+            wait = 1 - server_now % 1 - rtt / 2
+            await asyncio.sleep(wait if wait >= 0 else wait + 1)
+        try:
+            send_time = time.time()
+            res = await HttpClientManager.request("HEAD", url, timeout=plugin_config.preference.timeout,
+                                                  rate_limit=False, circuit_breaker=False)
+            receive_time = time.time()
+        except Exception:
+            logger.exception("同步服务器时间 - 请求失败")
+            continue
+        rtt = receive_time - send_time
+        date = res.headers.get("Date")
+        if not date:
+            logger.error("同步服务器时间 - 服务器响应中没有 Date 请求头")
+            return None, None
+        server_time = parsedate_to_datetime(date).timestamp()
+        new_lower, new_upper = max(lower, server_time - receive_time), min(upper, server_time + 1 - send_time)
+        # 区间为空说明服务器时间发生了跳变或测量异常，以最新的采样结果为准
+        if new_lower > new_upper:
+            new_lower, new_upper = server_time - receive_time, server_time + 1 - send_time
+        lower, upper = new_lower, new_upper
+    if lower == float("-inf"):
+        return None, None
+    return (lower + upper) / 2, (upper - lower) / 2
+
+
 async def genshin_note(account: UserAccount) -> Tuple[
     Union[BaseApiStatus, GenshinNoteStatus],
     Optional[GenshinNote]
@@ -1480,19 +1680,19 @@ async def genshin_note(account: UserAccount) -> Tuple[
                     with attempt:
                         headers["DS"] = generate_ds(
                             params={"role_id": record.game_role_id, "server": record.region})
-                        async with httpx.AsyncClient() as client:
-                            res = await client.get(
-                                URL_GENSHEN_NOTE_BBS,
-                                headers=headers,
-                                cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
-                                params=params,
-                                timeout=plugin_config.preference.timeout
-                            )
-                        api_result = ApiResultHandler(res.json())
+                        res = await HttpClientManager.get(
+                            URL_GENSHEN_NOTE_BBS,
+                            headers=headers,
+                            cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
+                            params=params,
+                            timeout=plugin_config.preference.timeout
+                        )
+                        api_result = ApiResultHandler(json_loads(res.content))
                         if api_result.login_expired:
                             logger.info(
                                 f"原神实时便笺: 用户 {account.display_name} 登录失效")
                             logger.debug(f"网络请求返回: {res.text}")
+                            invalidate_account_cache(account)
                             return GenshinNoteStatus(login_expired=True), None
 
                         if api_result.invalid_ds:
@@ -1500,20 +1700,20 @@ async def genshin_note(account: UserAccount) -> Tuple[
                                 f"原神实时便笺: 用户 {account.display_name} DS 校验失败")
                             logger.debug(f"网络请求返回: {res.text}")
                         if api_result.retcode == 1034:
+                            HttpClientManager.report_throttled(res.url)
                             logger.info(
                                 f"原神实时便笺: 用户 {account.display_name} 可能被验证码阻拦")
                             logger.debug(f"网络请求返回: {res.text}")
                         if not api_result.success:
                             headers["DS"] = generate_ds()
                             headers["x-rpc-device_id"] = account.device_id_ios
-                            async with httpx.AsyncClient() as client:
-                                res = await client.get(
-                                    URL_GENSHEN_NOTE_WIDGET,
-                                    headers=headers,
-                                    cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
-                                    timeout=plugin_config.preference.timeout
-                                )
-                            api_result = ApiResultHandler(res.json())
+                            res = await HttpClientManager.get(
+                                URL_GENSHEN_NOTE_WIDGET,
+                                headers=headers,
+                                cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
+                                timeout=plugin_config.preference.timeout
+                            )
+                            api_result = ApiResultHandler(json_loads(res.content))
                             return GenshinNoteStatus(success=True), \
                                 GenshinNote.parse_obj(api_result.data)
                         return GenshinNoteStatus(success=True), GenshinNote.parse_obj(api_result.data)
@@ -1560,16 +1760,16 @@ async def starrail_note(account: UserAccount) -> Tuple[
                 async for attempt in get_async_retry(False):
                     with attempt:
                         headers["DS"] = generate_ds(data={})
-                        async with httpx.AsyncClient() as client:
-                            cookies = account.cookies.dict(v2_stoken=True, cookie_type=True)
-                            res = await client.get(url, headers=headers,
-                                                   cookies=cookies,
-                                                   timeout=plugin_config.preference.timeout)
-                        api_result = ApiResultHandler(res.json())
+                        cookies = account.cookies.dict(v2_stoken=True, cookie_type=True)
+                        res = await HttpClientManager.get(url, headers=headers,
+                                                          cookies=cookies,
+                                                          timeout=plugin_config.preference.timeout)
+                        api_result = ApiResultHandler(json_loads(res.content))
                         if api_result.login_expired:
                             logger.info(
                                 f"崩铁实时便笺: 用户 {account.display_name} 登录失效")
                             logger.debug(f"网络请求返回: {res.text}")
+                            invalidate_account_cache(account)
                             return StarRailNoteStatus(login_expired=True), None
 
                         if api_result.invalid_ds:
@@ -1577,6 +1777,7 @@ async def starrail_note(account: UserAccount) -> Tuple[
                                 f"崩铁实时便笺: 用户 {account.display_name} DS 校验失败")
                             logger.debug(f"网络请求返回: {res.text}")
                         if api_result.retcode == 1034:
+                            HttpClientManager.report_throttled(res.url)
                             logger.info(
                                 f"崩铁实时便笺: 用户 {account.display_name} 可能被验证码阻拦")
                             logger.debug(f"网络请求返回: {res.text}")
@@ -1612,14 +1813,13 @@ async def create_verification(
                 headers["x-rpc-device_fp"] = account.device_fp if account and account.device_fp else \
                     generate_fp_locally()
                 headers["DS"] = generate_ds()
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(
-                        URL_CREATE_VERIFICATION,
-                        headers=headers,
-                        cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
-                        timeout=plugin_config.preference.timeout
-                    )
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.get(
+                    URL_CREATE_VERIFICATION,
+                    headers=headers,
+                    cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
+                    timeout=plugin_config.preference.timeout
+                )
+                api_result = ApiResultHandler(json_loads(res.content))
                 return BaseApiStatus(success=True), MmtData.parse_obj(api_result.data)
     except tenacity.RetryError as e:
         if is_incorrect_return(e):
@@ -1659,14 +1859,13 @@ async def verify_verification(
                 headers["x-rpc-device_fp"] = account.device_fp if account and account.device_fp else \
                     generate_fp_locally()
                 headers["DS"] = generate_ds()
-                async with httpx.AsyncClient() as client:
-                    res = await client.post(
-                        URL_VERIFY_VERIFICATION,
-                        headers=headers,
-                        cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
-                        json=content,
-                        timeout=plugin_config.preference.timeout)
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.post(
+                    URL_VERIFY_VERIFICATION,
+                    headers=headers,
+                    cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
+                    json=content,
+                    timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.retcode == 0:
                     return BaseApiStatus(success=True)
                 else:
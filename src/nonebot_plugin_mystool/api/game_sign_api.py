@@ -1,20 +1,35 @@
+from datetime import datetime
 from typing import List, Optional, Tuple, Literal, Set, Type
 from urllib.parse import urlencode
 
-import httpx
+import pytz
 import tenacity
 
 from ..api.common import ApiResultHandler, HEADERS_API_TAKUMI_MOBILE, is_incorrect_return, \
-    device_login, device_save
+    device_login, device_save, AsyncTTLCache
 from ..model import GameRecord, BaseApiStatus, Award, GameSignInfo, GeetestResult, MmtData, plugin_config, plugin_env, \
-    UserAccount
+    UserAccount, json_loads
 from ..utils import logger, generate_ds, \
-    get_async_retry
+    get_async_retry, HttpClientManager
 
 __all__ = ["BaseGameSign", "GenshinImpactSign", "HonkaiImpact3Sign", "HoukaiGakuen2Sign", "TearsOfThemisSign",
            "StarRailSign"]
 
 
+reward_cache = AsyncTTLCache(lambda: 86400)
+"""签到奖励列表缓存 {(act_id, 月份): 请求结果}，奖励列表只与签到活动和月份有关"""
+
+
+def _current_month() -> str:
+    """
+    获取当前月份（按偏好设置中的时区），格式为 YYYY-MM
+    """
+    if zone := plugin_config.preference.timezone:
+        return datetime.now(pytz.timezone(zone)).strftime("%Y-%m")
+    else:
+        return datetime.now().strftime("%Y-%m")
+
+
 class BaseGameSign:
     """
     游戏签到基类
@@ -65,20 +80,19 @@ class BaseGameSign:
         """
         return self.record is not None
 
-    async def get_rewards(self, retry: bool = True) -> Tuple[BaseApiStatus, Optional[List[Award]]]:
+    async def _get_rewards(self, retry: bool = True) -> Tuple[BaseApiStatus, Optional[List[Award]]]:
         """
-        获取签到奖励信息
+        获取签到奖励信息（不使用缓存）
 
         :param retry: 是否允许重试
         """
         try:
             async for attempt in get_async_retry(retry):
                 with attempt:
-                    async with httpx.AsyncClient() as client:
-                        res = await client.get(self.url_reward, headers=self.headers_reward,
-                                               timeout=plugin_config.preference.timeout)
+                    res = await HttpClientManager.get(self.url_reward, headers=self.headers_reward,
+                                                      timeout=plugin_config.preference.timeout)
                     award_list = []
-                    for award in res.json()["data"]["awards"]:
+                    for award in json_loads(res.content)["data"]["awards"]:
                         award_list.append(Award.parse_obj(award))
                     return BaseApiStatus(success=True), award_list
         except tenacity.RetryError as e:
@@ -90,6 +104,21 @@ class BaseGameSign:
                 logger.exception(f"获取签到奖励信息 - 请求失败")
                 return BaseApiStatus(network_error=True), None
 
+    async def get_rewards(self, retry: bool = True) -> Tuple[BaseApiStatus, Optional[List[Award]]]:
+        """
+        获取签到奖励信息
+
+        奖励列表按签到活动和月份在进程内缓存，所有账号共用
+
+        :param retry: 是否允许重试
+        """
+        status, awards = await reward_cache.get(
+            (self.act_id, _current_month()),
+            lambda: self._get_rewards(retry),
+            lambda result: bool(result[0])
+        )
+        return status, list(awards) if awards is not None else None
+
     async def get_info(
             self,
             platform: Literal["ios", "android"] = "ios",
@@ -108,11 +137,10 @@ class BaseGameSign:
             async for attempt in get_async_retry(retry):
                 with attempt:
                     headers["DS"] = generate_ds() if platform == "ios" else generate_ds(platform="android")
-                    async with httpx.AsyncClient() as client:
-                        res = await client.get(self.url_info, headers=headers,
-                                               cookies=self.account.cookies.dict(),
-                                               timeout=plugin_config.preference.timeout)
-                    api_result = ApiResultHandler(res.json())
+                    res = await HttpClientManager.get(self.url_info, headers=headers,
+                                                      cookies=self.account.cookies.dict(),
+                                                      timeout=plugin_config.preference.timeout)
+                    api_result = ApiResultHandler(json_loads(res.content))
                     if api_result.login_expired:
                         logger.info(
                             f"获取签到数据 - 用户 {self.account.display_name} 登录失效")
@@ -181,16 +209,15 @@ class BaseGameSign:
                         headers["x-rpc-seccode"] = geetest_result.seccode
                         logger.info("游戏签到 - 尝试使用人机验证结果进行签到")
 
-                    async with httpx.AsyncClient() as client:
-                        res = await client.post(
-                            self.url_sign,
-                            headers=headers,
-                            cookies=self.account.cookies.dict(),
-                            timeout=plugin_config.preference.timeout,
-                            json=content
-                        )
+                    res = await HttpClientManager.post(
+                        self.url_sign,
+                        headers=headers,
+                        cookies=self.account.cookies.dict(),
+                        timeout=plugin_config.preference.timeout,
+                        json=content
+                    )
 
-                    api_result = ApiResultHandler(res.json())
+                    api_result = ApiResultHandler(json_loads(res.content))
                     if api_result.login_expired:
                         logger.info(
                             f"游戏签到 - 用户 {self.account.display_name} 登录失效")
@@ -202,6 +229,7 @@ class BaseGameSign:
                         logger.debug(f"网络请求返回: {res.text}")
                         return BaseApiStatus(invalid_ds=True), None
                     elif api_result.data.get("risk_code") != 0:
+                        HttpClientManager.report_throttled(self.url_sign)
                         logger.warning(
                             f"{plugin_config.preference.log_head}游戏签到 - 用户 {self.account.display_name} 可能被人机验证阻拦")
                         logger.debug(f"{plugin_config.preference.log_head}网络请求返回: {res.text}")
@@ -1,15 +1,13 @@
-import asyncio
-from typing import List, Optional, Tuple, Type, Dict
+from typing import List, Optional, Tuple, Type, Dict, Iterable
 
-import httpx
 import tenacity
 
 from ..api.common import ApiResultHandler, is_incorrect_return, create_verification, \
-    verify_verification
+    verify_verification, AsyncTTLCache
 from ..model import BaseApiStatus, MissionStatus, MissionData, \
-    MissionState, UserAccount, plugin_config, plugin_env
+    MissionState, UserAccount, plugin_config, plugin_env, json_loads
 from ..utils import logger, generate_ds, \
-    get_async_retry, get_validate
+    get_async_retry, get_validate, HttpClientManager, RateLimiter
 
 URL_SIGN = "https://bbs-api.mihoyo.com/apihub/app/api/signIn"
 URL_GET_POST = "https://bbs-api.miyoushe.com/post/api/feeds/posts?fresh_action=1&gids={}&is_first_initialize=false" \
@@ -77,6 +75,9 @@ HEADERS_OLD = {
     "DS": None
 }
 
+post_list_cache = AsyncTTLCache(lambda: plugin_config.preference.post_list_cache_ttl)
+"""米游社分区文章列表缓存 {gids: 请求结果}，所有账号共用"""
+
 
 class BaseMission:
     """
@@ -99,6 +100,9 @@ class BaseMission:
     available_games: Dict[str, Type["BaseMission"]] = {}
     """可用的子类"""
 
+    _rate_limiters: Dict[str, Tuple[Tuple[float, int], RateLimiter]] = {}
+    """米游社UID -> (创建时的 (速率, 容量), 任务操作限速器)，同一账户在不同分区的任务共用"""
+
     def __init__(self, account: UserAccount) -> None:
         """
         米游币任务相关
@@ -108,6 +112,26 @@ class BaseMission:
         self.account = account
         self.headers = HEADERS_BASE.copy()
         self.headers["x-rpc-device_id"] = account.device_id_android
+        self.rate_limiter = self.get_rate_limiter(account)
+
+    @classmethod
+    def get_rate_limiter(cls, account: UserAccount) -> RateLimiter:
+        """
+        获取账户的任务操作限速器
+
+        每个账户每 ``sleep_time`` 秒补充一次操作机会，最多积攒 ``mission_rate_burst`` 次，
+        签到、阅读、点赞、分享共用同一个限速器，因此可以同时进行。
+        若偏好设置中的 ``sleep_time`` 或 ``mission_rate_burst`` 已改变，则按新的设置重新创建限速器
+
+        :param account: 账号对象
+        """
+        preference = plugin_config.preference
+        rate = 1 / preference.sleep_time if preference.sleep_time > 0 else 0
+        settings = (rate, preference.mission_rate_burst)
+        cached = cls._rate_limiters.get(account.bbs_uid)
+        if cached is None or cached[0] != settings:
+            cached = cls._rate_limiters[account.bbs_uid] = (settings, RateLimiter(*settings))
+        return cached[1]
 
     async def sign(self, retry: bool = True) -> Tuple[MissionStatus, Optional[int]]:
         """
@@ -117,21 +141,21 @@ class BaseMission:
         :return: (BaseApiStatus, 签到获得的米游币数量)
         """
         content = {"gids": self.gids}
+        await self.rate_limiter.acquire()
         try:
             async for attempt in get_async_retry(retry):
                 with attempt:
                     headers = HEADERS_OLD.copy()
                     headers["x-rpc-device_id"] = self.account.device_id_android
                     headers["DS"] = generate_ds(data=content)
-                    async with httpx.AsyncClient() as client:
-                        res = await client.post(
-                            URL_SIGN,
-                            headers=headers,
-                            json=content,
-                            timeout=plugin_config.preference.timeout,
-                            cookies=self.account.cookies.dict(v2_stoken=True, cookie_type=True)
-                        )
-                    api_result = ApiResultHandler(res.json())
+                    res = await HttpClientManager.post(
+                        URL_SIGN,
+                        headers=headers,
+                        json=content,
+                        timeout=plugin_config.preference.timeout,
+                        cookies=self.account.cookies.dict(v2_stoken=True, cookie_type=True)
+                    )
+                    api_result = ApiResultHandler(json_loads(res.content))
                     if api_result.login_expired:
                         logger.error(
                             f"米游币任务 - 讨论区签到: 用户 {self.account.display_name} 登录失效")
@@ -143,6 +167,7 @@ class BaseMission:
                         logger.debug(f"网络请求返回: {res.text}")
                         return MissionStatus(invalid_ds=True), None
                     elif api_result.retcode == 1034:
+                        HttpClientManager.report_throttled(URL_SIGN)
                         logger.error(
                             f"米游币任务 - 讨论区签到: 用户 {self.account.display_name} 需要完成人机验证")
                         logger.debug(f"网络请求返回: {res.text}")
@@ -173,31 +198,29 @@ class BaseMission:
                 logger.exception("米游币任务 - 讨论区签到: 请求失败")
                 return MissionStatus(network_error=True), None
 
-    async def get_posts(self, retry: bool = True) -> Tuple[BaseApiStatus, Optional[List[str]]]:
+    async def _get_posts(self, retry: bool = True) -> Tuple[BaseApiStatus, Optional[List[Tuple[str, int]]]]:
         """
-        获取文章ID列表，若失败返回 `None`
+        获取分区文章列表（不使用缓存）
 
         :param retry: 是否允许重试
-        :return: (BaseApiStatus, 文章ID列表)
+        :return: (BaseApiStatus, (文章ID, 点赞状态) 列表)
         """
-        post_id_list = []
+        post_list = []
         try:
             async for attempt in get_async_retry(retry):
                 with attempt:
                     headers = HEADERS_GET_POSTS.copy()
                     headers["x-rpc-device_id"] = self.account.device_id_ios
-                    async with httpx.AsyncClient() as client:
-                        res = await client.get(
-                            URL_GET_POST.format(self.gids),
-                            headers=headers,
-                            timeout=plugin_config.preference.timeout
-                        )
-                    api_result = ApiResultHandler(res.json())
+                    res = await HttpClientManager.get(
+                        URL_GET_POST.format(self.gids),
+                        headers=headers,
+                        timeout=plugin_config.preference.timeout
+                    )
+                    api_result = ApiResultHandler(json_loads(res.content))
                     for post in api_result.data["list"]:
-                        if post["self_operation"]["attitude"] == 0:
-                            post_id_list.append(post['post']['post_id'])
+                        post_list.append((post['post']['post_id'], post["self_operation"]["attitude"]))
                     break
-            return BaseApiStatus(success=True), post_id_list
+            return BaseApiStatus(success=True), post_list
         except tenacity.RetryError as e:
             if is_incorrect_return(e):
                 logger.exception(f"米游币任务 - 获取文章列表: 服务器没有正确返回")
@@ -207,6 +230,48 @@ class BaseMission:
                 logger.exception(f"米游币任务 - 获取文章列表: 请求失败")
                 return BaseApiStatus(network_error=True), None
 
+    async def get_posts(
+            self,
+            retry: bool = True,
+            refresh: bool = False,
+            exclude: Iterable[str] = ()
+    ) -> Tuple[BaseApiStatus, Optional[List[str]]]:
+        """
+        获取文章ID列表，若失败返回 `None`
+
+        文章列表按分区缓存，所有账号共用，每个账号再过滤掉已点赞过和本次已经操作过的文章
+
+        :param retry: 是否允许重试
+        :param refresh: 是否忽略缓存，重新获取文章列表
+        :param exclude: 需要过滤掉的文章ID
+        :return: (BaseApiStatus, 文章ID列表)
+        """
+        if refresh:
+            post_list_cache.invalidate(self.gids)
+        status, post_list = await post_list_cache.get(
+            self.gids,
+            lambda: self._get_posts(retry),
+            lambda result: bool(result[0])
+        )
+        if post_list is None:
+            return status, None
+        exclude = set(exclude)
+        return status, [post_id for post_id, attitude in post_list if attitude == 0 and post_id not in exclude]
+
+    async def _next_posts(self, operated: Iterable[str], retry: bool = True) -> Tuple[BaseApiStatus, Optional[List[str]]]:
+        """
+        当前文章列表已经用完时，重新获取文章列表
+
+        优先返回本次还没有操作过的文章，若重新获取后仍没有新文章，则返回完整的文章列表
+
+        :param operated: 本次已经操作过的文章ID
+        :param retry: 是否允许重试
+        """
+        get_post_status, posts = await self.get_posts(retry, refresh=True, exclude=operated)
+        if get_post_status and not posts:
+            get_post_status, posts = await self.get_posts(retry)
+        return get_post_status, posts
+
     async def read(self, read_times: int = 5, retry: bool = True) -> MissionStatus:
         """
         阅读
@@ -215,6 +280,7 @@ class BaseMission:
         :param retry: 是否允许重试
         """
         count = 0
+        read_posts = set()
         get_post_status, posts = await self.get_posts(retry)
         if not get_post_status:
             return MissionStatus(failed_getting_post=True)
@@ -222,18 +288,18 @@ class BaseMission:
             for post_id in posts:
                 if count == read_times:
                     break
+                await self.rate_limiter.acquire()
                 try:
                     async for attempt in get_async_retry(retry):
                         with attempt:
                             self.headers["DS"] = generate_ds(platform="android")
-                            async with httpx.AsyncClient() as client:
-                                res = await client.get(
-                                    URL_READ.format(post_id),
-                                    headers=self.headers,
-                                    timeout=plugin_config.preference.timeout,
-                                    cookies=self.account.cookies.dict(v2_stoken=True, cookie_type=True)
-                                )
-                            api_result = ApiResultHandler(res.json())
+                            res = await HttpClientManager.get(
+                                URL_READ.format(post_id),
+                                headers=self.headers,
+                                timeout=plugin_config.preference.timeout,
+                                cookies=self.account.cookies.dict(v2_stoken=True, cookie_type=True)
+                            )
+                            api_result = ApiResultHandler(json_loads(res.content))
                             if api_result.login_expired:
                                 logger.info(
                                     f"米游币任务 - 阅读: 用户 {self.account.display_name} 登录失效")
@@ -258,11 +324,11 @@ class BaseMission:
                     else:
                         logger.exception(f"米游币任务 - 阅读: 请求失败")
                         return MissionStatus(network_error=True)
-                if count != read_times:
-                    await asyncio.sleep(plugin_config.preference.sleep_time)
-            get_post_status, posts = await self.get_posts(retry)
-            if not get_post_status:
-                return MissionStatus(failed_getting_post=True)
+                read_posts.add(post_id)
+            if count < read_times:
+                get_post_status, posts = await self._next_posts(read_posts, retry)
+                if not get_post_status:
+                    return MissionStatus(failed_getting_post=True)
 
         return MissionStatus(success=True)
 
@@ -274,6 +340,7 @@ class BaseMission:
         :param retry: 是否允许重试
         """
         count = 0
+        liked_posts = set()
         get_post_status, posts = await self.get_posts(retry)
         if not get_post_status:
             return MissionStatus(failed_getting_post=True)
@@ -281,20 +348,20 @@ class BaseMission:
             for post_id in posts:
                 if count == like_times:
                     break
+                await self.rate_limiter.acquire()
                 try:
                     async for attempt in get_async_retry(retry):
                         with attempt:
                             headers = HEADERS_OLD.copy()
                             headers["x-rpc-device_id"] = self.account.device_id_android
                             headers["DS"] = generate_ds(platform="android")
-                            async with httpx.AsyncClient() as client:
-                                res = await client.post(
-                                    URL_LIKE, headers=headers,
-                                    json={'is_cancel': False, 'post_id': post_id},
-                                    timeout=plugin_config.preference.timeout,
-                                    cookies=self.account.cookies.dict(v2_stoken=True, cookie_type=True)
-                                )
-                            api_result = ApiResultHandler(res.json())
+                            res = await HttpClientManager.post(
+                                URL_LIKE, headers=headers,
+                                json={'is_cancel': False, 'post_id': post_id},
+                                timeout=plugin_config.preference.timeout,
+                                cookies=self.account.cookies.dict(v2_stoken=True, cookie_type=True)
+                            )
+                            api_result = ApiResultHandler(json_loads(res.content))
                             if api_result.login_expired:
                                 logger.info(
                                     f"米游币任务 - 点赞: 用户 {self.account.display_name} 登录失效")
@@ -318,11 +385,11 @@ class BaseMission:
                     else:
                         logger.exception(f"米游币任务 - 点赞: 请求失败")
                         return MissionStatus(network_error=True)
-                if count != like_times:
-                    await asyncio.sleep(plugin_config.preference.sleep_time)
-            get_post_status, posts = await self.get_posts(retry)
-            if not get_post_status:
-                return MissionStatus(failed_getting_post=True)
+                liked_posts.add(post_id)
+            if count < like_times:
+                get_post_status, posts = await self._next_posts(liked_posts, retry)
+                if not get_post_status:
+                    return MissionStatus(failed_getting_post=True)
 
         return MissionStatus(success=True)
 
@@ -335,20 +402,20 @@ class BaseMission:
         get_post_status, posts = await self.get_posts(retry)
         if not get_post_status or not posts:
             return MissionStatus(failed_getting_post=True)
+        await self.rate_limiter.acquire()
         try:
             async for attempt in get_async_retry(retry):
                 with attempt:
                     headers = HEADERS_OLD.copy()
                     headers["x-rpc-device_id"] = self.account.device_id_android
                     headers["DS"] = generate_ds(platform="android")
-                    async with httpx.AsyncClient() as client:
-                        res = await client.get(
-                            URL_SHARE.format(posts[0]),
-                            headers=headers,
-                            timeout=plugin_config.preference.timeout,
-                            cookies=self.account.cookies.dict(v2_stoken=True, cookie_type=True)
-                        )
-                    api_result = ApiResultHandler(res.json())
+                    res = await HttpClientManager.get(
+                        URL_SHARE.format(posts[0]),
+                        headers=headers,
+                        timeout=plugin_config.preference.timeout,
+                        cookies=self.account.cookies.dict(v2_stoken=True, cookie_type=True)
+                    )
+                    api_result = ApiResultHandler(json_loads(res.content))
                     if api_result.login_expired:
                         logger.info(
                             f"米游币任务 - 分享: 用户 {self.account.display_name} 登录失效")
@@ -459,11 +526,10 @@ async def get_missions(account: UserAccount, retry: bool = True) -> Tuple[BaseAp
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_MISSION, headers=HEADERS_MISSION,
-                                           cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
-                                           timeout=plugin_config.preference.timeout)
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.get(URL_MISSION, headers=HEADERS_MISSION,
+                                                  cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
+                                                  timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.login_expired:
                     logger.info(
                         f"获取米游币任务列表: 用户 {account.display_name} 登录失效")
@@ -496,11 +562,10 @@ async def get_missions_state(account: UserAccount, retry: bool = True) -> Tuple[
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_MISSION_STATE, headers=HEADERS_MISSION,
-                                           cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
-                                           timeout=plugin_config.preference.timeout)
-                api_result = ApiResultHandler(res.json())
+                res = await HttpClientManager.get(URL_MISSION_STATE, headers=HEADERS_MISSION,
+                                                  cookies=account.cookies.dict(v2_stoken=True, cookie_type=True),
+                                                  timeout=plugin_config.preference.timeout)
+                api_result = ApiResultHandler(json_loads(res.content))
                 if api_result.login_expired:
                     logger.info(
                         f"获取米游币任务完成情况: 用户 {account.display_name} 登录失效")
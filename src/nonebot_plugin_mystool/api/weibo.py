@@ -1,10 +1,8 @@
 import re
 from urllib.parse import unquote
 
-import httpx
-
-from ..model import UserAccount
-from ..utils import logger
+from ..model import UserAccount, json_loads
+from ..utils import logger, HttpClientManager
 
 
 def cookie_to_dict(cookie):
@@ -58,9 +56,8 @@ class WeiboCode:
         ticket_id = {}
         for key, value in self.container_id.items():
             url = self.event_url.replace('{container_id}', value)
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url)
-            responses = response.json()
+            response = await HttpClientManager.get(url)
+            responses = json_loads(response.content)
             group = nested_lookup(responses, 'group', fetch_first=True)
             if group:
                 ticket_id[key] = [i
@@ -80,9 +77,8 @@ class WeiboCode:
         data = {
             'ext': '', 'ticket_id': id, 'aid': self.params['aid'], 'from': self.params['from']
         }
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=data, headers=self.headers, cookies=self.cookie)
-        responses = response.json()
+        response = await HttpClientManager.get(url, params=data, headers=self.headers, cookies=self.cookie)
+        responses = json_loads(response.content)
         code = responses['data']['prize_data']['card_no'] if responses['msg'] == 'success' or responses[
             'msg'] == 'recently' else False
         if responses['msg'] == 'fail':
@@ -5,4 +5,5 @@ from .help import *
 from .login import *
 from .plan import *
 from .setting import *
+from .status import *
 from .user_check import *
@@ -1,5 +1,7 @@
 import asyncio
+import hashlib
 import io
+import json
 import os
 import random
 import threading
@@ -19,15 +21,14 @@ from nonebot.matcher import Matcher
 from nonebot.params import ArgPlainText, T_State, CommandArg, Command
 from nonebot_plugin_apscheduler import scheduler
 
-from ..api.common import get_game_record, get_good_detail, get_good_list, good_exchange_sync, \
-    get_device_fp, \
-    good_exchange
+from ..api.common import get_game_record, get_good_detail, get_good_list, get_device_fp, good_exchange, \
+    get_server_time_offset, URL_EXCHANGE, PreparedExchange
 from ..command.common import CommandRegistry
 from ..model import Good, GameRecord, ExchangeStatus, PluginDataManager, plugin_config, UserAccount, \
-    ExchangePlan, ExchangeResult, CommandUsage
+    ExchangePlan, ExchangeResult, CommandUsage, atomic_write
 from ..utils import COMMAND_BEGIN, logger, get_last_command_sep, GeneralMessageEvent, \
     send_private_msg, get_unique_users, \
-    get_all_bind, game_list_to_image
+    get_all_bind, game_list_to_image, HttpClientManager
 
 __all__ = [
     "myb_exchange_plan", "get_good_image", "generate_image"
@@ -221,7 +222,7 @@ async def _(
             for plan in plans:
                 if plan.good.goods_id == good_id:
                     plans.remove(plan)
-                    PluginDataManager.write_plugin_data()
+                    PluginDataManager.write_plugin_data(event.get_user_id())
                     for i in range(plugin_config.preference.exchange_thread_count):
                         scheduler.remove_job(job_id=f"exchange-plan-{hash(plan)}-{i}")
                     await matcher.finish('兑换计划删除成功')
@@ -269,20 +270,10 @@ async def _(
             if not fp_status:
                 await matcher.send(
                     '⚠️从服务器获取device_fp失败！兑换时将在本地生成device_fp。你也可以尝试重新添加兑换计划。')
-        PluginDataManager.write_plugin_data()
+        PluginDataManager.write_plugin_data(event.get_user_id())
 
     # 初始化兑换任务
-    finished.setdefault(plan, [])
-    for i in range(plugin_config.preference.exchange_thread_count):
-        scheduler.add_job(
-            good_exchange_sync,
-            "date",
-            id=f"exchange-plan-{hash(plan)}-{i}",
-            replace_existing=True,
-            args=(plan,),
-            run_date=datetime.fromtimestamp(good.time),
-            max_instances=plugin_config.preference.exchange_thread_count
-        )
+    add_exchange_jobs(plan)
 
     await matcher.finish(
         f'🎉设置兑换计划成功！将于 {plan.good.time_text} 开始兑换，到时将会私聊告知您兑换结果')
@@ -393,7 +384,7 @@ def exchange_notice(event: JobExecutionEvent):
                         )
                     if len(finished[plan]) == plugin_config.preference.exchange_thread_count:
                         del plan
-                        PluginDataManager.write_plugin_data()
+                        PluginDataManager.write_plugin_data(user_id)
 
         else:
             plan = exchange_result.plan
@@ -434,86 +425,198 @@ def exchange_notice(event: JobExecutionEvent):
                     except KeyError:
                         pass
                     else:
-                        PluginDataManager.write_plugin_data()
+                        PluginDataManager.write_plugin_data(user_id)
+
+
+_time_offset: Optional[Tuple[float, float]] = None
+"""最近一次同步的服务器时间偏差 (测量时的 time.perf_counter(), 服务器时间 - 本地时间)"""
+_time_offset_lock: Optional[asyncio.Lock] = None
+"""同步服务器时间的锁，需要在事件循环中创建"""
+
+
+async def get_exchange_time_offset() -> float:
+    """
+    获取服务器时间与本地时间的偏差，同一批兑换任务共享同一次测量结果
+
+    :return: 服务器时间 - 本地时间（单位：秒），无法同步时为 0
+    """
+    global _time_offset, _time_offset_lock
+    if _time_offset_lock is None:
+        _time_offset_lock = asyncio.Lock()
+    async with _time_offset_lock:
+        if _time_offset is None or \
+                time.perf_counter() - _time_offset[0] > plugin_config.preference.exchange_prepare_time * 2:
+            offset, error = await get_server_time_offset(samples=plugin_config.preference.exchange_time_sync_samples)
+            if offset is None:
+                logger.warning(f"{plugin_config.preference.log_head}兑换准备 - 无法同步服务器时间，将使用本地时间")
+                offset = 0
+            else:
+                logger.info(f"{plugin_config.preference.log_head}兑换准备 - "
+                            f"服务器时间偏差 {offset * 1000:+.1f}ms（误差 ±{error * 1000:.1f}ms）")
+            _time_offset = time.perf_counter(), offset
+        return _time_offset[1]
+
+
+async def sleep_until(deadline: float):
+    """
+    非阻塞地等待，直到 ``time.perf_counter()`` 达到 deadline
+
+    先通过 ``asyncio.sleep`` 等待到临近时刻，最后的 20ms 内只让出事件循环进行忙等待，避免定时器调度带来的误差
+
+    :param deadline: 目标时刻（``time.perf_counter()`` 时间）
+    """
+    while (remaining := deadline - time.perf_counter()) > 0:
+        await asyncio.sleep(remaining - 0.02 if remaining > 0.02 else 0)
 
 
-async def exchange_begin(plan: ExchangePlan):
+async def exchange_begin(plan: ExchangePlan, thread: int = 0):
     """
-    到点后执行兑换
+    在开售前开始准备，到点后执行兑换
 
     :param plan: 兑换计划
+    :param thread: 兑换线程序号
     """
-    duration = 0
-    random_x, random_y = plugin_config.preference.exchange_latency
     exchange_status, exchange_result = ExchangeStatus(), None
+    offset = await get_exchange_time_offset()
+    # 同步服务器时间时只会建立一个连接，每个线程再单独预热各自使用的连接
+    try:
+        await HttpClientManager.request("HEAD", URL_EXCHANGE, timeout=plugin_config.preference.timeout,
+                                        rate_limit=False, circuit_breaker=False)
+    except Exception:
+        logger.warning(f"{plugin_config.preference.log_head}兑换准备 - 线程 {thread + 1} 预热连接失败")
+
+    # 提前构建好兑换请求，兑换时只需发送
+    prepared = PreparedExchange(plan)
+    prepared.build_request()
+
+    sale_time = plan.good.time
+    send_time = sale_time + plugin_config.preference.exchange_send_offset - offset
+    await sleep_until(time.perf_counter() + send_time - time.time())
 
     # 在兑换开始后的一段时间内，不断尝试兑换，直到成功（因为太早兑换可能被认定不在兑换时间）
-    while duration < plugin_config.preference.exchange_duration:
-        latency = random.uniform(random_x, random_y)
-        time.sleep(latency)
-        exchange_status, exchange_result = await good_exchange(plan)
+    start = time.perf_counter()
+    random_x, random_y = plugin_config.preference.exchange_latency
+    while True:
+        logger.info(f"{plugin_config.preference.log_head}米游币商品兑换: 用户 {plan.account.display_name} "
+                    f"商品 {plan.good.goods_id} 线程 {thread + 1} 发送兑换请求，"
+                    f"相对开售时间 {(time.time() + offset - sale_time) * 1000:+.1f}ms")
+        exchange_status, exchange_result = await good_exchange(prepared)
         if exchange_status and exchange_result.result:
             break
-        duration += latency
+        if time.perf_counter() - start >= plugin_config.preference.exchange_duration:
+            break
+        await asyncio.sleep(random.uniform(random_x, random_y))
     return exchange_status, exchange_result
 
 
+def add_exchange_jobs(plan: ExchangePlan):
+    """
+    为兑换计划添加兑换任务，任务会在开售前 ``exchange_prepare_time`` 秒开始执行
+
+    :param plan: 兑换计划
+    """
+    finished.setdefault(plan, [])
+    run_date = datetime.fromtimestamp(max(time.time(), plan.good.time - plugin_config.preference.exchange_prepare_time))
+    for i in range(plugin_config.preference.exchange_thread_count):
+        scheduler.add_job(
+            exchange_begin,
+            "date",
+            id=f"exchange-plan-{hash(plan)}-{i}",
+            replace_existing=True,
+            args=(plan, i),
+            run_date=run_date,
+            max_instances=plugin_config.preference.exchange_thread_count
+        )
+
+
 @_driver.on_startup
 async def _():
     """
     启动机器人时自动初始化兑换任务
     """
-    for user_id, user in PluginDataManager.plugin_data.users.items():
-        plans = user.exchange_plans
-        for plan in plans:
-            good_detail_status, good = await get_good_detail(plan.good)
-            if not good_detail_status or not good.time or good.time < time.time():
-                # 若商品不存在则删除
-                # 若重启时兑换超时则删除该兑换
+    user_plans = [
+        (user, plan)
+        for user in PluginDataManager.plugin_data.users.values()
+        for plan in user.exchange_plans
+    ]
+    # 并发获取商品信息，相同商品的请求会被合并
+    results = await asyncio.gather(*(get_good_detail(plan.good) for _, plan in user_plans))
+    removed = False
+    for (user, plan), (good_detail_status, good) in zip(user_plans, results):
+        if not good_detail_status or not good.time or good.time < time.time():
+            # 若商品不存在则删除
+            # 若重启时兑换超时则删除该兑换
+            if plan in user.exchange_plans:
                 user.exchange_plans.remove(plan)
-                PluginDataManager.write_plugin_data()
-                continue
-            else:
-                finished.setdefault(plan, [])
-                for i in range(plugin_config.preference.exchange_thread_count):
-                    scheduler.add_job(
-                        exchange_begin,
-                        "date",
-                        id=f"exchange-plan-{hash(plan)}-{i}",
-                        replace_existing=True,
-                        args=(plan,),
-                        run_date=datetime.fromtimestamp(good.time),
-                        max_instances=plugin_config.preference.exchange_thread_count
-                    )
+                removed = True
+        else:
+            add_exchange_jobs(plan)
+    if removed:
+        PluginDataManager.write_plugin_data()
+
+
+def good_list_fingerprint(good_list: List[Good]) -> str:
+    """
+    计算商品列表图片内容的指纹，指纹相同说明生成的图片也相同
+
+    包括商品ID、名称、价格、兑换时间、库存、预览图，以及图片生成设置
+
+    :param good_list: 商品列表
+    """
+    content = [
+        (good.goods_id, good.general_name, good.price, good.time, good.next_num, good.icon)
+        for good in good_list
+    ]
+    content.append(plugin_config.good_list_image_config.json())
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False, default=str).encode()).hexdigest()
 
 
 def image_process(game: str, _lock: Lock = None):
     """
     生成并保存图片的进程函数
 
+    若商品列表与上次生成时相比没有变化，则直接将旧图片重命名为当日的图片，不再重新生成
+
     :param game: 游戏名
     :param _lock: 进程锁
     :return: 生成成功或无商品返回True，否则返回False
     """
     loop = asyncio.new_event_loop()
-    good_list_status, good_list = loop.run_until_complete(get_good_list(game))
-    if not good_list_status:
-        logger.error(f"{plugin_config.preference.log_head}获取 {game} 分区的商品列表失败，跳过该分区的商品图片生成")
-        return False
-    good_list = list(filter(lambda x: not x.time_end and x.time_limited, good_list))
-    if good_list:
-        logger.info(f"{plugin_config.preference.log_head}正在生成 {game} 分区的商品列表图片")
-        image_bytes = loop.run_until_complete(game_list_to_image(good_list, _lock))
-        if not image_bytes:
+    try:
+        good_list_status, good_list = loop.run_until_complete(get_good_list(game))
+        if not good_list_status:
+            logger.error(f"{plugin_config.preference.log_head}获取 {game} 分区的商品列表失败，跳过该分区的商品图片生成")
             return False
-        date = time.strftime('%m-%d', time.localtime())
-        path = plugin_config.good_list_image_config.SAVE_PATH / f"{date}-{game}.jpg"
-        with open(path, 'wb') as f:
-            f.write(image_bytes)
-        logger.info(f"{plugin_config.preference.log_head}已完成 {game} 分区的商品列表图片生成")
-    else:
-        logger.info(f"{plugin_config.preference.log_head}{game}分区暂时没有可兑换的限时商品，跳过该分区的商品图片生成")
-    return True
+        save_path = plugin_config.good_list_image_config.SAVE_PATH
+        fingerprint_path = save_path / f".{game}.fingerprint"
+        old_images = sorted(save_path.glob(f"*-{game}.jpg"), key=lambda x: x.stat().st_mtime)
+        good_list = list(filter(lambda x: not x.time_end and x.time_limited, good_list))
+        if good_list:
+            date = time.strftime('%m-%d', time.localtime())
+            path = save_path / f"{date}-{game}.jpg"
+            fingerprint = good_list_fingerprint(good_list)
+            if old_images and fingerprint_path.is_file() and fingerprint_path.read_text() == fingerprint:
+                os.replace(old_images.pop(), path)
+                logger.info(f"{plugin_config.preference.log_head}{game} 分区的商品列表没有变化，沿用已生成的图片")
+            else:
+                logger.info(f"{plugin_config.preference.log_head}正在生成 {game} 分区的商品列表图片")
+                image_bytes = loop.run_until_complete(game_list_to_image(good_list, _lock))
+                if not image_bytes:
+                    return False
+                atomic_write(path, image_bytes)
+                atomic_write(fingerprint_path, fingerprint)
+                logger.info(f"{plugin_config.preference.log_head}已完成 {game} 分区的商品列表图片生成")
+            for old_image in filter(lambda x: x != path, old_images):
+                os.remove(old_image)
+        else:
+            for old_image in old_images:
+                os.remove(old_image)
+            logger.info(f"{plugin_config.preference.log_head}{game}分区暂时没有可兑换的限时商品，跳过该分区的商品图片生成")
+        return True
+    finally:
+        # 关闭该事件循环中创建的连接池和事件循环本身，否则连接会一直保持打开
+        loop.run_until_complete(HttpClientManager.close_all())
+        loop.close()
 
 
 def generate_image(is_auto=True, callback: Callable[[bool], Any] = None):
@@ -523,16 +626,10 @@ def generate_image(is_auto=True, callback: Callable[[bool], Any] = None):
     :param is_auto: True为每日自动生成，False为用户手动更新
     :param callback: 回调函数，参数为生成成功与否
     """
-    for root, _, files in os.walk(plugin_config.good_list_image_config.SAVE_PATH, topdown=False):
-        for name in files:
-            date = time.strftime('%m-%d', time.localtime())
-            # 若图片开头为当日日期，则退出函数不执行
-            if name.startswith(date):
-                if is_auto:
-                    return
-            # 删除旧图片
-            if name.endswith('.jpg'):
-                os.remove(os.path.join(root, name))
+    # 若已有当日日期开头的图片，则退出函数不执行（旧图片会在各分区生成时删除或重命名沿用）
+    date = time.strftime('%m-%d', time.localtime())
+    if is_auto and any(plugin_config.good_list_image_config.SAVE_PATH.glob(f"{date}-*.jpg")):
+        return
 
     if plugin_config.good_list_image_config.MULTI_PROCESS:
         _lock: Lock = Manager().Lock()
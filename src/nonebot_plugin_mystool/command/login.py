@@ -11,7 +11,8 @@ from nonebot.params import ArgPlainText, T_State
 
 from ..api.common import get_login_ticket_by_captcha, get_multi_token_by_login_ticket, \
     get_stoken_v2_by_v1, \
-    get_ltoken_by_stoken, get_cookie_token_by_stoken, get_device_fp, create_mmt, create_mobile_captcha
+    get_ltoken_by_stoken, get_cookie_token_by_stoken, get_device_fp, create_mmt, create_mobile_captcha, \
+    invalidate_account_cache
 from ..command.common import CommandRegistry
 from ..model import CreateMobileCaptchaStatus, PluginDataManager, plugin_config, UserAccount, UserData, CommandUsage
 from ..utils import logger, COMMAND_BEGIN, GeneralMessageEvent, GeneralPrivateMessageEvent, \
@@ -153,7 +154,7 @@ async def _(event: Union[GeneralPrivateMessageEvent], state: T_State, captcha: s
             fp_status, account.device_fp = await get_device_fp(device_id)
             if fp_status:
                 logger.success(f"用户 {cookies.bbs_uid} 成功获取 device_fp: {account.device_fp}")
-            PluginDataManager.write_plugin_data()
+            PluginDataManager.write_plugin_data(user_id)
 
             # 2. 通过 login_ticket 获取 stoken 和 ltoken
             if login_status or account:
@@ -161,29 +162,30 @@ async def _(event: Union[GeneralPrivateMessageEvent], state: T_State, captcha: s
                 if login_status:
                     logger.success(f"用户 {phone_number} 成功获取 stoken: {cookies.stoken}")
                     account.cookies.update(cookies)
-                    PluginDataManager.write_plugin_data()
+                    PluginDataManager.write_plugin_data(user_id)
 
                     # 3. 通过 stoken_v1 获取 stoken_v2 和 mid
                     login_status, cookies = await get_stoken_v2_by_v1(account.cookies, device_id)
                     if login_status:
                         logger.success(f"用户 {phone_number} 成功获取 stoken_v2: {cookies.stoken_v2}")
                         account.cookies.update(cookies)
-                        PluginDataManager.write_plugin_data()
+                        PluginDataManager.write_plugin_data(user_id)
 
                         # 4. 通过 stoken_v2 获取 ltoken
                         login_status, cookies = await get_ltoken_by_stoken(account.cookies, device_id)
                         if login_status:
                             logger.success(f"用户 {phone_number} 成功获取 ltoken: {cookies.ltoken}")
                             account.cookies.update(cookies)
-                            PluginDataManager.write_plugin_data()
+                            PluginDataManager.write_plugin_data(user_id)
 
                             # 5. 通过 stoken_v2 获取 cookie_token
                             login_status, cookies = await get_cookie_token_by_stoken(account.cookies, device_id)
                             if login_status:
                                 logger.success(f"用户 {phone_number} 成功获取 cookie_token: {cookies.cookie_token}")
                                 account.cookies.update(cookies)
-                                PluginDataManager.write_plugin_data()
+                                PluginDataManager.write_plugin_data(user_id)
 
+                                invalidate_account_cache(account)
                                 logger.success(f"{plugin_config.preference.log_head}米游社账户 {phone_number} 绑定成功")
                                 await get_cookie.finish(f"🎉米游社账户 {phone_number} 绑定成功")
 
@@ -1,18 +1,19 @@
 import asyncio
 import threading
-from typing import Union, Optional, Iterable, Dict
+import time
+from datetime import datetime, timedelta, date
+from functools import partial
+from typing import Union, Optional, Iterable, Dict, List, Callable, Awaitable, Type
 
 from nonebot import on_command, get_adapters
-from nonebot.adapters.onebot.v11 import MessageSegment as OneBotV11MessageSegment, Adapter as OneBotV11Adapter, \
-    MessageEvent as OneBotV11MessageEvent
-from nonebot.adapters.qq import MessageSegment as QQGuildMessageSegment, Adapter as QQGuildAdapter, \
-    MessageEvent as QQGuildMessageEvent
+from nonebot.adapters.onebot.v11 import Adapter as OneBotV11Adapter, MessageEvent as OneBotV11MessageEvent
+from nonebot.adapters.qq import Adapter as QQGuildAdapter, MessageEvent as QQGuildMessageEvent, \
+    MessageSegment as QQGuildMessageSegment
 from nonebot.adapters.qq.exception import AuditException
 from nonebot.exception import ActionFailed
 from nonebot.internal.matcher import Matcher
 from nonebot.params import CommandArg
 from nonebot_plugin_apscheduler import scheduler
-from nonebot_plugin_saa import Image
 from pydantic import BaseModel
 
 from ..api import BaseGameSign
@@ -22,10 +23,9 @@ from ..api.weibo import WeiboCode
 from ..command.common import CommandRegistry
 from ..command.exchange import generate_image
 from ..model import (MissionStatus, PluginDataManager, plugin_config, UserData, CommandUsage, GenshinNoteNotice,
-                     StarRailNoteNotice)
-from ..utils import get_file, logger, COMMAND_BEGIN, GeneralMessageEvent, GeneralGroupMessageEvent, \
-    send_private_msg, get_all_bind, \
-    get_unique_users, get_validate, read_admin_list
+                     StarRailNoteNotice, UserAccount, GenshinNote, StarRailNote, MissionState)
+from ..utils import logger, COMMAND_BEGIN, GeneralMessageEvent, GeneralGroupMessageEvent, \
+    get_all_bind, get_unique_users, get_validate, read_admin_list, AwardIcon, AwardIconCache, NotificationBatch
 
 __all__ = [
     "manually_game_sign", "manually_bbs_sign", "manually_genshin_note_check", "manually_starrail_note_check"
@@ -137,11 +137,103 @@ class NoteNoticeStatus(BaseModel):
     """
     genshin = GenshinNoteNotice()
     starrail = StarRailNoteNotice()
+    genshin_next_check: float = 0
+    """下次自动检查原神便笺的时间戳"""
+    starrail_next_check: float = 0
+    """下次自动检查星铁便笺的时间戳"""
+    rogue_score_notice_date: Optional[date] = None
+    """上次发送模拟宇宙积分提醒的日期，每天最多提醒一次"""
 
 
 note_notice_status: Dict[str, NoteNoticeStatus] = {}
 """记录账号对应的便笺通知状态"""
 
+RESIN_RECOVERY_SECONDS = 8 * 60
+"""原神每恢复1点树脂所需时间（单位：秒）"""
+STAMINA_RECOVERY_SECONDS = 6 * 60
+"""星铁每恢复1点开拓力所需时间（单位：秒）"""
+NOTE_CHECK_DELAY = 60
+"""预测的提醒时间点之后，再延迟多久进行检查（单位：秒），防止检查时还差一点点未达到"""
+ROGUE_SCORE_NOTICE_HOUR = 20
+"""每天从几点开始进行模拟宇宙积分提醒"""
+NOTE_CHECK_RETRY_INTERVAL = 5 * 60
+"""获取便笺失败后，间隔多久重新检查（单位：秒）"""
+
+
+def next_note_check(*countdowns: Optional[float]) -> float:
+    """
+    根据距离各个提醒条件满足的剩余时间，计算下次检查便笺的时间戳
+
+    :param countdowns: 各个提醒条件的剩余时间（单位：秒），为 None 说明不会再满足
+    :return: 下次检查的时间戳，与现在的间隔不超过 ``note_check_max_interval``
+    """
+    max_interval = plugin_config.preference.note_check_max_interval * 60
+    countdowns = [max(x, 0) + NOTE_CHECK_DELAY for x in countdowns if x is not None]
+    return time.time() + min(countdowns + [max_interval])
+
+
+def failed_note_check(permanent: bool) -> float:
+    """
+    获取便笺失败时，计算下次检查便笺的时间戳
+
+    :param permanent: 失败原因是否短时间内不会消失（如没有绑定游戏账户），是则按最大间隔检查，否则稍后重试
+    :return: 下次检查的时间戳
+    """
+    if permanent:
+        return next_note_check()
+    return time.time() + NOTE_CHECK_RETRY_INTERVAL
+
+
+def genshin_note_countdowns(account: UserAccount, note: GenshinNote) -> List[Optional[float]]:
+    """
+    计算原神便笺中，距离各个提醒条件满足的剩余时间
+
+    :param account: 账号数据
+    :param note: 原神便笺数据
+    """
+    countdowns = []
+    if None not in (note.resin_recovery_time, note.current_resin, note.max_resin):
+        if note.current_resin < account.user_resin_threshold:
+            countdowns.append(
+                note.resin_recovery_time - (note.max_resin - account.user_resin_threshold) * RESIN_RECOVERY_SECONDS)
+        if note.current_resin < note.max_resin:
+            countdowns.append(note.resin_recovery_time)
+    if note.home_coin_recovery_time is not None and note.current_home_coin != note.max_home_coin:
+        countdowns.append(note.home_coin_recovery_time)
+    try:
+        if note.transformer and note.transformer["obtained"] and not note.transformer["recovery_time"]["reached"]:
+            recovery_time = note.transformer["recovery_time"]
+            countdowns.append(recovery_time["Day"] * 86400 + recovery_time["Hour"] * 3600 +
+                              recovery_time["Minute"] * 60 + recovery_time["Second"])
+    except KeyError:
+        pass
+    return countdowns
+
+
+def starrail_note_countdowns(account: UserAccount, note: StarRailNote) -> List[Optional[float]]:
+    """
+    计算星铁便笺中，距离各个提醒条件满足的剩余时间
+
+    :param account: 账号数据
+    :param note: 星铁便笺数据
+    """
+    countdowns = []
+    if None not in (note.stamina_recover_time, note.current_stamina, note.max_stamina):
+        if note.current_stamina < account.user_stamina_threshold:
+            countdowns.append(
+                note.stamina_recover_time - (note.max_stamina - account.user_stamina_threshold)
+                * STAMINA_RECOVERY_SECONDS)
+        if note.current_stamina < note.max_stamina:
+            countdowns.append(note.stamina_recover_time)
+    # 模拟宇宙积分未打满时，需要在提醒时间检查一次
+    if note.current_rogue_score != note.max_rogue_score:
+        now = datetime.now()
+        notice_time = now.replace(hour=ROGUE_SCORE_NOTICE_HOUR, minute=0, second=0, microsecond=0)
+        if notice_time <= now:
+            notice_time += timedelta(days=1)
+        countdowns.append((notice_time - now).total_seconds() - NOTE_CHECK_DELAY)
+    return countdowns
+
 manually_genshin_note_check = on_command(
     plugin_config.preference.command_start + '原神便笺',
     aliases={
@@ -211,51 +303,70 @@ async def perform_game_sign(
         user: UserData,
         user_ids: Iterable[str],
         matcher: Matcher = None,
-        event: Union[GeneralMessageEvent] = None
+        event: Union[GeneralMessageEvent] = None,
+        batch: NotificationBatch = None
 ):
     """
     执行游戏签到函数，并发送给用户签到消息。
 
+    不同账户、不同游戏的签到并发进行，签到请求的冷却由按 Host 的限速器控制。
+    消息会先暂存，最后按账户、游戏的顺序发送，与逐个签到时的顺序一致。
+
     :param user: 用户数据
     :param user_ids: 发送通知的所有用户ID
     :param matcher: 事件响应器
     :param event: 事件
+    :param batch: 暂存通知的对象，为None则在签到结束后直接发送通知
     """
     failed_accounts = []
-    for account in user.accounts.values():
-        # 自动签到时，要求用户打开了签到功能；手动签到时都可以调用执行。
-        if not matcher and not account.enable_game_sign:
-            continue
-        signed = False
-        """是否已经完成过签到"""
-        game_record_status, records = await get_game_record(account)
-        if not game_record_status:
-            if matcher:
-                await matcher.send(f"⚠️账户 {account.display_name} 获取游戏账号信息失败，请重新尝试")
-            else:
-                for user_id in user_ids:
-                    await send_private_msg(
-                        user_id=user_id,
-                        message=f"⚠️账户 {account.display_name} 获取游戏账号信息失败，请重新尝试"
-                    )
-            continue
-        games_has_record = []
-        for class_type in BaseGameSign.available_game_signs:
-            signer = class_type(account, records)
-            if not signer.has_record:
-                continue
-            else:
-                games_has_record.append(signer)
+    semaphore = asyncio.Semaphore(plugin_config.preference.game_sign_concurrency)
+    own_batch = batch is None
+    if own_batch:
+        batch = NotificationBatch()
+
+    async def send_text(message: str):
+        if matcher:
+            await matcher.send(message)
+        else:
+            for user_id in user_ids:
+                batch.add(user_id, message)
+
+    async def send_result(msg: str, icon: Optional[AwardIcon]):
+        onebot_img_msg, saa_img = "", ""
+        if icon:
+            onebot_img_msg, saa_img = icon.onebot_segment, icon.saa_image
+        if matcher:
+            try:
+                if isinstance(event, OneBotV11MessageEvent):
+                    await matcher.send(msg + onebot_img_msg)
+                elif isinstance(event, QQGuildMessageEvent):
+                    await matcher.send(msg)
+                    if icon:
+                        await matcher.send(QQGuildMessageSegment.file_image(icon.content))
+            except (ActionFailed, AuditException):
+                pass
+        else:
+            for adapter in get_adapters().values():
+                if isinstance(adapter, OneBotV11Adapter):
+                    for user_id in user_ids:
+                        batch.add(user_id, msg + saa_img, use=adapter)
+                elif isinstance(adapter, QQGuildAdapter):
+                    for user_id in user_ids:
+                        batch.add(user_id, msg, use=adapter)
+                        if icon:
+                            batch.add(user_id, icon.saa_image, use=adapter)
+
+    async def game_sign(account: UserAccount, signer: BaseGameSign) -> List[Callable[[], Awaitable]]:
+        """
+        对单个游戏账号进行签到，返回待发送的消息
+        """
+        outbox: List[Callable[[], Awaitable]] = []
+        async with semaphore:
+            signed = False
+            """是否已经完成过签到"""
             get_info_status, info = await signer.get_info(account.platform)
             if not get_info_status:
-                if matcher:
-                    await matcher.send(f"⚠️账户 {account.display_name} 获取签到记录失败")
-                else:
-                    for user_id in user_ids:
-                        await send_private_msg(
-                            user_id=user_id,
-                            message=f"⚠️账户 {account.display_name} 获取签到记录失败"
-                        )
+                outbox.append(partial(send_text, f"⚠️账户 {account.display_name} 获取签到记录失败"))
             else:
                 signed = info.is_sign
 
@@ -264,6 +375,7 @@ async def perform_game_sign(
                 sign_status, mmt_data = await signer.sign(account.platform)
                 if sign_status.need_verify:
                     if plugin_config.preference.geetest_url:
+                        # 提示消息直接发送，不必等待签到结果
                         if matcher:
                             await matcher.send("⏳正在尝试完成人机验证，请稍后...")
                         geetest_result = await get_validate(mmt_data.gt, mmt_data.challenge)
@@ -277,19 +389,12 @@ async def perform_game_sign(
                                    "请尝试使用命令『/账号设置』更改设备平台，若仍失败请手动前往米游社签到")
                     else:
                         message = f"⚠️账户 {account.display_name} 🎮『{signer.name}』签到失败，请稍后再试"
-                    if matcher:
-                        await matcher.send(message)
-                    elif user.enable_notice:
-                        for user_id in user_ids:
-                            await send_private_msg(user_id=user_id, message=message)
-                    await asyncio.sleep(plugin_config.preference.sleep_time)
-                    continue
-
-                await asyncio.sleep(plugin_config.preference.sleep_time)
+                    outbox.append(partial(send_text, message))
+                    return outbox
 
             # 用户打开通知或手动签到时，进行通知
             if user.enable_notice or matcher:
-                onebot_img_msg, saa_img, qq_guild_img_msg = "", "", ""
+                icon = None
                 get_info_status, info = await signer.get_info(account.platform)
                 get_award_status, awards = await signer.get_rewards()
                 if not get_info_status or not get_award_status:
@@ -305,58 +410,119 @@ async def perform_game_sign(
                               "\n\n🎁今日签到奖励：" \
                               f"\n{award.name} * {award.cnt}" \
                               f"\n\n📅本月签到次数：{info.total_sign_day}"
-                        img_file = await get_file(award.icon)
-                        onebot_img_msg = OneBotV11MessageSegment.image(img_file)
-                        saa_img = Image(img_file)
-                        qq_guild_img_msg = QQGuildMessageSegment.file_image(img_file)
+                        icon = await AwardIconCache.get(award.icon)
                     else:
                         msg = (f"⚠️账户 {account.display_name} 🎮『{signer.name}』签到失败！请尝试重新签到，"
                                "若多次失败请尝试重新登录绑定账户")
-                if matcher:
-                    try:
-                        if isinstance(event, OneBotV11MessageEvent):
-                            await matcher.send(msg + onebot_img_msg)
-                        elif isinstance(event, QQGuildMessageEvent):
-                            await matcher.send(msg)
-                            await matcher.send(qq_guild_img_msg)
-                    except (ActionFailed, AuditException):
-                        pass
-                else:
-                    for adapter in get_adapters().values():
-                        if isinstance(adapter, OneBotV11Adapter):
-                            for user_id in user_ids:
-                                await send_private_msg(use=adapter, user_id=user_id, message=msg + saa_img)
-                        elif isinstance(adapter, QQGuildAdapter):
-                            for user_id in user_ids:
-                                await send_private_msg(use=adapter, user_id=user_id, message=msg)
-                                await send_private_msg(use=adapter, user_id=user_id, message=qq_guild_img_msg)
-            await asyncio.sleep(plugin_config.preference.sleep_time)
+                outbox.append(partial(send_result, msg, icon))
+        return outbox
 
+    async def account_sign(account: UserAccount) -> List[Callable[[], Awaitable]]:
+        """
+        对账户下的所有游戏账号进行签到，返回按游戏顺序排列的待发送消息
+        """
+        game_record_status, records = await get_game_record(account)
+        if not game_record_status:
+            return [partial(send_text, f"⚠️账户 {account.display_name} 获取游戏账号信息失败，请重新尝试")]
+        signers = [class_type(account, records) for class_type in BaseGameSign.available_game_signs]
+        games_has_record = [signer for signer in signers if signer.has_record]
         if not games_has_record:
-            if matcher:
-                await matcher.send(f"⚠️您的米游社账户 {account.display_name} 下不存在任何游戏账号，已跳过签到")
-            else:
-                for user_id in user_ids:
-                    await send_private_msg(
-                        user_id=user_id,
-                        message=f"⚠️您的米游社账户 {account.display_name} 下不存在任何游戏账号，已跳过签到"
-                    )
+            return [partial(send_text, f"⚠️您的米游社账户 {account.display_name} 下不存在任何游戏账号，已跳过签到")]
+        outboxes = await asyncio.gather(*map(partial(game_sign, account), games_has_record))
+        return [send for outbox in outboxes for send in outbox]
+
+    # 自动签到时，要求用户打开了签到功能；手动签到时都可以调用执行。
+    tasks = [
+        asyncio.create_task(account_sign(account))
+        for account in user.accounts.values()
+        if matcher or account.enable_game_sign
+    ]
+    try:
+        # 按账户顺序发送消息，先完成的账户不必等待后面的账户
+        for task in tasks:
+            for send in await task:
+                await send()
+    finally:
+        for task in tasks:
+            task.cancel()
+        if own_batch:
+            batch.flush()
 
     # 如果全部登录失效，则关闭通知
     if len(failed_accounts) == len(user.accounts):
         user.enable_notice = False
-        PluginDataManager.write_plugin_data()
+        PluginDataManager.write_plugin_data(*user_ids)
+
 
+RUNNABLE_MISSIONS = (BaseMission.SIGN, BaseMission.VIEW, BaseMission.LIKE, BaseMission.SHARE)
+"""可以执行的米游币任务，任务完成情况中可能还有其他无法执行的任务"""
 
-async def perform_bbs_sign(user: UserData, user_ids: Iterable[str], matcher: Matcher = None):
+
+def missions_finished(missions_state: MissionState) -> bool:
+    """
+    可以执行的米游币任务是否都已完成
+
+    :param missions_state: 米游币任务完成情况
+    """
+    return all(
+        current >= mission.threshold
+        for key_name, (mission, current) in missions_state.state_dict.items()
+        if key_name in RUNNABLE_MISSIONS
+    )
+
+
+def mission_quota(missions_state: MissionState, partitions: int) -> Dict[str, int]:
+    """
+    根据米游币任务完成情况，计算当前分区需要执行的各类任务次数
+
+    剩余次数平均分配到剩余的分区中（向上取整，靠前的分区分配得更多），已完成的任务、无法执行的任务不会分配
+
+    :param missions_state: 米游币任务完成情况
+    :param partitions: 剩余的分区数（包括当前分区）
+    :return: {mission_key: 当前分区需要执行的次数}
+    """
+    partitions = max(partitions, 1)
+    return {
+        key_name: -(-max(mission.threshold - current, 0) // partitions)
+        for key_name, (mission, current) in missions_state.state_dict.items()
+        if key_name in RUNNABLE_MISSIONS
+    }
+
+
+def deduct_mission_quota(missions_state: MissionState, quota: Dict[str, int]) -> MissionState:
+    """
+    无法获取最新的任务完成情况时，假设分配的任务都已经完成，估算新的完成情况
+
+    :param missions_state: 执行前的米游币任务完成情况
+    :param quota: 已执行的各类任务次数
+    """
+    return MissionState(
+        current_myb=missions_state.current_myb,
+        state_dict={
+            key_name: (mission, current + quota.get(key_name, 0))
+            for key_name, (mission, current) in missions_state.state_dict.items()
+        }
+    )
+
+
+async def perform_bbs_sign(
+        user: UserData,
+        user_ids: Iterable[str],
+        matcher: Matcher = None,
+        batch: NotificationBatch = None
+):
     """
     执行米游币任务函数，并发送给用户任务执行消息。
 
     :param user: 用户数据
     :param user_ids: 发送通知的所有用户ID
     :param matcher: 事件响应器
+    :param batch: 暂存通知的对象，为None则在任务结束后直接发送通知
     """
     failed_accounts = []
+    own_batch = batch is None
+    if own_batch:
+        batch = NotificationBatch()
     for account in user.accounts.values():
         # 自动执行米游币任务时，要求用户打开了米游币任务功能；手动执行米游币任务时都可以调用执行。
         if not matcher and not account.enable_mission:
@@ -369,27 +535,22 @@ async def perform_bbs_sign(user: UserData, user_ids: Iterable[str], matcher: Mat
                     await matcher.send(f'⚠️账户 {account.display_name} 登录失效，请重新登录')
                 else:
                     for user_id in user_ids:
-                        await send_private_msg(
-                            user_id=user_id,
-                            message=f'⚠️账户 {account.display_name} 登录失效，请重新登录'
-                        )
+                        batch.add(user_id, f'⚠️账户 {account.display_name} 登录失效，请重新登录')
             if matcher:
                 await matcher.send(f'⚠️账户 {account.display_name} 获取任务完成情况请求失败，你可以手动前往App查看')
             else:
                 for user_id in user_ids:
-                    await send_private_msg(
-                        user_id=user_id,
-                        message=f'⚠️账户 {account.display_name} 获取任务完成情况请求失败，你可以手动前往App查看'
-                    )
+                    batch.add(user_id, f'⚠️账户 {account.display_name} 获取任务完成情况请求失败，你可以手动前往App查看')
             continue
         myb_before_mission = missions_state.current_myb
 
         # 在此处进行判断。因为如果在多个分区执行任务，会在完成之前就已经达成米游币任务目标，导致其他分区任务不会执行。
-        finished = all(current == mission.threshold for mission, current in missions_state.state_dict.values())
+        finished = missions_finished(missions_state)
         if not finished:
             if not account.mission_games:
                 await matcher.send(
                     f'⚠️🆔账户 {account.display_name} 未设置米游币任务目标分区，将跳过执行')
+            mission_types: List[Type[BaseMission]] = []
             for class_name in account.mission_games:
                 class_type = BaseMission.available_games.get(class_name)
                 if not class_type:
@@ -397,37 +558,57 @@ async def perform_bbs_sign(user: UserData, user_ids: Iterable[str], matcher: Mat
                         await matcher.send(
                             f'⚠️🆔账户 {account.display_name} 米游币任务目标分区『{class_name}』未找到，将跳过该分区')
                     continue
+                mission_types.append(class_type)
+
+            def result_mark(mission_status: Optional[MissionStatus]):
+                if mission_status is None:
+                    return "-"
+                return "✓" if mission_status else "✕"
+
+            current_state = missions_state
+            for i, class_type in enumerate(mission_types):
                 mission_obj = class_type(account)
+                # 剩余的任务次数分配到剩余的分区中执行，而不是在每个分区都重复执行
+                quota = mission_quota(current_state, len(mission_types) - i)
+                if not any(quota.values()):
+                    break
                 if matcher:
                     await matcher.send(f'🆔账户 {account.display_name} ⏳开始在分区『{class_type.name}』执行米游币任务...')
 
-                # 执行任务
-                sign_status, read_status, like_status, share_status = (
-                    MissionStatus(),
-                    MissionStatus(),
-                    MissionStatus(),
-                    MissionStatus()
-                )
-                sign_points: Optional[int] = None
-                for key_name in missions_state.state_dict:
-                    if key_name == BaseMission.SIGN:
-                        sign_status, sign_points = await mission_obj.sign()
-                    elif key_name == BaseMission.VIEW:
-                        read_status = await mission_obj.read()
-                    elif key_name == BaseMission.LIKE:
-                        like_status = await mission_obj.like()
-                    elif key_name == BaseMission.SHARE:
-                        share_status = await mission_obj.share()
+                # 执行任务，各类任务同时进行，操作频率由账户的限速器控制
+                mission_runs = {}
+                if quota.get(BaseMission.SIGN):
+                    mission_runs[BaseMission.SIGN] = mission_obj.sign()
+                if quota.get(BaseMission.VIEW):
+                    mission_runs[BaseMission.VIEW] = mission_obj.read(quota[BaseMission.VIEW])
+                if quota.get(BaseMission.LIKE):
+                    mission_runs[BaseMission.LIKE] = mission_obj.like(quota[BaseMission.LIKE])
+                if quota.get(BaseMission.SHARE):
+                    mission_runs[BaseMission.SHARE] = mission_obj.share()
+                results = dict(zip(mission_runs, await asyncio.gather(*mission_runs.values())))
+                sign_status, sign_points = results.get(BaseMission.SIGN, (None, None))
 
                 if matcher:
                     await matcher.send(
                         f"🆔账户 {account.display_name} 🎮『{class_type.name}』米游币任务执行情况：\n"
-                        f"📅签到：{'✓' if sign_status else '✕'} +{sign_points or '0'} 米游币🪙\n"
-                        f"📰阅读：{'✓' if read_status else '✕'}\n"
-                        f"❤️点赞：{'✓' if like_status else '✕'}\n"
-                        f"↗️分享：{'✓' if share_status else '✕'}"
+                        f"📅签到：{result_mark(sign_status)} +{sign_points or '0'} 米游币🪙\n"
+                        f"📰阅读：{result_mark(results.get(BaseMission.VIEW))}\n"
+                        f"❤️点赞：{result_mark(results.get(BaseMission.LIKE))}\n"
+                        f"↗️分享：{result_mark(results.get(BaseMission.SHARE))}"
                     )
 
+                # 根据最新的完成情况决定剩余分区的任务，若已经达成所有任务目标，则不必在剩余的分区继续执行
+                if i < len(mission_types) - 1:
+                    current_state_status, new_state = await get_missions_state(account)
+                    if current_state_status:
+                        current_state = new_state
+                    else:
+                        current_state = deduct_mission_quota(current_state, quota)
+                    if missions_finished(current_state):
+                        logger.info(f"{plugin_config.preference.log_head}米游币任务 - 账户 {account.display_name} "
+                                    f"已完成今日所有任务，跳过剩余分区")
+                        break
+
         # 用户打开通知或手动任务时，进行通知
         if user.enable_notice or matcher:
             missions_state_status, missions_state = await get_missions_state(account)
@@ -437,20 +618,14 @@ async def perform_bbs_sign(user: UserData, user_ids: Iterable[str], matcher: Mat
                         await matcher.send(f'⚠️账户 {account.display_name} 登录失效，请重新登录')
                     else:
                         for user_id in user_ids:
-                            await send_private_msg(
-                                user_id=user_id,
-                                message=f'⚠️账户 {account.display_name} 登录失效，请重新登录'
-                            )
+                            batch.add(user_id, f'⚠️账户 {account.display_name} 登录失效，请重新登录')
                     continue
                 if matcher:
                     await matcher.send(
                         f'⚠️账户 {account.display_name} 获取任务完成情况请求失败，你可以手动前往App查看')
                 else:
                     for user_id in user_ids:
-                        await send_private_msg(
-                            user_id=user_id,
-                            message=f'⚠️账户 {account.display_name} 获取任务完成情况请求失败，你可以手动前往App查看'
-                        )
+                        batch.add(user_id, f'⚠️账户 {account.display_name} 获取任务完成情况请求失败，你可以手动前往App查看')
                 continue
             if all(current == mission.threshold for mission, current in missions_state.state_dict.values()):
                 notice_string = "🎉已完成今日米游币任务"
@@ -478,27 +653,45 @@ async def perform_bbs_sign(user: UserData, user_ids: Iterable[str], matcher: Mat
                 await matcher.send(msg)
             else:
                 for user_id in user_ids:
-                    await send_private_msg(user_id=user_id, message=msg)
+                    batch.add(user_id, msg)
+    if own_batch:
+        batch.flush()
 
     # 如果全部登录失效，则关闭通知
     if len(failed_accounts) == len(user.accounts):
         user.enable_notice = False
-        PluginDataManager.write_plugin_data()
+        PluginDataManager.write_plugin_data(*user_ids)
 
 
-async def genshin_note_check(user: UserData, user_ids: Iterable[str], matcher: Matcher = None):
+async def genshin_note_check(
+        user: UserData,
+        user_ids: Iterable[str],
+        matcher: Matcher = None,
+        batch: NotificationBatch = None
+):
     """
     查看原神实时便笺函数，并发送给用户任务执行消息。
 
     :param user: 用户对象
     :param user_ids: 发送通知的所有用户ID
     :param matcher: 事件响应器
+    :param batch: 暂存通知的对象，为None则在检查结束后直接发送通知
     """
+    own_batch = batch is None
+    if own_batch:
+        batch = NotificationBatch()
     for account in user.accounts.values():
         note_notice_status.setdefault(account.bbs_uid, NoteNoticeStatus())
         genshin_notice = note_notice_status[account.bbs_uid].genshin
+        if not matcher and time.time() < note_notice_status[account.bbs_uid].genshin_next_check:
+            continue
         if account.enable_resin or matcher:
             genshin_board_status, note = await genshin_note(account)
+            if genshin_board_status:
+                next_check = next_note_check(*genshin_note_countdowns(account, note))
+            else:
+                next_check = failed_note_check(genshin_board_status.no_genshin_account)
+            note_notice_status[account.bbs_uid].genshin_next_check = next_check
             if not genshin_board_status:
                 if matcher:
                     if genshin_board_status.login_expired:
@@ -519,7 +712,7 @@ async def genshin_note_check(user: UserData, user_ids: Iterable[str], matcher: M
                 if note.current_resin >= account.user_resin_threshold:
                     # 防止重复提醒
                     if not genshin_notice.current_resin_full:
-                        if note.current_resin == 160:
+                        if note.current_resin >= note.max_resin:
                             genshin_notice.current_resin_full = True
                             msg += '❕您的树脂已经满啦\n'
                             do_notice = True
@@ -557,11 +750,11 @@ async def genshin_note_check(user: UserData, user_ids: Iterable[str], matcher: M
 
                 if not do_notice:
                     logger.info(f"原神实时便笺：账户 {account.display_name} 树脂:{note.current_resin},未满足推送条件")
-                    return
+                    continue
 
             msg += "❖原神·实时便笺❖" \
                    f"\n🆔账户 {account.display_name}" \
-                   f"\n⏳树脂数量：{note.current_resin} / 160" \
+                   f"\n⏳树脂数量：{note.current_resin} / {note.max_resin}" \
                    f"\n⏱️树脂{note.resin_recovery_text}" \
                    f"\n🕰️探索派遣：{note.current_expedition_num} / {note.max_expedition_num}" \
                    f"\n📅每日委托：{4 - note.finished_task_num} 个任务未完成" \
@@ -571,22 +764,40 @@ async def genshin_note_check(user: UserData, user_ids: Iterable[str], matcher: M
                 await matcher.send(msg)
             else:
                 for user_id in user_ids:
-                    await send_private_msg(user_id=user_id, message=msg)
+                    batch.add(user_id, msg)
+    if own_batch:
+        batch.flush()
 
 
-async def starrail_note_check(user: UserData, user_ids: Iterable[str], matcher: Matcher = None):
+async def starrail_note_check(
+        user: UserData,
+        user_ids: Iterable[str],
+        matcher: Matcher = None,
+        batch: NotificationBatch = None
+):
     """
     查看星铁实时便笺函数，并发送给用户任务执行消息。
 
     :param user: 用户对象
     :param user_ids: 发送通知的所有用户ID
     :param matcher: 事件响应器
+    :param batch: 暂存通知的对象，为None则在检查结束后直接发送通知
     """
+    own_batch = batch is None
+    if own_batch:
+        batch = NotificationBatch()
     for account in user.accounts.values():
         note_notice_status.setdefault(account.bbs_uid, NoteNoticeStatus())
         starrail_notice = note_notice_status[account.bbs_uid].starrail
+        if not matcher and time.time() < note_notice_status[account.bbs_uid].starrail_next_check:
+            continue
         if account.enable_resin or matcher:
             starrail_board_status, note = await starrail_note(account)
+            if starrail_board_status:
+                next_check = next_note_check(*starrail_note_countdowns(account, note))
+            else:
+                next_check = failed_note_check(starrail_board_status.no_starrail_account)
+            note_notice_status[account.bbs_uid].starrail_next_check = next_check
             if not starrail_board_status:
                 if matcher:
                     if starrail_board_status.login_expired:
@@ -624,16 +835,19 @@ async def starrail_note_check(user: UserData, user_ids: Iterable[str], matcher:
                     starrail_notice.current_stamina = False
                     starrail_notice.current_stamina_full = False
 
-                # 每周模拟宇宙积分提醒
+                # 每周模拟宇宙积分提醒，每天到达提醒时间后提醒一次
                 if note.current_rogue_score != note.max_rogue_score:
-                    if plugin_config.preference.notice_time:
+                    now = datetime.now()
+                    notice_status = note_notice_status[account.bbs_uid]
+                    if now.hour >= ROGUE_SCORE_NOTICE_HOUR and notice_status.rogue_score_notice_date != now.date():
+                        notice_status.rogue_score_notice_date = now.date()
                         msg += '❕您的模拟宇宙积分还没打满\n\n'
                         do_notice = True
 
                 if not do_notice:
                     logger.info(
                         f"崩铁实时便笺：账户 {account.display_name} 开拓力:{note.current_stamina},未满足推送条件")
-                    return
+                    continue
 
             msg += "❖星穹铁道·实时便笺❖" \
                    f"\n🆔账户 {account.display_name}" \
@@ -647,7 +861,9 @@ async def starrail_note_check(user: UserData, user_ids: Iterable[str], matcher:
                 await matcher.send(msg)
             else:
                 for user_id in user_ids:
-                    await send_private_msg(user_id=user_id, message=msg)
+                    batch.add(user_id, msg)
+    if own_batch:
+        batch.flush()
 
 
 async def weibo_code_check(user: UserData, user_ids: Iterable[str]):
@@ -657,13 +873,15 @@ async def weibo_code_check(user: UserData, user_ids: Iterable[str]):
     :param user: 用户对象
     :param user_ids: 发送通知的所有用户ID
     """
+    batch = NotificationBatch()
     for account in user.accounts.values():
         if account.enable_weibo:
             # account = UserAccount(account) 
             weibo = WeiboCode(account)
             msg = await weibo.get_code_list()
             for user_id in user_ids:
-                await send_private_msg(user_id=user_id, message=msg)
+                batch.add(user_id, msg)
+    batch.flush()
 
 
 @scheduler.scheduled_job("cron", hour='0', minute='0', id="daily_goodImg_update")
@@ -684,26 +902,53 @@ async def daily_schedule():
     自动米游币任务、游戏签到函数
     """
     logger.info(f"{plugin_config.preference.log_head}开始执行每日自动任务")
-    for user_id, user in get_unique_users():
-        user_ids = [user_id] + list(get_all_bind(user_id))
-        await perform_game_sign(user=user, user_ids=user_ids)
-        await perform_bbs_sign(user=user, user_ids=user_ids)
-    logger.info(f"{plugin_config.preference.log_head}每日自动任务执行完成")
+    start_time = time.perf_counter()
+    semaphore = asyncio.Semaphore(plugin_config.preference.plan_concurrency)
+    stage_time: Dict[str, float] = {"游戏签到": 0, "米游币任务": 0}
+
+    async def run_user(user_id: str, user: UserData):
+        # 同一用户的游戏签到与米游币任务依旧按顺序执行，不同用户之间并发执行
+        async with semaphore:
+            user_ids = [user_id] + list(get_all_bind(user_id))
+            # 两项任务的通知在全部执行完后一起发送，开启摘要模式时合并为一条报告
+            batch = NotificationBatch(digest=user.enable_digest, title="📋每日自动任务结果")
+            for stage, perform in ("游戏签到", perform_game_sign), ("米游币任务", perform_bbs_sign):
+                stage_start = time.perf_counter()
+                batch.section(stage)
+                try:
+                    await perform(user=user, user_ids=user_ids, batch=batch)
+                except Exception:
+                    logger.exception(f"{plugin_config.preference.log_head}每日自动任务 - 用户 {user_id} {stage}执行出错")
+                finally:
+                    stage_time[stage] += time.perf_counter() - stage_start
+            batch.flush()
+
+    users = list(get_unique_users())
+    await asyncio.gather(*(run_user(user_id, user) for user_id, user in users))
+    logger.info(
+        f"{plugin_config.preference.log_head}每日自动任务执行完成，共 {len(users)} 个用户，"
+        f"总耗时 {time.perf_counter() - start_time:.2f}s，" +
+        "，".join(f"{stage}累计耗时 {cost:.2f}s" for stage, cost in stage_time.items())
+    )
 
 
 @scheduler.scheduled_job("interval",
-                         minutes=plugin_config.preference.resin_interval,
+                         minutes=plugin_config.preference.note_check_tick,
                          id="resin_check")
 async def auto_note_check():
     """
-    自动查看实时便笺
+    自动查看实时便笺，只会检查到了预测检查时间的账号
     """
-    logger.info(f"{plugin_config.preference.log_head}开始执行自动便笺检查")
+    logger.debug(f"{plugin_config.preference.log_head}开始执行自动便笺检查")
     for user_id, user in get_unique_users():
         user_ids = [user_id] + list(get_all_bind(user_id))
-        await genshin_note_check(user=user, user_ids=user_ids)
-        await starrail_note_check(user=user, user_ids=user_ids)
-    logger.info(f"{plugin_config.preference.log_head}自动便笺检查执行完成")
+        batch = NotificationBatch(digest=user.enable_digest, title="📋实时便笺提醒")
+        batch.section("原神")
+        await genshin_note_check(user=user, user_ids=user_ids, batch=batch)
+        batch.section("星穹铁道")
+        await starrail_note_check(user=user, user_ids=user_ids, batch=batch)
+        batch.flush()
+    logger.debug(f"{plugin_config.preference.log_head}自动便笺检查执行完成")
 
 
 @scheduler.scheduled_job("cron",
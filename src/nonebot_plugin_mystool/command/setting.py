@@ -114,11 +114,11 @@ async def _(event: Union[GeneralMessageEvent], state: T_State, setting_id=ArgStr
         await account_setting.finish('🚪已成功退出')
     elif setting_id == '1':
         account.enable_mission = not account.enable_mission
-        PluginDataManager.write_plugin_data()
+        PluginDataManager.write_plugin_data(event.get_user_id())
         await account_setting.finish(f"📅米游币任务自动执行已 {'✅开启' if account.enable_mission else '❌关闭'}")
     elif setting_id == '2':
         account.enable_game_sign = not account.enable_game_sign
-        PluginDataManager.write_plugin_data()
+        PluginDataManager.write_plugin_data(event.get_user_id())
         await account_setting.finish(f"📅米哈游游戏自动签到已 {'✅开启' if account.enable_game_sign else '❌关闭'}")
     elif setting_id == '3':
         if account.platform == "ios":
@@ -127,7 +127,7 @@ async def _(event: Union[GeneralMessageEvent], state: T_State, setting_id=ArgStr
         else:
             account.platform = "ios"
             platform_show = "iOS"
-        PluginDataManager.write_plugin_data()
+        PluginDataManager.write_plugin_data(event.get_user_id())
         await account_setting.finish(f"📲设备平台已更改为 {platform_show}")
     elif setting_id == '4':
         games_show = "、".join(map(lambda x: f"『{x.name}』", BaseMission.available_games.values()))
@@ -141,7 +141,7 @@ async def _(event: Union[GeneralMessageEvent], state: T_State, setting_id=ArgStr
         state["setting_item"] = "mission_games"
     elif setting_id == '5':
         account.enable_resin = not account.enable_resin
-        PluginDataManager.write_plugin_data()
+        PluginDataManager.write_plugin_data(event.get_user_id())
         await account_setting.finish(f"📅原神、星穹铁道便笺提醒已 {'✅开启' if account.enable_resin else '❌关闭'}")
     elif setting_id == '6':
         await account_setting.send(
@@ -157,7 +157,7 @@ async def _(event: Union[GeneralMessageEvent], state: T_State, setting_id=ArgStr
         await account_setting.reject(f"⚠️确认删除账号 {account.display_name} ？发送 \"确认删除\" 以确定。")
     elif setting_id == '确认删除' and state["prepare_to_delete"]:
         user_account.pop(account.bbs_uid)
-        PluginDataManager.write_plugin_data()
+        PluginDataManager.write_plugin_data(event.get_user_id())
         await account_setting.finish(f"已删除账号 {account.display_name} 的数据")
     else:
         await account_setting.reject("⚠️您的输入有误，请重新输入")
@@ -189,7 +189,7 @@ async def _(_: Union[GeneralMessageEvent], state: T_State, notice_game=ArgStr())
 
 
 @account_setting.got('setting_value')
-async def _(_: Union[GeneralMessageEvent], state: T_State, setting_value=ArgStr()):
+async def _(event: Union[GeneralMessageEvent], state: T_State, setting_value=ArgStr()):
     if setting_value == '退出':
         await account_setting.finish('🚪已成功退出')
     account: UserAccount = state['account']
@@ -203,7 +203,7 @@ async def _(_: Union[GeneralMessageEvent], state: T_State, setting_value=ArgStr(
             if 0 <= resin_threshold <= 160:
                 # 输入有效的数字范围，将 resin_threshold 赋值为输入的整数
                 account.user_resin_threshold = resin_threshold
-                PluginDataManager.write_plugin_data()
+                PluginDataManager.write_plugin_data(event.get_user_id())
                 await account_setting.finish("更改原神便笺树脂提醒阈值成功\n"
                                              f"⏰当前提醒阈值：{resin_threshold}")
             else:
@@ -218,7 +218,7 @@ async def _(_: Union[GeneralMessageEvent], state: T_State, setting_value=ArgStr(
             if 0 <= stamina_threshold <= 240:
                 # 输入有效的数字范围，将 stamina_threshold 赋值为输入的整数
                 account.user_stamina_threshold = stamina_threshold
-                PluginDataManager.write_plugin_data()
+                PluginDataManager.write_plugin_data(event.get_user_id())
                 await account_setting.finish("更改崩铁便笺开拓力提醒阈值成功\n"
                                              f"⏰当前提醒阈值：{stamina_threshold}")
             else:
@@ -237,7 +237,7 @@ async def _(_: Union[GeneralMessageEvent], state: T_State, setting_value=ArgStr(
                 mission_games.append(game_name)
 
         account.mission_games = mission_games
-        PluginDataManager.write_plugin_data()
+        PluginDataManager.write_plugin_data(event.get_user_id())
         setting_value = setting_value.replace(" ", "、")
         await account_setting.finish(f"💬执行米游币任务的频道已更改为『{setting_value}』")
 
@@ -248,7 +248,7 @@ CommandRegistry.set_usage(
     global_setting,
     CommandUsage(
         name="通知设置",
-        description="设置每日签到后是否进行QQ通知"
+        description="设置每日签到后是否进行QQ通知，以及是否将通知合并为一条摘要"
     )
 )
 
@@ -260,8 +260,9 @@ async def _(event: Union[GeneralMessageEvent], matcher: Matcher):
     """
     user = PluginDataManager.plugin_data.users[event.get_user_id()]
     await matcher.send(
-        f"自动通知每日计划任务结果：{'🔔开' if user.enable_notice else '🔕关'}"
-        "\n请问您是否需要更改呢？\n请回复“是”或“否”\n🚪发送“退出”即可退出")
+        f"1️⃣ 自动通知每日计划任务结果：{'🔔开' if user.enable_notice else '🔕关'}"
+        f"\n2️⃣ 摘要模式（每次任务的结果合并为一条消息）：{'开' if user.enable_digest else '关'}"
+        "\n\n您要更改哪一项呢？请发送 1 / 2\n🚪发送“退出”即可退出")
 
 
 @global_setting.got('choice')
@@ -272,11 +273,13 @@ async def _(event: Union[GeneralMessageEvent], matcher: Matcher, choice=ArgStr()
     user = PluginDataManager.plugin_data.users[event.get_user_id()]
     if choice == '退出':
         await matcher.finish("🚪已成功退出")
-    elif choice == '是':
+    elif choice == '1':
         user.enable_notice = not user.enable_notice
-        PluginDataManager.write_plugin_data()
+        PluginDataManager.write_plugin_data(event.get_user_id())
         await matcher.finish(f"自动通知每日计划任务结果 已 {'🔔开启' if user.enable_notice else '🔕关闭'}")
-    elif choice == '否':
-        await matcher.finish("没有做修改哦~")
+    elif choice == '2':
+        user.enable_digest = not user.enable_digest
+        PluginDataManager.write_plugin_data(event.get_user_id())
+        await matcher.finish(f"📋通知摘要模式已 {'✅开启' if user.enable_digest else '❌关闭'}")
     else:
         await matcher.reject("⚠️您的输入有误，请重新输入")
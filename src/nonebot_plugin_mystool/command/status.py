@@ -0,0 +1,49 @@
+import time
+from typing import Union
+
+from nonebot import on_command
+from nonebot.matcher import Matcher
+
+from ..command.common import CommandRegistry
+from ..model import plugin_config, CommandUsage
+from ..utils import GeneralMessageEvent, HttpClientManager, read_admin_list
+
+__all__ = ["service_status"]
+
+service_status = on_command(plugin_config.preference.command_start + '服务状态', priority=5, block=True)
+
+CommandRegistry.set_usage(
+    service_status,
+    CommandUsage(
+        name="服务状态",
+        description="查看米游社等接口的熔断情况（仅管理员可用）"
+    )
+)
+
+CIRCUIT_STATE_TEXT = {
+    "closed": "🟢正常",
+    "open": "🔴已熔断",
+    "half_open": "🟡试探中"
+}
+
+
+@service_status.handle()
+async def _(event: Union[GeneralMessageEvent], matcher: Matcher):
+    """
+    查看接口熔断器状态
+    """
+    if event.get_user_id() not in read_admin_list():
+        await matcher.finish("⚠️你暂无权限执行此操作，只有管理员名单中的用户可以执行此操作")
+    circuit_breakers = list(HttpClientManager.circuit_breakers.values())
+    if not circuit_breakers:
+        await matcher.finish("ℹ️暂无接口请求记录")
+
+    abnormal = [breaker for breaker in circuit_breakers if breaker.state != "closed" or breaker.failures]
+    msg = f"📡共 {len(circuit_breakers)} 个接口，其中 {len(abnormal)} 个接口出现异常"
+    for breaker in abnormal:
+        msg += f"\n\n{CIRCUIT_STATE_TEXT[breaker.state]} {breaker.endpoint}" \
+               f"\n- 连续失败次数：{breaker.failures}"
+        if breaker.state == "open":
+            retry_after = breaker.opened_at + breaker.reset_timeout - time.monotonic()
+            msg += f"\n- 恢复尝试倒计时：{retry_after:.0f} 秒"
+    await matcher.finish(msg)
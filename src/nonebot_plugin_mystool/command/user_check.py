@@ -113,12 +113,10 @@ async def _(
                     f"{PluginDataManager.plugin_data.user_bind[user_id]}\n"
                     "您的任何操作都将会影响到目标用户的数据"
                 )
-            elif user_id in PluginDataManager.plugin_data.user_bind.values():
-                user_filter = filter(lambda x: PluginDataManager.plugin_data.user_bind[x] == user_id,
-                                     PluginDataManager.plugin_data.user_bind)
+            elif src_users := PluginDataManager.plugin_data.get_bind_sources(user_id):
                 await matcher.send(
                     "🖇️目前有以下用户绑定了您的数据：\n"
-                    "\n".join(user_filter)
+                    "\n".join(src_users)
                 )
             else:
                 await matcher.send("⚠️您当前没有绑定任何用户数据，也没有任何用户绑定您的数据")
@@ -127,9 +125,7 @@ async def _(
             if user_id not in PluginDataManager.plugin_data.user_bind:
                 await matcher.finish("⚠️您当前没有绑定任何用户数据")
             else:
-                del PluginDataManager.plugin_data.user_bind[user_id]
-                del PluginDataManager.plugin_data.users[user_id]
-                PluginDataManager.write_plugin_data()
+                PluginDataManager.plugin_data.do_user_unbind(user_id, write=True)
                 await matcher.send("✔已清除当前用户的绑定关系，当前用户数据已是空白数据")
 
         elif command[1] in ["刷新UUID", "刷新uuid"]:
@@ -143,13 +139,11 @@ async def _(
                 target_id = user_id
                 be_bind = True
 
-            src_users = list(filter(lambda x: PluginDataManager.plugin_data.user_bind[x] == target_id,
-                                    PluginDataManager.plugin_data.user_bind))
+            src_users = PluginDataManager.plugin_data.get_bind_sources(target_id)
             for key in src_users:
-                del PluginDataManager.plugin_data.user_bind[key]
-                del PluginDataManager.plugin_data.users[key]
+                PluginDataManager.plugin_data.do_user_unbind(key)
             PluginDataManager.plugin_data.users[target_id].uuid = str(uuid4())
-            PluginDataManager.write_plugin_data()
+            PluginDataManager.write_plugin_data(target_id, *src_users)
 
             await matcher.send(
                 f"{'✔已刷新UUID密钥，原先绑定的用户将无法访问当前用户数据' if be_bind else '✔已刷新您绑定的用户数据的UUID密钥，目前您的用户数据已为空，您也可以再次绑定'}\n"
@@ -194,7 +188,7 @@ async def _(
             if isinstance(event, GeneralGroupMessageEvent):
                 user.uuid = str(uuid4())
                 await matcher.send("🔑由于您在群聊中进行绑定，已刷新您的UUID密钥，但不会影响其他已绑定用户")
-            PluginDataManager.write_plugin_data()
+            PluginDataManager.write_plugin_data(user_id)
             await matcher.send(f"✔已绑定用户 {target_id} 的用户数据")
 
 
@@ -224,7 +218,7 @@ async def _(bot: Bot, event: Union[GeneralGroupMessageEvent]):
         user_id = event.get_user_id()
         if user := PluginDataManager.plugin_data.users.get(user_id):
             user.qq_guild[user_id] = event.guild_id
-            PluginDataManager.write_plugin_data()
+            PluginDataManager.write_plugin_data(user_id)
 
     msg_text = f"{PLUGIN.metadata.name}" \
                f"{PLUGIN.metadata.description}\n" \
@@ -1,15 +1,21 @@
 import inspect
+import json
 import time
 from abc import abstractmethod
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Literal, NamedTuple, no_type_check, Union, Dict, Any, TypeVar, Tuple
+from typing import Optional, Literal, NamedTuple, no_type_check, Union, Dict, Any, TypeVar, Tuple, Callable
 
 import pytz
 from pydantic import BaseModel
 
-__all__ = ["root_path", "data_path", "BaseModelWithSetter", "BaseModelWithUpdate", "Good", "GameRecord", "GameInfo",
-           "Address", "MmtData",
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ["root_path", "data_path", "json_loads", "json_dumps", "model_json", "BaseModelWithSetter",
+           "BaseModelWithUpdate", "Good", "GameRecord", "GameInfo", "Address", "MmtData",
            "Award", "GameSignInfo", "MissionData", "MissionState", "GenshinNote", "StarRailNote", "GenshinNoteNotice",
            "StarRailNoteNotice", "BaseApiStatus", "CreateMobileCaptchaStatus", "GetCookieStatus", "GetGoodDetailStatus",
            "ExchangeStatus", "MissionStatus", "GetFpStatus", "BoardStatus", "GenshinNoteStatus", "StarRailNoteStatus",
@@ -22,6 +28,48 @@ data_path = root_path / "data" / "nonebot-plugin-mystool"
 '''插件数据保存目录'''
 
 
+def json_loads(data: Union[str, bytes]) -> Any:
+    """
+    反序列化JSON，安装了 orjson 时使用 orjson，否则使用标准库 json
+
+    :param data: JSON文本或二进制数据
+    :raises json.JSONDecodeError: JSON格式错误（orjson 的异常也是它的子类）
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj: Any, indent: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """
+    序列化为JSON文本，安装了 orjson 时使用 orjson，否则使用标准库 json
+
+    非ASCII字符不会被转义。orjson 只支持2个空格的缩进，标准库 json 则使用4个空格。
+
+    :param obj: 需要序列化的对象
+    :param indent: 是否缩进
+    :param default: 无法直接序列化的对象的转换函数
+    :raises TypeError: 存在无法序列化的对象
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option).decode()
+    return json.dumps(obj, default=default, ensure_ascii=False, indent=4 if indent else None)
+
+
+def model_json(model: BaseModel, indent: bool = False, **kwargs) -> str:
+    """
+    使用 ``json_dumps`` 序列化 pydantic 模型，用于代替 ``BaseModel.json``
+
+    :param model: pydantic 模型对象
+    :param indent: 是否缩进
+    :param kwargs: 传给 ``BaseModel.dict`` 的参数，如 ``exclude``
+    """
+    return json_dumps(model.dict(**kwargs), indent=indent, default=model.__json_encoder__)
+
+
 class BaseModelWithSetter(BaseModel):
     """
     可以使用@property.setter的BaseModel
@@ -368,6 +416,8 @@ class GenshinNote(BaseModel):
     """
     current_resin: Optional[int]
     """当前树脂数量"""
+    max_resin: Optional[int]
+    """树脂上限"""
     finished_task_num: Optional[int]
     """每日委托完成数"""
     current_expedition_num: Optional[int]
@@ -382,6 +432,8 @@ class GenshinNote(BaseModel):
     """参量质变仪相关数据"""
     resin_recovery_time: Optional[int]
     """剩余树脂恢复时间"""
+    home_coin_recovery_time: Optional[int]
+    """洞天财瓮剩余回满时间"""
 
     @property
     def transformer_text(self):
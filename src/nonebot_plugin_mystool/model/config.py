@@ -1,13 +1,13 @@
 import os
-from datetime import time, timedelta, datetime
+from datetime import time, timedelta
 from pathlib import Path
-from typing import Union, Optional, Tuple, Any, Dict, TYPE_CHECKING
+from typing import Union, Optional, Tuple, Any, Dict, TYPE_CHECKING, Literal
 
 import nonebot
 from nonebot.log import logger
 from pydantic import BaseModel, BaseSettings, validator
 
-from ..model.common import data_path
+from ..model.common import data_path, json_loads, model_json
 
 if TYPE_CHECKING:
     IntStr = Union[int, str]
@@ -33,10 +33,49 @@ class Preference(BaseModel):
     """连接测试间隔（单位：秒）"""
     timeout: float = 10
     """网络请求超时时间（单位：秒）"""
+    max_connections: int = 100
+    """同一 Host 的最大连接数"""
+    max_keepalive_connections: int = 20
+    """同一 Host 保持的最大空闲长连接数"""
+    keepalive_expiry: float = 30
+    """空闲长连接的保持时间（单位：秒）"""
+    host_concurrency: int = 20
+    """同一 Host 同时进行中的最大请求数"""
+    host_rate_limits: Dict[str, float] = {
+        "api-takumi.mihoyo.com": 5,
+        "api-takumi-record.mihoyo.com": 5,
+        "bbs-api.miyoushe.com": 5,
+        "bbs-api.mihoyo.com": 5,
+        "passport-api.mihoyo.com": 2,
+        "webapi.account.mihoyo.com": 2
+    }
+    """各 Host 每秒最多发送的请求数，未设置的 Host 使用 host_rate_limit"""
+    host_rate_limit: float = 0
+    """未在 host_rate_limits 中设置的 Host 每秒最多发送的请求数（小于等于0则不限速）"""
+    host_rate_burst: int = 5
+    """同一 Host 允许突发的请求数"""
+    host_rate_decrease_factor: float = 0.5
+    """遇到限流（HTTP 429、人机验证）时，Host 的请求速率乘以该系数"""
+    host_rate_increase: float = 0.05
+    """每次请求成功后，Host 的请求速率增加的值（不超过设置的速率）"""
+    game_record_cache_ttl: float = 3600
+    """用户游戏账户信息的缓存时间（单位：秒）"""
+    game_list_cache_ttl: float = 86400
+    """米哈游游戏信息的缓存时间（单位：秒）"""
+    post_list_cache_ttl: float = 300
+    """米游社分区文章列表的缓存时间（单位：秒），所有账号共用同一份文章列表"""
+    good_detail_cache_ttl: float = 10
+    """商品详细信息的缓存时间（单位：秒），用于合并短时间内对同一商品的重复请求"""
     max_retry_times: Optional[int] = 3
     """最大网络请求重试次数"""
     retry_interval: float = 2
-    """网络请求重试间隔（单位：秒）（除兑换请求外）"""
+    """网络请求首次重试的间隔（单位：秒）（除兑换请求外），之后的重试间隔按指数增长并加入随机抖动"""
+    retry_max_interval: float = 30
+    """网络请求重试的最大间隔（单位：秒）"""
+    circuit_breaker_threshold: int = 10
+    """同一接口连续失败多少次后熔断（暂停请求），小于等于0则不熔断"""
+    circuit_breaker_reset_timeout: float = 120
+    """接口熔断后，经过多久再尝试请求（单位：秒）"""
     timezone: Optional[str] = "Asia/Shanghai"
     """兑换时所用的时区"""
     exchange_thread_count: int = 2
@@ -45,6 +84,12 @@ class Preference(BaseModel):
     """同一线程下，每个兑换请求之间的间隔时间"""
     exchange_duration: float = 5
     """兑换持续时间随机范围（单位：秒）"""
+    exchange_prepare_time: float = 10
+    """提前多久开始准备兑换，包括同步服务器时间、预热连接（单位：秒）"""
+    exchange_time_sync_samples: int = 5
+    """同步服务器时间时的采样次数"""
+    exchange_send_offset: float = 0
+    """兑换请求相对于商品开售时间（服务器时间）的发送时间偏移，负数为提前发送（单位：秒）"""
     enable_log_output: bool = True
     """是否保存日志"""
     log_head: str = ""
@@ -66,11 +111,37 @@ class Preference(BaseModel):
     command_start: str = ""
     '''插件内部命令头(若为""空字符串则不启用)'''
     sleep_time: float = 2
-    '''任务操作冷却时间(如米游币任务)'''
+    '''任务操作冷却时间(如米游币任务)，即同一账户每次操作之间的平均间隔'''
+    mission_rate_burst: int = 3
+    '''米游币任务中，同一账户允许连续进行（不需要等待冷却）的最大操作次数'''
     plan_time: str = "00:30"
     '''每日自动签到和米游社任务的定时任务执行时间，格式为HH:MM'''
+    plan_concurrency: int = 10
+    '''每日自动任务同时执行的最大用户数'''
+    game_sign_concurrency: int = 4
+    '''单个用户同时进行游戏签到的最大游戏账号数'''
+    award_icon_cache_size: int = 16 * 1024 * 1024
+    '''内存中缓存的签到奖励图片总大小上限（单位：字节）'''
+    award_icon_cache_path: Optional[Path] = data_path / "award_icon_cache"
+    '''签到奖励图片的磁盘缓存目录（为空则不使用磁盘缓存）'''
+    notice_rate_limit: float = 1
+    '''向同一用户发送通知的最大频率（单位：条/秒）'''
+    notice_max_retry: int = 3
+    '''通知发送失败时的最大重试次数'''
+    notice_outbox_path: Path = data_path / "notice_outbox"
+    '''未发送的通知的保存目录，每条通知一个文件，发送成功后删除'''
+    notice_dead_letter_path: Path = data_path / "notice_dead_letter.jsonl"
+    '''多次发送失败的通知的记录路径'''
     resin_interval: int = 60
-    '''每次检查原神便笺间隔，单位为分钟'''
+    '''已弃用，仅为兼容旧版配置文件而保留，便笺检查间隔由 note_check_max_interval 控制'''
+    note_check_max_interval: int = 600
+    '''
+    每次检查便笺的最大间隔，单位为分钟
+
+    会根据上次查询到的树脂、开拓力等恢复时间，预测下次需要提醒的时间再进行检查，但两次检查之间的间隔不会超过此值
+    '''
+    note_check_tick: int = 1
+    '''便笺检查调度的最小间隔，单位为分钟'''
     geetest_url: Optional[str]
     '''极验Geetest人机验证打码接口URL'''
     geetest_params: Optional[Dict[str, Any]] = None
@@ -94,6 +165,20 @@ class Preference(BaseModel):
     """是否启用管理员名单"""
     admin_list_path: Optional[Path] = data_path / "admin_list.txt"
     """管理员名单文件路径"""
+    user_list_check_interval: float = 5
+    """黑/白名单、管理员名单文件的变更检查间隔（单位：秒），间隔内直接使用内存中的名单"""
+    plugin_data_storage: Literal["json", "journal", "sqlite"] = "json"
+    """
+    插件数据存储方式
+
+    - json: 每次保存都完整写入插件数据文件（默认）
+    - journal: 只追加写入发生变化的用户数据，定期合并为完整的插件数据文件。
+      每次保存仍需序列化所有用户以找出变化，启动时还需回放变更记录，只适合写入磁盘较慢的环境
+    - sqlite: 保存在 SQLite 数据库中，首次使用时自动从插件数据文件迁移，此后插件数据文件不再更新。
+      切换回其他方式后，启动时会自动从数据库写回插件数据文件，并将数据库重命名为 dataV2.db.bak
+    """
+    journal_compact_threshold: int = 500
+    """journal 存储方式下，变更记录达到多少条后合并为完整的插件数据文件"""
 
     @validator("log_path", allow_reuse=True)
     def _(cls, v: Optional[Path]):
@@ -108,16 +193,6 @@ class Preference(BaseModel):
             logger.warning(f"程序没有写入日志文件 {absolute_path} 的权限")
         return v
 
-    @property
-    def notice_time(self) -> bool:
-        now_hour = datetime.now().hour
-        now_minute = datetime.now().minute
-        set_time = "20:00"
-        notice_time = int(set_time[:2]) * 60 + int(set_time[3:])
-        start_time = notice_time - self.resin_interval
-        end_time = notice_time + self.resin_interval
-        return start_time <= (now_hour * 60 + now_minute) % (24 * 60) <= end_time
-
 
 class GoodListImageConfig(BaseModel):
     """
@@ -146,6 +221,10 @@ class GoodListImageConfig(BaseModel):
     '''商品列表图片缓存目录'''
     MULTI_PROCESS: bool = True
     '''是否使用多进程生成图片（如果生成图片时崩溃，可尝试关闭此选项）'''
+    ICON_FETCH_CONCURRENCY: int = 8
+    '''同时下载商品预览图的最大数量'''
+    ICON_CACHE_PATH: Path = data_path / "icon_cache"
+    '''商品预览图缓存目录'''
 
 
 class SaltConfig(BaseModel):
@@ -241,11 +320,11 @@ class PluginEnv(BaseSettings):
 
 
 if plugin_config_path.exists() and plugin_config_path.is_file():
-    plugin_config = PluginConfig.parse_file(plugin_config_path)
+    plugin_config = PluginConfig.parse_obj(json_loads(plugin_config_path.read_bytes()))
 else:
     plugin_config = PluginConfig()
     try:
-        str_data = plugin_config.json(indent=4)
+        str_data = model_json(plugin_config, indent=True)
         plugin_config_path.parent.mkdir(parents=True, exist_ok=True)
         with open(plugin_config_path, "w", encoding="utf-8") as f:
             f.write(str_data)
@@ -1,15 +1,17 @@
-import json
 from json import JSONDecodeError
+from pathlib import Path
 from typing import Union, Optional, Any, Dict, TYPE_CHECKING, AbstractSet, \
     Mapping, Set, Literal, List
 from uuid import UUID, uuid4
 
 from httpx import Cookies
 from nonebot.log import logger
-from pydantic import BaseModel, ValidationError, validator, Field
+from pydantic import BaseModel, ValidationError, validator, Field, PrivateAttr
 
 from .._version import __version__
-from ..model.common import data_path, BaseModelWithSetter, Address, BaseModelWithUpdate, Good, GameRecord
+from ..model.common import data_path, BaseModelWithSetter, Address, BaseModelWithUpdate, Good, GameRecord, \
+    json_loads, model_json
+from ..model.storage import PluginDataStorage, atomic_write, get_plugin_data_storage
 
 if TYPE_CHECKING:
     IntStr = Union[int, str]
@@ -374,6 +376,8 @@ class UserData(BaseModelWithSetter):
     """
     enable_notice: bool = True
     """是否开启通知"""
+    enable_digest: bool = False
+    """是否将计划任务的通知合并为一条摘要发送"""
     uuid: Optional[str] = None
     """用户UUID密钥，用于不同NoneBot适配器平台之间的数据同步，因此不可泄露"""
     qq_guild: Optional[Dict[str, int]] = {}
@@ -429,6 +433,9 @@ class PluginData(BaseModel):
     users: Dict[str, UserData] = {}
     '''所有用户数据'''
 
+    _bind_index: Dict[str, Set[str]] = PrivateAttr(default_factory=dict)
+    """用户绑定关系的反向索引 {被绑定用户ID: {绑定该用户的用户ID}}"""
+
     def do_user_bind(self, src: str = None, dst: str = None, write: bool = False):
         """
         执行用户数据绑定同步，将src指向dst的用户数据，即src处的数据将会被dst处的数据对象替换
@@ -438,20 +445,51 @@ class PluginData(BaseModel):
         :param write: 是否写入插件数据文件
         """
         if None in [src, dst]:
+            self._bind_index = {}
             for x, y in self.user_bind.items():
+                self._bind_index.setdefault(y, set()).add(x)
                 try:
                     self.users[x] = self.users[y]
                 except KeyError:
                     logger.error(f"用户数据绑定失败，目标用户 {y} 不存在")
         else:
             try:
-                self.user_bind[src] = dst
                 self.users[src] = self.users[dst]
             except KeyError:
                 logger.error(f"用户数据绑定失败，目标用户 {dst} 不存在")
             else:
+                if src in self.user_bind:
+                    self._bind_index.get(self.user_bind[src], set()).discard(src)
+                self.user_bind[src] = dst
+                self._bind_index.setdefault(dst, set()).add(src)
                 if write:
-                    PluginDataManager.write_plugin_data()
+                    PluginDataManager.write_plugin_data(src)
+
+    def do_user_unbind(self, src: str, write: bool = False):
+        """
+        解除用户数据绑定，src处的用户数据将被删除
+
+        :param src: 源用户数据
+        :param write: 是否写入插件数据文件
+        """
+        dst = self.user_bind.pop(src, None)
+        if dst is not None:
+            sources = self._bind_index.get(dst)
+            if sources is not None:
+                sources.discard(src)
+                if not sources:
+                    del self._bind_index[dst]
+        self.users.pop(src, None)
+        if write:
+            PluginDataManager.write_plugin_data(src)
+
+    def get_bind_sources(self, dst: str) -> Set[str]:
+        """
+        获取绑定了目标用户数据的所有用户ID
+
+        :param dst: 被绑定的目标用户ID
+        """
+        return set(self._bind_index.get(dst, ()))
 
     def __init__(self, **data: Any):
         super().__init__(**data)
@@ -464,32 +502,36 @@ class PluginData(BaseModel):
 class PluginDataManager:
     plugin_data: Optional[PluginData] = None
     """加载出的插件数据对象"""
+    storage: PluginDataStorage = get_plugin_data_storage(plugin_data_path)
+    """插件数据存储后端"""
 
     @classmethod
     def load_plugin_data(cls):
         """
         加载插件数据文件
         """
-        if plugin_data_path.exists() and plugin_data_path.is_file():
+        try:
+            plugin_data_dict = cls.storage.load()
+        except (ValidationError, JSONDecodeError):
+            logger.exception(f"读取插件数据文件失败，请检查插件数据文件 {plugin_data_path} 格式是否正确")
+            raise
+        except Exception:
+            logger.exception(
+                f"读取插件数据文件失败，请检查插件数据文件 {plugin_data_path} 是否存在且有权限读取和写入")
+            raise
+
+        if plugin_data_dict is not None:
             try:
-                with open(plugin_data_path, "r") as f:
-                    plugin_data_dict = json.load(f)
                 # 读取完整的插件数据
                 cls.plugin_data = PluginData.parse_obj(plugin_data_dict)
-            except (ValidationError, JSONDecodeError):
+            except ValidationError:
                 logger.exception(f"读取插件数据文件失败，请检查插件数据文件 {plugin_data_path} 格式是否正确")
                 raise
-            except Exception:
-                logger.exception(
-                    f"读取插件数据文件失败，请检查插件数据文件 {plugin_data_path} 是否存在且有权限读取和写入")
-                raise
+            cls.storage.loaded(cls.plugin_data)
         else:
             cls.plugin_data = PluginData()
             try:
-                str_data = cls.plugin_data.json(indent=4)
-                plugin_data_path.parent.mkdir(parents=True, exist_ok=True)
-                with open(plugin_data_path, "w", encoding="utf-8") as f:
-                    f.write(str_data)
+                cls.storage.compact(cls.plugin_data)
             except (AttributeError, TypeError, ValueError, PermissionError):
                 logger.exception(f"创建插件数据文件失败，请检查是否有权限读取和写入 {plugin_data_path}")
                 raise
@@ -497,22 +539,49 @@ class PluginDataManager:
                 logger.info(f"插件数据文件 {plugin_data_path} 不存在，已创建默认插件数据文件。")
 
     @classmethod
-    def write_plugin_data(cls):
+    def write_plugin_data(cls, *user_ids: str):
         """
         写入插件数据文件
 
+        :param user_ids: 数据发生变化的用户ID，不传入则视为所有用户都可能发生了变化。
+            与这些用户存在绑定关系的用户共用同一个用户数据对象，也会一并保存
         :return: 是否成功
         """
+        changed_ids = None
+        if user_ids:
+            changed_ids = set()
+            for user_id in user_ids:
+                dst = cls.plugin_data.user_bind.get(user_id, user_id)
+                changed_ids.add(dst)
+                changed_ids.update(cls.plugin_data.get_bind_sources(dst))
         try:
-            str_data = cls.plugin_data.json(indent=4)
+            cls.storage.write(cls.plugin_data, changed_ids)
         except (AttributeError, TypeError, ValueError):
             logger.exception("数据对象序列化失败，可能是数据类型错误")
             return False
         else:
-            with open(plugin_data_path, "w", encoding="utf-8") as f:
-                f.write(str_data)
             return True
 
+    @classmethod
+    def export_plugin_data(cls, path: Path):
+        """
+        将插件数据以完整的 JSON 格式（与 dataV2.json 相同）导出到文件
+
+        :param path: 导出的文件路径
+        """
+        atomic_write(path, model_json(cls.plugin_data, indent=True))
+
+    @classmethod
+    def import_plugin_data(cls, path: Path):
+        """
+        从完整的 JSON 格式插件数据文件导入，替换当前的插件数据并保存
+
+        :param path: 导入的文件路径
+        """
+        plugin_data_dict = json_loads(path.read_bytes())
+        cls.plugin_data = PluginData.parse_obj(plugin_data_dict)
+        cls.storage.compact(cls.plugin_data)
+
 
 PluginDataManager.load_plugin_data()
 
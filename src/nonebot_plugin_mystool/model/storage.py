@@ -0,0 +1,533 @@
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Optional, Dict, Any, TYPE_CHECKING, Tuple, Union, Set
+
+from nonebot.log import logger
+
+from ..model.common import data_path, json_loads, json_dumps, model_json
+from ..model.config import plugin_config
+
+if TYPE_CHECKING:
+    from ..model.data import PluginData
+
+__all__ = ["plugin_data_journal_path", "plugin_data_database_path", "plugin_data_database_backup_path", "atomic_write",
+           "PluginDataStorage", "JsonStorage", "JournalStorage", "SqliteStorage", "get_plugin_data_storage"]
+
+plugin_data_journal_path = data_path / "dataV2.journal"
+"""插件数据变更日志文件路径"""
+plugin_data_database_path = data_path / "dataV2.db"
+"""插件数据 SQLite 数据库文件路径"""
+plugin_data_database_backup_path = data_path / "dataV2.db.bak"
+"""从 SQLite 存储方式切换回其他方式后，原数据库文件的备份路径"""
+
+
+def atomic_write(path: Path, data: Union[str, bytes]):
+    """
+    原子化写入文件：先写入同目录下的临时文件并 fsync，再通过重命名替换目标文件
+
+    写入过程中崩溃不会导致目标文件损坏，只会残留临时文件
+
+    :param path: 目标文件路径
+    :param data: 写入的文本或二进制数据
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 临时文件名带上进程ID和线程ID，防止多进程（如生成商品图片时）或多线程（如兑换计划保存数据时）同时写入同一文件
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    if isinstance(data, bytes):
+        f = open(temp_path, "wb")
+    else:
+        f = open(temp_path, "w", encoding="utf-8")
+    with f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    # 确保重命名操作本身也已落盘（Windows 下无法对目录进行 fsync）
+    if os.name == "posix":
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class PluginDataStorage(ABC):
+    """
+    插件数据存储后端基类
+    """
+
+    def __init__(self, snapshot_path: Path):
+        """
+        :param snapshot_path: 完整插件数据文件（dataV2.json）路径
+        """
+        self.snapshot_path = snapshot_path
+        self._from_database = False
+        """本次加载是否从 SQLite 数据库读取了数据"""
+
+    def read_snapshot(self) -> Optional[Dict[str, Any]]:
+        """
+        读取完整插件数据文件
+
+        :return: 插件数据字典，文件不存在则返回 None
+        """
+        if self.snapshot_path.exists() and self.snapshot_path.is_file():
+            return json_loads(self.snapshot_path.read_bytes())
+        return None
+
+    def write_snapshot(self, plugin_data: "PluginData"):
+        """
+        原子化写入完整插件数据文件
+
+        :param plugin_data: 插件数据对象
+        """
+        atomic_write(self.snapshot_path, model_json(plugin_data, indent=True))
+
+    def read_database(self) -> Optional[Dict[str, Any]]:
+        """
+        从 SQLite 存储方式切换回来时，读取数据库中的插件数据
+
+        :return: 插件数据字典，数据库不存在或没有数据则返回 None
+        """
+        if not plugin_data_database_path.exists():
+            return None
+        database = SqliteStorage(self.snapshot_path, plugin_data_database_path)
+        try:
+            plugin_data_dict = database.read_rows()
+        finally:
+            database.close()
+        self._from_database = plugin_data_dict is not None
+        return plugin_data_dict
+
+    def retire_database(self):
+        """
+        插件数据已从 SQLite 数据库写回完整插件数据文件后，将数据库重命名为备份文件，避免下次启动时再次读取
+        """
+        for suffix in ("", "-wal", "-shm"):
+            path = plugin_data_database_path.with_name(plugin_data_database_path.name + suffix)
+            if path.exists():
+                os.replace(path, plugin_data_database_backup_path.with_name(
+                    plugin_data_database_backup_path.name + suffix))
+        self._from_database = False
+        logger.info(f"已将插件数据从 SQLite 数据库 {plugin_data_database_path} 迁移至 {self.snapshot_path}，"
+                    f"原数据库已重命名为 {plugin_data_database_backup_path}")
+
+    @abstractmethod
+    def load(self) -> Optional[Dict[str, Any]]:
+        """
+        读取插件数据
+
+        :return: 插件数据字典，不存在插件数据则返回 None
+        """
+
+    def loaded(self, plugin_data: "PluginData"):
+        """
+        插件数据对象创建完成后调用，用于记录当前的数据状态
+
+        :param plugin_data: 插件数据对象
+        """
+
+    @abstractmethod
+    def write(self, plugin_data: "PluginData", user_ids: Optional[Set[str]] = None):
+        """
+        保存插件数据
+
+        :param plugin_data: 插件数据对象
+        :param user_ids: 发生变化的用户ID，为 None 则视为所有用户都可能发生了变化。
+            支持增量保存的存储方式可以只处理这些用户
+        """
+
+    @abstractmethod
+    def compact(self, plugin_data: "PluginData"):
+        """
+        完整写入插件数据，并清除之前保存的增量数据
+
+        :param plugin_data: 插件数据对象
+        """
+
+
+class JsonStorage(PluginDataStorage):
+    """
+    每次保存都完整写入 dataV2.json 的存储后端
+    """
+
+    def load(self):
+        # 从 SQLite 存储方式切换回来时，以数据库中的数据为准
+        if (plugin_data_dict := self.read_database()) is not None:
+            return plugin_data_dict
+        plugin_data_dict = self.read_snapshot()
+        # 从日志存储方式切换回来时，需要先应用尚未合并的变更记录
+        if plugin_data_dict is not None and plugin_data_journal_path.exists():
+            JournalStorage.replay(plugin_data_dict, plugin_data_journal_path)
+        return plugin_data_dict
+
+    def loaded(self, plugin_data):
+        if self._from_database:
+            self.write(plugin_data)
+            self.retire_database()
+        elif plugin_data_journal_path.exists():
+            self.write(plugin_data)
+
+    def write(self, plugin_data, user_ids=None):
+        self.write_snapshot(plugin_data)
+        if plugin_data_journal_path.exists():
+            plugin_data_journal_path.unlink()
+
+    def compact(self, plugin_data):
+        self.write(plugin_data)
+
+
+class JournalStorage(PluginDataStorage):
+    """
+    日志存储后端
+
+    每次保存只向变更日志追加发生变化的用户数据（每条记录为一行 JSON），
+    记录数达到阈值后合并写入 dataV2.json 并清空变更日志。
+    完整插件数据文件的格式与 JSON 存储方式相同，因此也可直接作为导出格式使用。
+
+    变更记录格式:
+        - ``{"op": "user", "id": 用户ID, "data": 用户数据}`` 新增或更新用户数据
+        - ``{"op": "delete", "id": 用户ID}`` 删除用户数据
+        - ``{"op": "meta", "data": {"version": ..., "user_bind": ...}}`` 更新除用户数据以外的插件数据
+    """
+
+    def __init__(self, snapshot_path: Path, journal_path: Path, compact_threshold: int):
+        """
+        :param snapshot_path: 完整插件数据文件（dataV2.json）路径
+        :param journal_path: 变更日志文件路径
+        :param compact_threshold: 变更记录数达到多少条后进行合并
+        """
+        super().__init__(snapshot_path)
+        self.journal_path = journal_path
+        self.compact_threshold = compact_threshold
+        self.journal_count = 0
+        """当前变更日志中的记录数"""
+        self._users_cache: Dict[str, str] = {}
+        """上次保存时各用户数据的序列化结果"""
+        self._meta_cache: Optional[str] = None
+        """上次保存时除用户数据以外的插件数据的序列化结果"""
+        self._lock = threading.Lock()
+        """兑换计划会在其他线程中执行并保存数据，因此需要加锁"""
+
+    @staticmethod
+    def replay(plugin_data_dict: Dict[str, Any], journal_path: Path) -> int:
+        """
+        将变更日志中的记录应用到插件数据字典
+
+        :param plugin_data_dict: 插件数据字典
+        :param journal_path: 变更日志文件路径
+        :return: 成功应用的记录数
+        """
+        users = plugin_data_dict.setdefault("users", {})
+        count = 0
+        with open(journal_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        for index, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                record = json_loads(line)
+            except JSONDecodeError:
+                # 最后一条记录可能因为写入时崩溃而不完整，直接丢弃
+                if index == len(lines) - 1:
+                    logger.warning(f"插件数据变更日志 {journal_path} 最后一条记录不完整，已忽略")
+                    break
+                raise
+            op = record.get("op")
+            if op == "user":
+                users[record["id"]] = record["data"]
+            elif op == "delete":
+                users.pop(record["id"], None)
+            elif op == "meta":
+                plugin_data_dict.update(record["data"])
+            count += 1
+        return count
+
+    @staticmethod
+    def _dump_users(plugin_data: "PluginData", user_ids: Optional[Set[str]] = None) -> Dict[str, str]:
+        """
+        分别序列化每个用户的数据
+
+        :param plugin_data: 插件数据对象
+        :param user_ids: 只序列化这些用户，为 None 则序列化所有用户
+        """
+        encoder = plugin_data.__json_encoder__
+        users_dict = plugin_data.dict(include={"users": user_ids} if user_ids is not None else {"users"})["users"]
+        return {user_id: json_dumps(user_dict, default=encoder)
+                for user_id, user_dict in users_dict.items()}
+
+    @staticmethod
+    def _dump_meta(plugin_data: "PluginData") -> str:
+        """
+        序列化除用户数据以外的插件数据
+        """
+        return model_json(plugin_data, exclude={"users"})
+
+    def load(self):
+        self.journal_count = 0
+        # 从 SQLite 存储方式切换回来时，以数据库中的数据为准，此前留下的变更记录已经过时
+        if (plugin_data_dict := self.read_database()) is not None:
+            return plugin_data_dict
+        plugin_data_dict = self.read_snapshot()
+        if self.journal_path.exists():
+            if plugin_data_dict is None:
+                plugin_data_dict = {}
+            self.journal_count = self.replay(plugin_data_dict, self.journal_path)
+        return plugin_data_dict
+
+    def loaded(self, plugin_data):
+        if self._from_database:
+            self.compact(plugin_data)
+            self.retire_database()
+        elif self.journal_count:
+            # 启动时将上次运行留下的变更记录合并，缩短下次启动时的回放时间
+            self.compact(plugin_data)
+        else:
+            self._users_cache = self._dump_users(plugin_data)
+            self._meta_cache = self._dump_meta(plugin_data)
+
+    def compact(self, plugin_data):
+        """
+        将当前插件数据完整写入 dataV2.json，并清空变更日志
+
+        先替换完整插件数据文件再清空日志：若两步之间崩溃，重新回放日志中的记录也只会得到相同的结果
+
+        :param plugin_data: 插件数据对象
+        """
+        with self._lock:
+            self._compact(plugin_data)
+
+    def _compact(self, plugin_data: "PluginData"):
+        """
+        ``compact`` 的实际实现，调用前需要持有锁
+        """
+        self.write_snapshot(plugin_data)
+        atomic_write(self.journal_path, "")
+        self.journal_count = 0
+        self._users_cache = self._dump_users(plugin_data)
+        self._meta_cache = self._dump_meta(plugin_data)
+
+    def write(self, plugin_data, user_ids=None):
+        with self._lock:
+            users = self._dump_users(plugin_data, user_ids)
+            meta = self._dump_meta(plugin_data)
+            deleted = (self._users_cache.keys() if user_ids is None else user_ids & self._users_cache.keys()) \
+                - users.keys()
+            records = []
+            if meta != self._meta_cache:
+                records.append(f'{{"op": "meta", "data": {meta}}}')
+            for user_id, user_str in users.items():
+                if self._users_cache.get(user_id) != user_str:
+                    records.append(f'{{"op": "user", "id": {json_dumps(user_id)}, "data": {user_str}}}')
+            for user_id in deleted:
+                records.append(json_dumps({"op": "delete", "id": user_id}))
+            if not records:
+                return
+
+            if self.journal_count + len(records) >= self.compact_threshold:
+                self._compact(plugin_data)
+                return
+
+            self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(records) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal_count += len(records)
+            self._users_cache.update(users)
+            for user_id in deleted:
+                del self._users_cache[user_id]
+            self._meta_cache = meta
+
+
+class SqliteStorage(PluginDataStorage):
+    """
+    SQLite 存储后端（WAL 模式）
+
+    用户数据、账号、兑换计划、用户绑定关系分别保存在不同的表中，每次保存只更新发生变化的行。
+    首次使用时若不存在数据库，会自动从 dataV2.json（及尚未合并的变更日志）迁移数据，原文件保留作为备份。
+    """
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS accounts (
+            user_id TEXT NOT NULL, bbs_uid TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (user_id, bbs_uid)
+        );
+        CREATE TABLE IF NOT EXISTS exchange_plans (
+            user_id TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (user_id, data)
+        );
+        CREATE TABLE IF NOT EXISTS user_bind (src TEXT PRIMARY KEY, dst TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS user_bind_dst ON user_bind (dst);
+    """
+
+    def __init__(self, snapshot_path: Path, database_path: Path):
+        """
+        :param snapshot_path: 完整插件数据文件（dataV2.json）路径，用于迁移数据
+        :param database_path: SQLite 数据库文件路径
+        """
+        super().__init__(snapshot_path)
+        self.database_path = database_path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        """兑换计划会在其他线程中执行并保存数据，因此需要加锁"""
+        self._rows_cache: Dict[str, Dict[Tuple[str, ...], str]] = {}
+        """上次保存时各表的数据 {表名: {主键: 数据}}"""
+        self._migrated = False
+        """本次加载是否从 dataV2.json 迁移了数据"""
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        数据库连接，首次访问时创建
+        """
+        if self._connection is None:
+            self.database_path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.database_path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(self._SCHEMA)
+        return self._connection
+
+    @staticmethod
+    def _dump_rows(plugin_data: "PluginData") -> Dict[str, Dict[Tuple[str, ...], str]]:
+        """
+        将插件数据拆分为各个表的行
+        """
+        encoder = plugin_data.__json_encoder__
+        rows: Dict[str, Dict[Tuple[str, ...], str]] = {
+            "meta": {("version",): plugin_data.version},
+            "users": {},
+            "accounts": {},
+            "exchange_plans": {},
+            "user_bind": {(src,): dst for src, dst in plugin_data.user_bind.items()}
+        }
+        users_dict = plugin_data.dict(include={"users"})["users"]
+        for user_id, user_dict in users_dict.items():
+            for bbs_uid, account_dict in user_dict.pop("accounts").items():
+                rows["accounts"][user_id, bbs_uid] = json_dumps(account_dict, default=encoder)
+            for plan_dict in user_dict.pop("exchange_plans"):
+                plan_str = json_dumps(plan_dict, default=encoder)
+                rows["exchange_plans"][user_id, plan_str] = ""
+            rows["users"][(user_id,)] = json_dumps(user_dict, default=encoder)
+        return rows
+
+    def read_rows(self) -> Optional[Dict[str, Any]]:
+        """
+        从数据库读取插件数据字典，数据库中没有数据则返回 None
+        """
+        connection = self.connection
+        version = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None:
+            return None
+        users = {}
+        for user_id, data in connection.execute("SELECT user_id, data FROM users"):
+            users[user_id] = json_loads(data)
+            users[user_id]["accounts"] = {}
+            users[user_id]["exchange_plans"] = []
+        for user_id, bbs_uid, data in connection.execute("SELECT user_id, bbs_uid, data FROM accounts"):
+            users[user_id]["accounts"][bbs_uid] = json_loads(data)
+        for user_id, data in connection.execute("SELECT user_id, data FROM exchange_plans"):
+            users[user_id]["exchange_plans"].append(json_loads(data))
+        return {
+            "version": version[0],
+            "user_bind": dict(connection.execute("SELECT src, dst FROM user_bind").fetchall()),
+            "users": users
+        }
+
+    def _apply_rows(self, rows: Dict[str, Dict[Tuple[str, ...], str]]):
+        """
+        在一个事务中将各表数据更新为 ``rows``，只写入发生变化的行
+        """
+        statements = {
+            "meta": ("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                     "DELETE FROM meta WHERE key = ?"),
+            "users": ("INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)",
+                      "DELETE FROM users WHERE user_id = ?"),
+            "accounts": ("INSERT OR REPLACE INTO accounts (user_id, bbs_uid, data) VALUES (?, ?, ?)",
+                         "DELETE FROM accounts WHERE user_id = ? AND bbs_uid = ?"),
+            "exchange_plans": ("INSERT OR REPLACE INTO exchange_plans (user_id, data) VALUES (?, ?)",
+                               "DELETE FROM exchange_plans WHERE user_id = ? AND data = ?"),
+            "user_bind": ("INSERT OR REPLACE INTO user_bind (src, dst) VALUES (?, ?)",
+                          "DELETE FROM user_bind WHERE src = ?")
+        }
+        connection = self.connection
+        connection.execute("BEGIN")
+        try:
+            for table, (upsert, delete) in statements.items():
+                new_rows = rows[table]
+                old_rows = self._rows_cache.get(table, {})
+                connection.executemany(delete, old_rows.keys() - new_rows.keys())
+                changed = [k for k, v in new_rows.items() if old_rows.get(k) != v]
+                if table == "exchange_plans":
+                    connection.executemany(upsert, changed)
+                else:
+                    connection.executemany(upsert, [(*k, new_rows[k]) for k in changed])
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        else:
+            connection.execute("COMMIT")
+            self._rows_cache = rows
+
+    def load(self):
+        plugin_data_dict = self.read_rows()
+        if plugin_data_dict is None:
+            plugin_data_dict = JsonStorage(self.snapshot_path).load()
+            self._migrated = plugin_data_dict is not None
+        return plugin_data_dict
+
+    def loaded(self, plugin_data):
+        if self._migrated:
+            self.compact(plugin_data)
+            logger.info(f"已将插件数据从 {self.snapshot_path} 迁移至 SQLite 数据库 {self.database_path}")
+            self._migrated = False
+        else:
+            self._rows_cache = self._dump_rows(plugin_data)
+
+    def write(self, plugin_data, user_ids=None):
+        rows = self._dump_rows(plugin_data)
+        with self._lock:
+            self._apply_rows(rows)
+
+    def compact(self, plugin_data):
+        rows = self._dump_rows(plugin_data)
+        with self._lock:
+            # 清空缓存即认为数据库中的所有行都需要重新写入，并删除数据库中多余的行
+            self._rows_cache = {}
+            self.connection.execute("BEGIN")
+            try:
+                for table in rows:
+                    self.connection.execute(f"DELETE FROM {table}")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            else:
+                self.connection.execute("COMMIT")
+            self._apply_rows(rows)
+
+    def close(self):
+        """
+        关闭数据库连接
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def get_plugin_data_storage(snapshot_path: Path) -> PluginDataStorage:
+    """
+    根据偏好设置创建插件数据存储后端
+
+    :param snapshot_path: 完整插件数据文件（dataV2.json）路径
+    """
+    storage_type = plugin_config.preference.plugin_data_storage
+    if storage_type == "sqlite":
+        return SqliteStorage(snapshot_path, plugin_data_database_path)
+    elif storage_type == "journal":
+        return JournalStorage(snapshot_path, plugin_data_journal_path,
+                              plugin_config.preference.journal_compact_threshold)
+    return JsonStorage(snapshot_path)
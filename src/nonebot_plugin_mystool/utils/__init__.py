@@ -1,2 +1,5 @@
 from .common import *
+from .http_client import *
+from .award_icon import *
+from .notification import *
 from .good_image import *
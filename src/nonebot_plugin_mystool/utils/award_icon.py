@@ -0,0 +1,97 @@
+import hashlib
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from nonebot.adapters.onebot.v11 import MessageSegment as OneBotV11MessageSegment
+from nonebot_plugin_saa import Image
+
+from ..model import plugin_config, atomic_write
+from .common import get_file, logger, SingleFlight
+
+__all__ = ["AwardIcon", "AwardIconCache"]
+
+
+class AwardIcon(NamedTuple):
+    """
+    签到奖励图片，包含原始数据和预先构建好的各平台消息段，发送给多个用户时不需要重复编码
+    """
+    content: bytes
+    """图片数据"""
+    onebot_segment: OneBotV11MessageSegment
+    """OneBot V11 图片消息段"""
+    saa_image: Image
+    """nonebot_plugin_saa 图片消息（QQ频道会转换为与 ``file_image`` 相同的消息段）"""
+
+    @classmethod
+    def from_bytes(cls, content: bytes):
+        return cls(
+            content,
+            OneBotV11MessageSegment.image(content),
+            Image(content)
+        )
+
+
+class AwardIconCache:
+    """
+    签到奖励图片缓存
+
+    每天所有用户获得的签到奖励只有少数几种，图片按URL缓存在内存中（按总大小进行 LRU 淘汰），
+    同时保存在磁盘上，重启后也不需要重新下载。奖励图片更换时URL也会改变，因此不需要重新校验缓存。
+    """
+    _icons: "OrderedDict[str, AwardIcon]" = OrderedDict()
+    """URL -> 签到奖励图片，按最近使用的顺序排列"""
+    _size = 0
+    """内存中缓存的图片总大小"""
+    _flight = SingleFlight()
+    """同一URL同时只进行一次下载"""
+
+    @classmethod
+    def _put(cls, url: str, icon: AwardIcon):
+        """
+        放入内存缓存，超出大小上限时淘汰最久未使用的图片
+        """
+        if url in cls._icons:
+            cls._size -= len(cls._icons.pop(url).content)
+        cls._icons[url] = icon
+        cls._size += len(icon.content)
+        while cls._size > plugin_config.preference.award_icon_cache_size and len(cls._icons) > 1:
+            _, evicted = cls._icons.popitem(last=False)
+            cls._size -= len(evicted.content)
+
+    @classmethod
+    async def _load(cls, url: str) -> Optional[AwardIcon]:
+        """
+        从磁盘缓存读取图片，没有缓存则下载并写入磁盘缓存
+        """
+        cache_dir = plugin_config.preference.award_icon_cache_path
+        cache_path = cache_dir / hashlib.sha256(url.encode()).hexdigest() if cache_dir else None
+        if cache_path and cache_path.is_file():
+            try:
+                return AwardIcon.from_bytes(cache_path.read_bytes())
+            except OSError:
+                logger.exception(f"{plugin_config.preference.log_head}读取签到奖励图片缓存失败: {url}")
+
+        content = await get_file(url)
+        if content is None:
+            return None
+        if cache_path:
+            try:
+                atomic_write(cache_path, content)
+            except OSError:
+                logger.exception(f"{plugin_config.preference.log_head}写入签到奖励图片缓存失败: {url}")
+        return AwardIcon.from_bytes(content)
+
+    @classmethod
+    async def get(cls, url: str) -> Optional[AwardIcon]:
+        """
+        获取签到奖励图片，若返回 ``None`` 说明下载失败
+
+        :param url: 图片URL
+        """
+        if (icon := cls._icons.get(url)) is not None:
+            cls._icons.move_to_end(url)
+            return icon
+        icon, shared = await cls._flight.do(url, lambda: cls._load(url))
+        if icon is not None and not shared:
+            cls._put(url, icon)
+        return icon
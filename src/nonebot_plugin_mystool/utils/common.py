@@ -1,18 +1,19 @@
+import asyncio
 import hashlib
 import io
 import json
 import os
 import random
 import string
+import threading
 import time
 import uuid
 from copy import deepcopy
 from pathlib import Path
 from typing import (Dict, Literal,
-                    Union, Optional, Tuple, Iterable, List)
+                    Union, Optional, Tuple, Iterable, FrozenSet, Hashable, Callable, Awaitable, TypeVar)
 from urllib.parse import urlencode
 
-import httpx
 import nonebot.log
 import nonebot.plugin
 import tenacity
@@ -37,14 +38,15 @@ from nonebot.log import logger
 from nonebot.log import logger
 from qrcode import QRCode
 
-from ..model import GeetestResult, PluginDataManager, Preference, plugin_config, plugin_env, UserData
+from ..model import GeetestResult, PluginDataManager, Preference, plugin_config, plugin_env, UserData, json_loads
+from .http_client import HttpClientManager, CircuitOpenError
 
 __all__ = ["GeneralMessageEvent", "GeneralPrivateMessageEvent", "GeneralGroupMessageEvent", "CommandBegin",
            "get_last_command_sep", "COMMAND_BEGIN", "set_logger", "logger", "PLUGIN", "custom_attempt_times",
            "get_async_retry", "generate_device_id", "cookie_str_to_dict", "cookie_dict_to_str", "generate_ds",
            "get_validate", "generate_seed_id", "generate_fp_locally", "get_file", "blur_phone", "generate_qr_img",
            "send_private_msg", "get_unique_users", "get_all_bind", "read_blacklist", "read_whitelist",
-           "read_admin_list"]
+           "read_admin_list", "SingleFlight"]
 
 # 启用 nonebot-plugin-send-anything-anywhere 的自动选择 Bot 功能
 enable_auto_select_bot()
@@ -136,19 +138,79 @@ def custom_attempt_times(retry: bool):
         return tenacity.stop_after_attempt(1)
 
 
+def stop_if_circuit_open(retry_state: tenacity.RetryCallState) -> bool:
+    """
+    接口已熔断时停止重试
+    """
+    return retry_state.outcome is not None and isinstance(retry_state.outcome.exception(), CircuitOpenError)
+
+
 def get_async_retry(retry: bool):
     """
     获取异步重试装饰器
 
-    :param retry: True - 重试次数达到偏好设置中 max_retry_times 时停止; False - 执行次数达到1时停止，即不进行重试
+    :param retry: True - 重试次数达到偏好设置中 max_retry_times 时停止; False - 执行次数达到1时停止，即不进行重试；
+        接口已熔断时也会直接停止
     """
     return tenacity.AsyncRetrying(
-        stop=custom_attempt_times(retry),
+        stop=custom_attempt_times(retry) | stop_if_circuit_open,
         retry=tenacity.retry_if_exception_type(BaseException),
-        wait=tenacity.wait_fixed(plugin_config.preference.retry_interval),
+        wait=tenacity.wait_exponential_jitter(
+            initial=plugin_config.preference.retry_interval,
+            max=plugin_config.preference.retry_max_interval,
+            jitter=plugin_config.preference.retry_interval
+        ),
     )
 
 
+_T = TypeVar("_T")
+
+
+class SingleFlight:
+    """
+    单飞合并：同一个键同时只会有一个请求在进行，其他协程会等待该请求的结果
+
+    正在进行的请求按事件循环区分（生成商品图片时会在其他线程的事件循环中请求），不同事件循环之间不会共享同一个 Future
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[_T]]) -> Tuple[_T, bool]:
+        """
+        执行请求，若当前事件循环中已有相同键的请求在进行，则等待其结果
+
+        :param key: 请求的键
+        :param factory: 发起请求的协程函数
+        :return: (请求结果, 是否为等待其他协程的结果)
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            pending = self._pending.get((loop, key))
+            if pending is None:
+                future = self._pending[(loop, key)] = loop.create_future()
+        if pending is not None:
+            return await asyncio.shield(pending), True
+
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 防止没有其他协程等待时出现 "Future exception was never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._pending.pop((loop, key), None)
+
+
 def generate_device_id() -> str:
     """
     生成随机的x-rpc-device_id
@@ -250,18 +312,26 @@ async def get_validate(gt: str = None, challenge: str = None, retry: bool = True
     for key, value in content.items():
         if isinstance(value, str):
             content[key] = value.format(gt=gt, challenge=challenge)
+    # 打码平台返回错误信息时也视为失败，因此自行记录熔断器的请求结果
+    circuit_breaker = HttpClientManager.get_circuit_breaker(plugin_config.preference.geetest_url)
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.post(
+                circuit_breaker.check()
+                try:
+                    res = await HttpClientManager.post(
                         plugin_config.preference.geetest_url,
                         params=params,
                         json=content,
-                        timeout=60
+                        timeout=60,
+                        circuit_breaker=False
                     )
-                geetest_data = res.json()
-                validate = geetest_data['data']['validate']
+                    geetest_data = json_loads(res.content)
+                    validate = geetest_data['data']['validate']
+                except Exception:
+                    circuit_breaker.record_failure()
+                    raise
+                circuit_breaker.record_success()
                 seccode = geetest_data['data'].get('seccode') or f"{validate}|jordan"
                 logger.debug(f"{plugin_config.preference.log_head}人机验证结果：{geetest_data}")
                 return GeetestResult(validate=validate, seccode=seccode)
@@ -300,8 +370,8 @@ async def get_file(url: str, retry: bool = True):
     try:
         async for attempt in get_async_retry(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(url, timeout=plugin_config.preference.timeout, follow_redirects=True)
+                res = await HttpClientManager.get(url, timeout=plugin_config.preference.timeout, follow_redirects=True,
+                                                  breaker_by_host=True)
                 return res.content
     except tenacity.RetryError:
         logger.exception(f"{plugin_config.preference.log_head}下载文件 - {url} 失败")
@@ -408,53 +478,74 @@ def get_all_bind(user_id: str) -> Iterable[str]:
 
     :return: 绑定该用户的所有用户ID
     """
-    user_id_filter = filter(lambda x: PluginDataManager.plugin_data.user_bind.get(x) == user_id,
-                            PluginDataManager.plugin_data.user_bind)
-    return user_id_filter
+    return PluginDataManager.plugin_data.get_bind_sources(user_id)
+
+
+_user_lists: Dict[Path, Tuple[float, Optional[Tuple[int, int, int]], FrozenSet[str]]] = {}
+"""名单文件路径 -> (上次检查时间, 文件标识 (st_ino, st_mtime_ns, st_size), 名单)"""
 
 
-def _read_user_list(path: Path) -> List[str]:
+def _read_user_list(path: Path) -> FrozenSet[str]:
     """
     从TEXT读取用户名单
 
+    名单缓存在内存中，每隔 ``user_list_check_interval`` 秒检查一次文件的 inode、修改时间和大小，发生变化时才重新读取
+
     :return: 名单中的所有用户ID
     """
     if not path:
-        return []
-    if os.path.isfile(path):
-        with open(path, "r", encoding=plugin_config.preference.encoding) as f:
-            lines = f.readlines()
-        lines = map(lambda x: x.strip(), lines)
-        line_filter = filter(lambda x: x and x != "\n", lines)
-        return list(line_filter)
-    else:
-        logger.error(f"{plugin_config.preference.log_head}黑/白名单文件 {path} 不存在")
-        return []
+        return frozenset()
+    now = time.monotonic()
+    checked_at, file_id, user_list = _user_lists.get(path, (None, None, frozenset()))
+    if checked_at is not None and now - checked_at < plugin_config.preference.user_list_check_interval:
+        return user_list
 
+    try:
+        stat = os.stat(path)
+    except OSError:
+        stat = None
+    new_file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size) if stat else None
+    if checked_at is None or new_file_id != file_id:
+        if new_file_id is None:
+            logger.error(f"{plugin_config.preference.log_head}黑/白名单文件 {path} 不存在")
+            user_list = frozenset()
+        else:
+            try:
+                with open(path, "r", encoding=plugin_config.preference.encoding) as f:
+                    user_list = frozenset(filter(None, map(str.strip, f)))
+            except OSError:
+                logger.exception(f"{plugin_config.preference.log_head}读取黑/白名单文件 {path} 失败")
+                new_file_id = None
+                user_list = frozenset()
+    _user_lists[path] = now, new_file_id, user_list
+    return user_list
 
-def read_blacklist() -> List[str]:
+
+def read_blacklist() -> FrozenSet[str]:
     """
     读取黑名单
 
     :return: 黑名单中的所有用户ID
     """
-    return _read_user_list(plugin_config.preference.blacklist_path) if plugin_config.preference.enable_blacklist else []
+    return _read_user_list(
+        plugin_config.preference.blacklist_path) if plugin_config.preference.enable_blacklist else frozenset()
 
 
-def read_whitelist() -> List[str]:
+def read_whitelist() -> FrozenSet[str]:
     """
     读取白名单
 
     :return: 白名单中的所有用户ID
     """
-    return _read_user_list(plugin_config.preference.whitelist_path) if plugin_config.preference.enable_whitelist else []
+    return _read_user_list(
+        plugin_config.preference.whitelist_path) if plugin_config.preference.enable_whitelist else frozenset()
 
 
-def read_admin_list() -> List[str]:
+def read_admin_list() -> FrozenSet[str]:
     """
     读取白名单
 
     :return: 管理员名单中的所有用户ID
     """
     return _read_user_list(
-        plugin_config.preference.admin_list_path) if plugin_config.preference.enable_admin_list else []
+        plugin_config.preference.admin_list_path) if plugin_config.preference.enable_admin_list else frozenset()
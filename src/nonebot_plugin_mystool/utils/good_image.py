@@ -1,15 +1,17 @@
+import asyncio
+import hashlib
 import io
 import os
 import zipfile
 from multiprocessing import Lock
-from typing import List
+from typing import List, Optional
 
-import httpx
 from PIL import Image, ImageDraw, ImageFont
 
 from ..api.common import get_good_detail
-from ..model import Good, data_path, plugin_config
+from ..model import Good, data_path, plugin_config, atomic_write, json_loads, json_dumps
 from ..utils.common import get_file, logger, get_async_retry
+from ..utils.http_client import HttpClientManager
 
 __all__ = ["game_list_to_image"]
 
@@ -20,6 +22,61 @@ TEMP_FONT_PATH = data_path / "temp" / "font.zip"
 FONT_SAVE_PATH = data_path / "SourceHanSansHWSC-Regular.otf"
 
 
+async def get_icon(url: str, retry: bool = True) -> bytes:
+    """
+    获取商品预览图，优先使用磁盘缓存
+
+    缓存以URL的哈希值命名，同时保存服务器返回的 ETag 和 Last-Modified，
+    再次获取时进行条件请求，图片未变化时服务器只返回 304 而不需要重新下载。
+
+    :param url: 预览图URL
+    :param retry: 是否允许重试
+    """
+    cache_dir = plugin_config.good_list_image_config.ICON_CACHE_PATH
+    key = hashlib.sha256(url.encode()).hexdigest()
+    content_path, meta_path = cache_dir / key, cache_dir / f"{key}.json"
+    cached: Optional[bytes] = None
+    headers = {}
+    if content_path.is_file() and meta_path.is_file():
+        try:
+            cached = content_path.read_bytes()
+            meta = json_loads(meta_path.read_bytes())
+        except (OSError, ValueError):
+            logger.exception(f"{plugin_config.preference.log_head}商品列表图片生成 - 读取预览图缓存失败: {url}")
+            cached = None
+        else:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        async for attempt in get_async_retry(retry):
+            with attempt:
+                res = await HttpClientManager.get(url, headers=headers, timeout=plugin_config.preference.timeout,
+                                                  breaker_by_host=True)
+                if res.status_code != 304:
+                    res.raise_for_status()
+    except Exception:
+        if cached is None:
+            raise
+        logger.warning(f"{plugin_config.preference.log_head}商品列表图片生成 - 预览图请求失败，使用缓存: {url}")
+        return cached
+
+    if res.status_code == 304 and cached is not None:
+        return cached
+    try:
+        atomic_write(content_path, res.content)
+        atomic_write(meta_path, json_dumps({
+            "url": url,
+            "etag": res.headers.get("ETag"),
+            "last_modified": res.headers.get("Last-Modified")
+        }))
+    except OSError:
+        logger.exception(f"{plugin_config.preference.log_head}商品列表图片生成 - 写入预览图缓存失败: {url}")
+    return res.content
+
+
 async def game_list_to_image(good_list: List[Good], lock: Lock = None, retry: bool = True):
     """
     将商品信息列表转换为图片数据，若返回`None`说明生成失败
@@ -82,13 +139,16 @@ async def game_list_to_image(good_list: List[Good], lock: Lock = None, retry: bo
         imgs: List[Image.Image] = []
         '''商品预览图'''
 
-        for good in good_list:
-            await get_good_detail(good)
-            async for attempt in get_async_retry(retry):
-                with attempt:
-                    async with httpx.AsyncClient() as client:
-                        icon = await client.get(good.icon, timeout=plugin_config.preference.timeout)
-            img = Image.open(io.BytesIO(icon.content))
+        semaphore = asyncio.Semaphore(plugin_config.good_list_image_config.ICON_FETCH_CONCURRENCY)
+
+        async def fetch_icon(_good: Good):
+            async with semaphore:
+                await get_good_detail(_good)
+                return await get_icon(_good.icon, retry)
+
+        icons = await asyncio.gather(*map(fetch_icon, good_list))
+        for icon in icons:
+            img = Image.open(io.BytesIO(icon))
             # 调整预览图大小
             img = img.resize(plugin_config.good_list_image_config.ICON_SIZE)
             # 记录预览图粘贴位置
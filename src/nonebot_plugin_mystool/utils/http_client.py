@@ -0,0 +1,413 @@
+import asyncio
+import threading
+import time
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Dict, Optional, Union, Literal
+from weakref import WeakKeyDictionary
+
+import httpx
+from nonebot.log import logger
+
+from ..model import plugin_config
+
+__all__ = ["RateLimiter", "CircuitOpenError", "CircuitBreaker", "HttpClientManager"]
+
+
+class _DiscardCookiePolicy(DefaultCookiePolicy):
+    """
+    不保存任何服务器返回的Cookie的策略
+
+    共享的连接池会被所有账号使用，如果保存了 Set-Cookie，就会把一个账号的Cookie带到另一个账号的请求中
+    """
+
+    def set_ok(self, cookie, request):
+        return False
+
+
+class RateLimiter:
+    """
+    令牌桶限速器
+
+    令牌以 ``rate`` 个/秒的速度补充，最多积攒 ``capacity`` 个，每次请求消耗一个令牌，没有令牌时等待。
+
+    速率按 AIMD 方式自适应：遇到限流时乘以 ``decrease_factor``（不低于设置速率的 1/10），
+    请求成功时增加 ``increase``（不超过设置的速率）
+
+    令牌状态由线程锁保护，不与任何事件循环绑定，可以在多个线程的事件循环中共享
+    """
+
+    def __init__(self, rate: float, capacity: float = 1, decrease_factor: float = 1, increase: float = 0):
+        """
+        :param rate: 每秒补充的令牌数，小于等于0则不限速
+        :param capacity: 令牌桶容量，即允许的突发请求数
+        :param decrease_factor: 遇到限流时速率乘以的系数
+        :param increase: 请求成功时速率增加的值
+        """
+        self.max_rate = rate
+        """设置的速率，即自适应调整的上限"""
+        self.rate = rate
+        """当前速率"""
+        self.capacity = max(capacity, 1)
+        self.decrease_factor = decrease_factor
+        self.increase = increase
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """
+        获取一个令牌，没有令牌时等待补充
+        """
+        if self.rate <= 0:
+            return
+        # 令牌不足时预支令牌（令牌数为负），并计算需要等待的时间，等待的请求按先来后到的顺序获得令牌
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        """
+        请求成功，加性增加速率
+        """
+        if self.max_rate > 0 and self.rate < self.max_rate:
+            with self._lock:
+                self._refill()
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttled(self):
+        """
+        遇到限流，乘性降低速率，并清空已积攒的令牌
+        """
+        if self.max_rate > 0:
+            with self._lock:
+                self._refill()
+                self.rate = max(self.max_rate / 10, self.rate * self.decrease_factor)
+                self._tokens = min(self._tokens, 0)
+
+
+class CircuitOpenError(Exception):
+    """
+    熔断器处于打开状态，请求被直接拒绝
+    """
+
+    def __init__(self, endpoint: str, retry_after: float):
+        """
+        :param endpoint: 接口
+        :param retry_after: 距离允许重新尝试请求的秒数
+        """
+        super().__init__(f"接口 {endpoint} 已熔断，{retry_after:.0f} 秒后重试")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    接口熔断器
+
+    - 关闭(closed)：正常请求，连续失败达到 ``failure_threshold`` 次后打开
+    - 打开(open)：直接拒绝请求，经过 ``reset_timeout`` 秒后进入半开状态
+    - 半开(half_open)：只放行一个试探请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, endpoint: str, failure_threshold: int, reset_timeout: float):
+        """
+        :param endpoint: 接口
+        :param failure_threshold: 打开熔断器所需的连续失败次数
+        :param reset_timeout: 打开后经过多久允许试探请求（单位：秒）
+        """
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        """连续失败次数"""
+        self.opened_at: Optional[float] = None
+        """熔断器打开的时间"""
+        self.trial_at: Optional[float] = None
+        """半开状态下试探请求的开始时间"""
+        self._lock = threading.Lock()
+        """商品图片生成会在其他线程中发送请求，状态变更需要加锁"""
+
+    @property
+    def state(self) -> Literal["closed", "open", "half_open"]:
+        """
+        熔断器状态
+        """
+        if self.opened_at is None:
+            return "closed"
+        elif time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        else:
+            return "half_open"
+
+    def check(self):
+        """
+        检查是否允许请求，不允许时抛出 ``CircuitOpenError``
+
+        :raise CircuitOpenError
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed" or self.failure_threshold <= 0:
+                return
+            now = time.monotonic()
+            if state == "half_open":
+                # 试探请求被取消等情况下不会有结果，超时后允许新的试探请求
+                if self.trial_at is None or now - self.trial_at >= self.reset_timeout:
+                    self.trial_at = now
+                    return
+                raise CircuitOpenError(self.endpoint, self.trial_at + self.reset_timeout - now)
+            raise CircuitOpenError(self.endpoint, self.opened_at + self.reset_timeout - now)
+
+    def record_success(self):
+        """
+        记录请求成功，关闭熔断器
+        """
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"{plugin_config.preference.log_head}接口 {self.endpoint} 已恢复，熔断器关闭")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_at = None
+
+    def record_failure(self):
+        """
+        记录请求失败，连续失败次数达到阈值或试探请求失败时打开熔断器
+        """
+        with self._lock:
+            self.failures += 1
+            if self.failure_threshold <= 0:
+                return
+            if self.state == "half_open" or (self.opened_at is None and self.failures >= self.failure_threshold):
+                logger.warning(f"{plugin_config.preference.log_head}接口 {self.endpoint} 连续失败 {self.failures} 次，"
+                               f"熔断 {self.reset_timeout:.0f} 秒")
+                self.opened_at = time.monotonic()
+                self.trial_at = None
+
+
+class HttpClientManager:
+    """
+    进程内共享的 ``httpx.AsyncClient`` 管理器
+
+    按 Host 维护长连接池，避免每次请求都重新进行 TCP + TLS 握手。
+    由于 ``httpx.AsyncClient`` 的连接与事件循环绑定（如商品图片生成会在其他线程中创建新的事件循环），
+    因此连接池按事件循环分别保存。
+    """
+    _clients: "WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = WeakKeyDictionary()
+    """事件循环 -> {Host: AsyncClient}"""
+    _semaphores: "WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = WeakKeyDictionary()
+    """事件循环 -> {Host: 限制同时请求数的信号量}"""
+    _rate_limiters: Dict[str, RateLimiter] = {}
+    """Host -> 限速器"""
+    circuit_breakers: Dict[str, CircuitBreaker] = {}
+    """接口（或 Host） -> 熔断器"""
+
+    @classmethod
+    def _new_client(cls) -> httpx.AsyncClient:
+        """
+        按照偏好设置创建新的 ``httpx.AsyncClient``
+        """
+        preference = plugin_config.preference
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=preference.max_connections,
+                max_keepalive_connections=preference.max_keepalive_connections,
+                keepalive_expiry=preference.keepalive_expiry
+            ),
+            cookies=CookieJar(policy=_DiscardCookiePolicy()),
+            timeout=preference.timeout
+        )
+
+    @classmethod
+    def get_client(cls, url: Union[str, httpx.URL]) -> httpx.AsyncClient:
+        """
+        获取目标URL对应Host的共享 ``httpx.AsyncClient``
+
+        :param url: 请求的URL
+        """
+        loop = asyncio.get_running_loop()
+        host = httpx.URL(url).host
+        clients = cls._clients.setdefault(loop, {})
+        client = clients.get(host)
+        if client is None or client.is_closed:
+            client = clients[host] = cls._new_client()
+        return client
+
+    @classmethod
+    def get_semaphore(cls, url: Union[str, httpx.URL]) -> asyncio.Semaphore:
+        """
+        获取目标URL对应Host的并发请求信号量
+
+        :param url: 请求的URL
+        """
+        loop = asyncio.get_running_loop()
+        host = httpx.URL(url).host
+        semaphores = cls._semaphores.setdefault(loop, {})
+        semaphore = semaphores.get(host)
+        if semaphore is None:
+            semaphore = semaphores[host] = asyncio.Semaphore(plugin_config.preference.host_concurrency)
+        return semaphore
+
+    @classmethod
+    def get_rate_limiter(cls, url: Union[str, httpx.URL]) -> RateLimiter:
+        """
+        获取目标URL对应Host的限速器
+
+        :param url: 请求的URL
+        """
+        host = httpx.URL(url).host
+        rate_limiter = cls._rate_limiters.get(host)
+        if rate_limiter is None:
+            preference = plugin_config.preference
+            # 可能同时在多个线程中创建，以先放入的为准
+            rate_limiter = cls._rate_limiters.setdefault(host, RateLimiter(
+                preference.host_rate_limits.get(host, preference.host_rate_limit),
+                preference.host_rate_burst,
+                preference.host_rate_decrease_factor,
+                preference.host_rate_increase
+            ))
+        return rate_limiter
+
+    @classmethod
+    def get_circuit_breaker(cls, url: Union[str, httpx.URL], by_host: bool = False) -> CircuitBreaker:
+        """
+        获取目标URL对应接口（Host + 路径，不包括查询参数）的熔断器
+
+        :param url: 请求的URL
+        :param by_host: 是否按 Host 获取熔断器。下载文件、图片等请求的路径各不相同，按路径区分会不断创建新的熔断器
+        """
+        url = httpx.URL(url)
+        endpoint = url.host if by_host else f"{url.host}{url.path}"
+        circuit_breaker = cls.circuit_breakers.get(endpoint)
+        if circuit_breaker is None:
+            preference = plugin_config.preference
+            # 可能同时在多个线程中创建，以先放入的为准
+            circuit_breaker = cls.circuit_breakers.setdefault(endpoint, CircuitBreaker(
+                endpoint,
+                preference.circuit_breaker_threshold,
+                preference.circuit_breaker_reset_timeout
+            ))
+        return circuit_breaker
+
+    @classmethod
+    def report_throttled(cls, url: Union[str, httpx.URL]):
+        """
+        报告目标URL对应的Host出现了限流（如返回了人机验证），降低该Host的请求速率
+
+        HTTP 429 会在发送请求时自动处理，不需要调用
+
+        :param url: 请求的URL
+        """
+        rate_limiter = cls.get_rate_limiter(url)
+        rate_limiter.on_throttled()
+        logger.warning(f"{plugin_config.preference.log_head}{httpx.URL(url).host} 出现限流，"
+                       f"请求速率降低至 {rate_limiter.rate:.2f} 次/秒")
+
+    @classmethod
+    def build_request(cls, method: str, url: str, **kwargs) -> httpx.Request:
+        """
+        预先构建请求，参数与 ``httpx.AsyncClient.build_request`` 相同。构建出的请求可以通过 ``send`` 多次发送
+
+        单次请求的Cookie只会作用于本次请求，不会写入共享的 Cookie Jar
+
+        :param method: 请求方法
+        :param url: 请求的URL
+        """
+        return cls.get_client(url).build_request(method, url, **kwargs)
+
+    @classmethod
+    async def send(
+            cls,
+            request: httpx.Request,
+            rate_limit: bool = True,
+            circuit_breaker: bool = True,
+            breaker_by_host: bool = False,
+            **kwargs
+    ) -> httpx.Response:
+        """
+        使用共享连接池发送已构建的请求，参数与 ``httpx.AsyncClient.send`` 相同
+
+        :param request: 已构建的请求
+        :param rate_limit: 是否按Host限速并限制同时请求数（对时间敏感的请求，如商品兑换，应关闭）
+        :param circuit_breaker: 是否使用接口熔断器（网络错误、HTTP 5xx 视为失败），关闭后可由调用方自行判断请求结果
+        :param breaker_by_host: 是否按 Host 而不是接口使用熔断器（用于下载文件、图片等路径不固定的请求）
+        :raise CircuitOpenError: 接口已熔断
+        """
+        client = cls.get_client(request.url)
+        kwargs.setdefault("follow_redirects", client.follow_redirects)
+        breaker = cls.get_circuit_breaker(request.url, breaker_by_host) if circuit_breaker else None
+        if breaker:
+            breaker.check()
+        rate_limiter = cls.get_rate_limiter(request.url) if rate_limit else None
+        if rate_limiter:
+            await rate_limiter.acquire()
+        try:
+            if rate_limit:
+                async with cls.get_semaphore(request.url):
+                    response = await client.send(request, **kwargs)
+            else:
+                # 对时间敏感的请求不能排队等待其他请求完成
+                response = await client.send(request, **kwargs)
+        except httpx.TransportError:
+            if breaker:
+                breaker.record_failure()
+            raise
+        if breaker:
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        if rate_limiter:
+            if response.status_code == 429:
+                cls.report_throttled(request.url)
+            elif response.is_success:
+                rate_limiter.on_success()
+        return response
+
+    @classmethod
+    async def request(cls, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        使用共享连接池发送请求，参数与 ``httpx.AsyncClient.request`` 相同
+
+        :param method: 请求方法
+        :param url: 请求的URL
+        """
+        send_kwargs = {
+            key: kwargs.pop(key) for key in ("follow_redirects", "rate_limit", "circuit_breaker", "breaker_by_host")
+            if key in kwargs
+        }
+        return await cls.send(cls.build_request(method, url, **kwargs), **send_kwargs)
+
+    @classmethod
+    async def get(cls, url: str, **kwargs) -> httpx.Response:
+        """
+        使用共享连接池发送 GET 请求
+        """
+        return await cls.request("GET", url, **kwargs)
+
+    @classmethod
+    async def post(cls, url: str, **kwargs) -> httpx.Response:
+        """
+        使用共享连接池发送 POST 请求
+        """
+        return await cls.request("POST", url, **kwargs)
+
+    @classmethod
+    async def close_all(cls, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """
+        关闭事件循环下的所有连接池，一般在机器人关闭时调用
+
+        :param loop: 事件循环，为空则为当前事件循环
+        """
+        loop = loop or asyncio.get_running_loop()
+        cls._semaphores.pop(loop, None)
+        clients = cls._clients.pop(loop, {})
+        for client in clients.values():
+            await client.aclose()
@@ -0,0 +1,410 @@
+import asyncio
+import base64
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union, NamedTuple, Any, Set
+
+import nonebot
+from nonebot import Adapter, Bot
+from nonebot_plugin_saa import MessageSegmentFactory, MessageFactory, AggregatedMessageFactory, Text, Image
+
+from ..model import plugin_config, atomic_write, json_dumps, json_loads
+from .common import logger, send_private_msg
+from .http_client import RateLimiter
+
+__all__ = ["NotificationOutbox", "NotificationBatch"]
+
+Message = Union[str, MessageSegmentFactory, MessageFactory, AggregatedMessageFactory]
+
+
+class _OutboxItem(NamedTuple):
+    """
+    发件箱中的一条通知
+    """
+    item_id: str
+    """通知ID，也是保存的文件名"""
+    bot_id: Optional[str]
+    """发送使用的 Bot ID，为None则等待任意 Bot 连接后发送"""
+    user_id: str
+    """目标用户ID"""
+    message: Message
+    """消息内容"""
+    attempts: int = 0
+    """已尝试发送的次数"""
+
+
+def _dump_message(message: Message, keep_image: bool = True) -> List[List[Dict[str, Any]]]:
+    """
+    将消息转换为可以保存为JSON的数据，每个子列表为一条消息
+
+    :param message: 消息内容
+    :param keep_image: 是否保存图片数据（死信文件中只需要记录文字）
+    """
+    if isinstance(message, AggregatedMessageFactory):
+        factories = message.message_factories
+    elif isinstance(message, MessageFactory):
+        factories = [message]
+    elif isinstance(message, MessageSegmentFactory):
+        factories = [[message]]
+    else:
+        factories = [[Text(str(message))]]
+
+    dumped = []
+    for factory in factories:
+        segments = []
+        for segment in factory:
+            if isinstance(segment, Text):
+                segments.append({"type": "text", "text": segment.data["text"]})
+            elif isinstance(segment, Image):
+                image = segment.data["image"]
+                segment_data = {"type": "image"}
+                if keep_image:
+                    if isinstance(image, bytes):
+                        segment_data["base64"] = base64.b64encode(image).decode()
+                    else:
+                        segment_data["url"] = str(image)
+                segments.append(segment_data)
+        dumped.append(segments)
+    return dumped
+
+
+def _load_message(dumped: List[List[Dict[str, Any]]]) -> Message:
+    """
+    从 ``_dump_message`` 保存的数据还原消息
+    """
+    factories = []
+    for segments in dumped:
+        factory = MessageFactory([])
+        for segment in segments:
+            if segment["type"] == "text":
+                factory.append(Text(segment["text"]))
+            elif "base64" in segment:
+                factory.append(Image(base64.b64decode(segment["base64"])))
+            elif "url" in segment:
+                factory.append(Image(segment["url"]))
+        factories.append(factory)
+    return factories[0] if len(factories) == 1 else AggregatedMessageFactory(factories)
+
+
+class NotificationOutbox:
+    """
+    异步通知发件箱
+
+    通知放入发件箱后立即返回，由后台任务发送，签到等任务不需要等待消息发送完成。
+    每个目标用户（Bot + 用户ID）有各自的发送队列，按 ``notice_rate_limit`` 限速，一个用户的限速或重试不会阻塞其他用户。
+    发送失败时重试，多次失败后写入死信文件。
+
+    每条通知放入发件箱时即保存到 ``notice_outbox_path`` 目录下，发送成功后才删除，即使进程崩溃也不会丢失。
+    没有可用的 Bot 时，通知会保存到有 Bot 连接后再发送。
+    """
+    _queues: Dict[Tuple[str, str], "asyncio.Queue[_OutboxItem]"] = {}
+    """(Bot ID, 用户ID) -> 待发送的通知"""
+    _workers: Dict[Tuple[str, str], asyncio.Task] = {}
+    """(Bot ID, 用户ID) -> 发送通知的后台任务"""
+    _rate_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+    """(Bot ID, 用户ID) -> 限速器"""
+    _retrying: Dict[asyncio.TimerHandle, _OutboxItem] = {}
+    """等待重试的通知"""
+    _active: Set[str] = set()
+    """已在内存中（等待发送、正在发送或等待重试）的通知ID，恢复时跳过"""
+
+    @classmethod
+    def _select_bot(cls, use: Union[Bot, Adapter, None]) -> Optional[Bot]:
+        """
+        选择发送通知使用的 Bot，与 ``send_private_msg`` 相同，使用第一个符合条件的 Bot
+        """
+        if isinstance(use, Bot):
+            return use
+        elif isinstance(use, Adapter):
+            return next(iter(use.bots.values()), None)
+        else:
+            return next(iter(nonebot.get_bots().values()), None)
+
+    @classmethod
+    def _item_path(cls, item_id: str) -> Path:
+        return plugin_config.preference.notice_outbox_path / f"{item_id}.json"
+
+    @classmethod
+    def _save(cls, item: _OutboxItem):
+        """
+        保存通知，写入失败时只记录日志，通知仍会发送
+        """
+        try:
+            atomic_write(cls._item_path(item.item_id), json_dumps({
+                "bot_id": item.bot_id,
+                "user_id": item.user_id,
+                "attempts": item.attempts,
+                "message": _dump_message(item.message)
+            }))
+        except OSError:
+            logger.exception(f"{plugin_config.preference.log_head}保存通知失败")
+
+    @classmethod
+    def _remove(cls, item: _OutboxItem):
+        """
+        删除已发送（或已写入死信文件）的通知
+        """
+        cls._active.discard(item.item_id)
+        try:
+            cls._item_path(item.item_id).unlink(missing_ok=True)
+        except OSError:
+            logger.exception(f"{plugin_config.preference.log_head}删除已发送的通知失败")
+
+    @classmethod
+    def _put(cls, item: _OutboxItem):
+        """
+        放入目标用户的发送队列，并确保该队列的后台任务在运行
+        """
+        target = item.bot_id, item.user_id
+        cls._active.add(item.item_id)
+        cls._queues.setdefault(target, asyncio.Queue()).put_nowait(item)
+        worker = cls._workers.get(target)
+        if worker is None or worker.done():
+            cls._workers[target] = asyncio.create_task(cls._worker(target))
+
+    @classmethod
+    def enqueue(cls, user_id: str, message: Message, use: Union[Bot, Adapter] = None):
+        """
+        将通知保存并放入发件箱，不等待发送
+
+        :param user_id: 目标用户ID
+        :param message: 消息内容
+        :param use: 使用的Bot或Adapter，为None则使用任意Bot
+        """
+        bot = cls._select_bot(use)
+        item = _OutboxItem(uuid.uuid4().hex, bot.self_id if bot else None, user_id, message)
+        cls._save(item)
+        if bot is None:
+            logger.info(f"{plugin_config.preference.log_head}暂无可用的Bot，发送给用户 {user_id} 的通知将在 Bot 连接后发送")
+        else:
+            cls._put(item)
+
+    @classmethod
+    def _get_rate_limiter(cls, target: Tuple[str, str]) -> RateLimiter:
+        rate_limiter = cls._rate_limiters.get(target)
+        if rate_limiter is None:
+            rate_limiter = cls._rate_limiters[target] = RateLimiter(plugin_config.preference.notice_rate_limit)
+        return rate_limiter
+
+    @classmethod
+    async def _worker(cls, target: Tuple[str, str]):
+        """
+        依次发送某个目标用户队列中的通知，队列为空时退出
+        """
+        queue = cls._queues[target]
+        while not queue.empty():
+            item = queue.get_nowait()
+            try:
+                await cls._get_rate_limiter(target).acquire()
+                await cls._deliver(item)
+            except Exception as e:
+                logger.exception(f"{plugin_config.preference.log_head}发送通知时出现异常")
+                cls._dead_letter(item, repr(e))
+        cls._queues.pop(target, None)
+        cls._workers.pop(target, None)
+
+    @classmethod
+    async def _deliver(cls, item: _OutboxItem):
+        """
+        发送一条通知，失败时按指数退避重新放回队列，超过最大重试次数后写入死信文件
+        """
+        bot = nonebot.get_bots().get(item.bot_id)
+        if bot is None:
+            # 保留已保存的通知，Bot 重新连接后恢复发送
+            cls._active.discard(item.item_id)
+            logger.warning(f"{plugin_config.preference.log_head}Bot {item.bot_id} 未连接，"
+                           f"发送给用户 {item.user_id} 的通知将在其重新连接后发送")
+            return
+        success, action_failed = await send_private_msg(item.user_id, item.message, use=bot)
+        if success:
+            cls._remove(item)
+            return
+        error = repr(action_failed) if action_failed else "发送失败"
+
+        item = item._replace(attempts=item.attempts + 1)
+        if item.attempts > plugin_config.preference.notice_max_retry:
+            cls._dead_letter(item, error)
+            return
+        cls._save(item)
+        logger.warning(f"{plugin_config.preference.log_head}向用户 {item.user_id} 发送通知失败（{error}），"
+                       f"将进行第 {item.attempts} 次重试")
+        delay = plugin_config.preference.retry_interval * 2 ** (item.attempts - 1)
+        handle = asyncio.get_running_loop().call_later(delay, cls._retry, item)
+        cls._retrying[handle] = item
+
+    @classmethod
+    def _retry(cls, item: _OutboxItem):
+        cls._retrying = {handle: value for handle, value in cls._retrying.items() if value is not item}
+        cls._put(item)
+
+    @classmethod
+    def _dead_letter(cls, item: _OutboxItem, error: str):
+        """
+        记录无法发送的通知，并从发件箱中删除
+        """
+        logger.error(f"{plugin_config.preference.log_head}向用户 {item.user_id} 发送通知失败，已写入死信文件："
+                     f"{plugin_config.preference.notice_dead_letter_path}")
+        record = {
+            "time": time.time(),
+            "bot_id": item.bot_id,
+            "user_id": item.user_id,
+            "error": error,
+            "message": _dump_message(item.message, keep_image=False)
+        }
+        try:
+            path = plugin_config.preference.notice_dead_letter_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json_dumps(record) + "\n")
+        except OSError:
+            logger.exception(f"{plugin_config.preference.log_head}写入通知死信文件失败")
+        cls._remove(item)
+
+    @classmethod
+    async def close(cls):
+        """
+        停止后台任务，一般在机器人关闭时调用。未发送的通知已经保存，下次 Bot 连接时会恢复发送
+        """
+        for worker in cls._workers.values():
+            worker.cancel()
+        for handle in cls._retrying:
+            handle.cancel()
+        cls._workers.clear()
+        cls._retrying.clear()
+        cls._queues.clear()
+        cls._active.clear()
+
+    @classmethod
+    async def restore(cls, bot: Bot):
+        """
+        恢复之前保存的、由该 Bot 发送或未指定 Bot 的通知，在 Bot 连接时调用
+
+        :param bot: 连接的 Bot
+        """
+        outbox_path = plugin_config.preference.notice_outbox_path
+        if not outbox_path.is_dir():
+            return
+        saved = []
+        for path in outbox_path.glob("*.json"):
+            try:
+                saved.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        restored = 0
+        # 按保存的先后顺序恢复
+        for _, path in sorted(saved):
+            item_id = path.stem
+            if item_id in cls._active:
+                continue
+            try:
+                record = json_loads(path.read_bytes())
+            except (OSError, ValueError):
+                logger.exception(f"{plugin_config.preference.log_head}读取未发送的通知 {path} 失败")
+                continue
+            if record["bot_id"] not in (None, bot.self_id):
+                continue
+            item = _OutboxItem(item_id, bot.self_id, record["user_id"], _load_message(record["message"]),
+                               record["attempts"])
+            if record["bot_id"] is None:
+                cls._save(item)
+            cls._put(item)
+            restored += 1
+        if restored:
+            logger.info(f"{plugin_config.preference.log_head}已恢复 {restored} 条未发送的通知")
+
+
+class NotificationBatch:
+    """
+    一次任务中产生的通知，发送给同一用户的多条消息会合并为一条 ``AggregatedMessageFactory``（仅限支持合并转发的适配器）
+
+    摘要模式下，只保留消息中的文字，按分区整理为一份报告，每个用户只发送一条消息
+    """
+
+    def __init__(self, digest: bool = False, title: str = "📋任务结果摘要"):
+        """
+        :param digest: 是否使用摘要模式
+        :param title: 摘要报告的标题
+        """
+        self.digest = digest
+        """是否使用摘要模式"""
+        self.title = title
+        """摘要报告的标题"""
+        self._section: Optional[str] = None
+        self._messages: Dict[Tuple[str, Optional[Bot]], List[Message]] = {}
+        self._digests: Dict[str, Dict[Optional[str], List[str]]] = {}
+
+    def section(self, name: Optional[str]):
+        """
+        设置之后添加的通知在摘要报告中所属的分区
+
+        :param name: 分区名称，为None则不显示分区标题
+        """
+        self._section = name
+
+    def add(self, user_id: str, message: Message, use: Union[Bot, Adapter] = None):
+        """
+        添加一条通知
+
+        :param user_id: 目标用户ID
+        :param message: 消息内容
+        :param use: 使用的Bot或Adapter，为None则使用任意Bot（摘要模式下忽略）
+        """
+        if not self.digest:
+            # 先确定实际使用的 Bot，指定了 Adapter 和未指定的消息在只有一个 Bot 时可以合并，并保持添加的顺序
+            bot = NotificationOutbox._select_bot(use)
+            self._messages.setdefault((user_id, bot), []).append(message)
+            return
+        text = "\n".join(
+            "".join(segment["text"] for segment in segments if segment["type"] == "text")
+            for segments in _dump_message(message, keep_image=False)
+        ).strip()
+        lines = self._digests.setdefault(user_id, {}).setdefault(self._section, [])
+        # 同一条通知可能通过不同的 Adapter 重复添加
+        if text and text not in lines:
+            lines.append(text)
+
+    def render(self, user_id: str) -> str:
+        """
+        生成某个用户的摘要报告
+
+        :param user_id: 目标用户ID
+        """
+        blocks = [self.title]
+        for section, lines in self._digests.get(user_id, {}).items():
+            if not lines:
+                continue
+            block = "\n\n".join(lines)
+            blocks.append(f"【{section}】\n{block}" if section else block)
+        return "\n\n".join(blocks)
+
+    @staticmethod
+    def _supports_aggregation(bot: Optional[Bot]) -> bool:
+        """
+        Bot 所属的适配器是否支持发送合并转发消息，未确定 Bot 时视为不支持
+
+        :param bot: 发送使用的 Bot
+        """
+        return bot is not None and bot.adapter.get_name() in AggregatedMessageFactory.sender
+
+    def flush(self):
+        """
+        将合并后的通知放入发件箱，支持合并转发的适配器会将发送给同一用户的多条消息合并为一条
+        """
+        for user_id, sections in self._digests.items():
+            if any(sections.values()):
+                NotificationOutbox.enqueue(user_id, self.render(user_id))
+        for (user_id, bot), messages in self._messages.items():
+            if len(messages) > 1 and self._supports_aggregation(bot):
+                NotificationOutbox.enqueue(
+                    user_id,
+                    AggregatedMessageFactory([Text(message) if isinstance(message, str) else message
+                                              for message in messages]),
+                    bot
+                )
+            else:
+                # 不支持合并转发的适配器会逐条发送合并消息，重试时已发送的消息会重复，因此分开放入发件箱
+                for message in messages:
+                    NotificationOutbox.enqueue(user_id, message, bot)
+        self._digests.clear()
+        self._messages.clear()